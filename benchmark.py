@@ -0,0 +1,425 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+import cv2
+import numpy as np
+
+#---------------------------------
+# Synthetic clip generation
+def generate_synthetic_video(video_path, width=1280, height=720, fps=30, num_frames=600):
+    # Noisy background with a few moving shapes so the decoder and the model both have real work to do
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+    video_writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for frame_num in range(num_frames):
+        frame = np.roll(background, frame_num * 4, axis=1)
+        x = (frame_num * 7) % max(width - 120, 1)
+        cv2.rectangle(frame, (x, height // 3), (x + 120, height // 3 + 90), (0, 0, 255), -1)
+        cv2.circle(frame, (width - x - 60, 2 * height // 3), 45, (0, 255, 0), -1)
+        video_writer.write(frame)
+    video_writer.release()
+    return video_path
+
+#---------------------------------
+# Batched inference benchmark
+def run_inference_timed(inference, video_path, output_dir):
+    inference.output_dir = output_dir
+    start = time.perf_counter()
+    inference.main(video_path, 0, input_directory=os.path.dirname(video_path))
+    return time.perf_counter() - start
+
+def benchmark_batch_sizes(args):
+    import inference
+
+    work_dir = tempfile.mkdtemp(prefix="vodetect-bench-")
+    try:
+        video_path = generate_synthetic_video(os.path.join(work_dir, "synthetic.mp4"), args.width, args.height, args.fps, args.frames)
+        original_batch_size = inference.batch_size
+        original_detection_cache = inference.enable_detection_cache
+        # Hashing the video and writing the detection cache is fixed I/O that has nothing to do with batching
+        inference.enable_detection_cache = False
+        timings = []
+        for batch_size in args.batch_sizes:
+            inference.batch_size = batch_size
+            elapsed = run_inference_timed(inference, video_path, os.path.join(work_dir, f"output-{batch_size}"))
+            timings.append((batch_size, elapsed))
+        inference.batch_size = original_batch_size
+        inference.enable_detection_cache = original_detection_cache
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sampled_frames = (args.frames + inference.frame_check_interval - 1) // inference.frame_check_interval
+    baseline = timings[0][1]
+    print(f"\n==== Batched inference ({args.width}x{args.height}, {args.frames} frames, interval {inference.frame_check_interval}) ====")
+    for batch_size, elapsed in timings:
+        print(f" - batch_size {batch_size:>3}: {elapsed:7.2f} s, {args.frames / elapsed:8.1f} frames/s, "
+              f"{sampled_frames / elapsed:7.1f} model frames/s, speedup {baseline / elapsed:.2f}x")
+
+#---------------------------------
+# Frame reader benchmark
+def time_frame_reader(inference, video_path, decode_all_frames):
+    from queue import Queue
+    from threading import Thread
+
+    cap = cv2.VideoCapture(video_path)
+    frame_queue = Queue(maxsize=64)
+    start = time.perf_counter()
+    reader_thread = Thread(target=inference.frame_reader, args=(cap, frame_queue, decode_all_frames))
+    reader_thread.start()
+    frames_returned = 0
+    while frame_queue.get() is not None:
+        frames_returned += 1
+    reader_thread.join()
+    elapsed = time.perf_counter() - start
+    cap.release()
+    return elapsed, frames_returned
+
+def benchmark_frame_reader(args):
+    import inference
+
+    work_dir = tempfile.mkdtemp(prefix="vodetect-bench-")
+    try:
+        video_path = generate_synthetic_video(os.path.join(work_dir, "synthetic.mp4"), args.width, args.height, args.fps, args.frames)
+        original_interval = inference.frame_check_interval
+        timings = []
+        for interval in args.intervals:
+            inference.frame_check_interval = interval
+            for decode_all_frames in (True, False):
+                elapsed, frames_returned = time_frame_reader(inference, video_path, decode_all_frames)
+                timings.append((interval, decode_all_frames, elapsed, frames_returned))
+        inference.frame_check_interval = original_interval
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n==== Frame reader ({args.width}x{args.height}, {args.frames} frames) ====")
+    for interval, decode_all_frames, elapsed, frames_returned in timings:
+        mode = "read every frame " if decode_all_frames else "grab non-sampled"
+        print(f" - interval {interval:>3}, {mode}: {elapsed:7.2f} s, {args.frames / elapsed:8.1f} frames/s, {frames_returned} frames returned")
+
+#---------------------------------
+# Startup benchmark
+HEAVY_MODULES = ("torch", "ultralytics")
+
+def time_import(module, load_model):
+    # A fresh interpreter per run, otherwise everything after the first import is already cached
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "imported = time.perf_counter()\n"
+        "heavy = [name for name in %r if name in sys.modules]\n"
+        "if %r:\n"
+        "    import inference\n"
+        "    inference.get_model()\n"
+        "print(imported - start, time.perf_counter() - imported, ','.join(heavy))\n"
+    ) % (HEAVY_MODULES, load_model)
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True, text=True).stdout
+    import_time, model_time, heavy = output.splitlines()[-1].split(" ")
+    return float(import_time), float(model_time), heavy
+
+def benchmark_startup(args):
+    print(f"\n==== Startup ({args.repeats} runs each, median) ====")
+    for module in args.modules:
+        timings = [time_import(module, args.load_model) for _ in range(args.repeats)]
+        import_time = statistics.median(timing[0] for timing in timings)
+        heavy = timings[-1][2] or "none"
+        line = f" - import {module:<12}: {import_time:6.2f} s, model stack loaded: {heavy}"
+        if args.load_model:
+            line += f", first model load afterwards: {statistics.median(timing[1] for timing in timings):6.2f} s"
+        print(line)
+
+#---------------------------------
+# End-to-end benchmark
+# Objects planted into the synthetic clips, one solid colour (BGR) per class so the stub detector can find them
+PLANTED_OBJECTS = {0: ("red", (0, 0, 255)), 1: ("green", (0, 255, 0)), 2: ("blue", (255, 0, 0))}
+
+def default_plants(num_frames, fps):
+    # The clip is cut into segments of up to 8 seconds, in every segment one object is visible for a while.
+    # The gaps are far longer than any sensible grace period and the last object leaves well before the end
+    segment_length = max(min(int(8 * fps), num_frames // 2), 8)
+    plants = []
+    for index, segment_start in enumerate(range(0, num_frames - segment_length + 1, segment_length)):
+        object_id = index % len(PLANTED_OBJECTS)
+        plants.append((object_id, segment_start + segment_length // 4, segment_start + 5 * segment_length // 8))
+    return plants
+
+def generate_planted_video(video_path, width, height, fps, num_frames, plants):
+    # plants is a list of (object_id, start_frame, end_frame), the object is on screen for start..end-1
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+    size = max(height // 6, 16)
+    video_writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for frame_num in range(num_frames):
+        frame = np.roll(background, frame_num * 4, axis=1)
+        for object_id, start_frame, end_frame in plants:
+            if start_frame <= frame_num < end_frame:
+                x = (frame_num - start_frame) * 5 % max(width - size, 1)
+                y = (object_id + 1) * height // (len(PLANTED_OBJECTS) + 2)
+                cv2.rectangle(frame, (x, y), (x + size, y + size), PLANTED_OBJECTS[object_id][1], -1)
+        video_writer.write(frame)
+    video_writer.release()
+    return video_path
+
+class StubTensor:
+    # Just enough of a torch tensor for inference_server.result_to_detections
+    def __init__(self, values):
+        self.values = values
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+class StubBoxes:
+    def __init__(self, class_ids, confidences, boxes):
+        self.cls = StubTensor(np.array(class_ids, dtype=np.float32))
+        self.conf = StubTensor(np.array(confidences, dtype=np.float32))
+        self.xyxy = StubTensor(np.array(boxes, dtype=np.float32).reshape(-1, 4))
+
+class StubResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+class StubDetector:
+    # Deterministic stand-in for the YOLO model: reports every planted colour it finds with a fixed confidence.
+    # It is cheap, so a run with it measures the pipeline around the model
+    names = {object_id: name for object_id, (name, _) in PLANTED_OBJECTS.items()}
+    scale = 4
+
+    def detect(self, frame):
+        small = frame[::self.scale, ::self.scale].astype(np.int16)
+        class_ids, confidences, boxes = [], [], []
+        for object_id, (_, colour) in PLANTED_OBJECTS.items():
+            channel = colour.index(255)
+            others = [other for other in range(3) if other != channel]
+            mask = (small[:, :, channel] > 180) & (small[:, :, others[0]] < 90) & (small[:, :, others[1]] < 90)
+            ys, xs = np.nonzero(mask)
+            if len(xs) >= 16:
+                class_ids.append(object_id)
+                confidences.append(0.9)
+                boxes.append([xs.min() * self.scale, ys.min() * self.scale, (xs.max() + 1) * self.scale, (ys.max() + 1) * self.scale])
+        return StubResult(StubBoxes(class_ids, confidences, boxes))
+
+    def __call__(self, source):
+        if isinstance(source, list):
+            return [self.detect(frame) for frame in source]
+        return [self.detect(source)]
+
+class StageTimer:
+    # Adds up the wall time spent in module level functions, replaced in place by timed wrappers
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    def wrap(self, module, name, stage):
+        original = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.totals[stage] += time.perf_counter() - start
+        setattr(module, name, timed)
+
+def wait_for_threads(existing_threads):
+    # processor.process_folder returns right away, the videos finish on threads it started
+    while True:
+        threads = [thread for thread in threading.enumerate() if thread not in existing_threads and not thread.daemon]
+        if not threads:
+            return
+        for thread in threads:
+            thread.join()
+
+def run_scenario(args, entry, output_mode, video_dir, output_dir, results):
+    # Runs in a child process of its own so every scenario starts cold and has its own peak memory
+    import inference
+
+    inference.output_dir = output_dir
+    inference.output_mode = output_mode
+    inference.batch_size = args.batch_size
+    inference.enable_detection_cache = False
+    if args.detector == "stub":
+        inference.model = StubDetector()
+        inference.load_model = StubDetector
+
+    timer = StageTimer()
+    timer.wrap(inference, "run_model_batch", "model")
+    timer.wrap(inference, "write_stream_copy_clips", "clip extraction")
+    windows = []
+    log_detection_window = inference.log_detection_window
+
+    def record_window(log_queue, object_name, timestamp, frame_count, window_length, detection_percentage, avg_confidence, median_confidence, peak_confidence, saved_to_output):
+        windows.append((object_name, timestamp, saved_to_output))
+        log_detection_window(log_queue, object_name, timestamp, frame_count, window_length, detection_percentage, avg_confidence, median_confidence, peak_confidence, saved_to_output)
+    inference.log_detection_window = record_window
+
+    video_paths = sorted(os.path.join(video_dir, name) for name in os.listdir(video_dir) if name.endswith(".mp4"))
+    start = time.perf_counter()
+    if entry == "main":
+        for video_path in video_paths:
+            inference.main(video_path, 0, input_directory=video_dir)
+    else:
+        import processor
+        processor.MAX_INFERENCE_THREADS = args.threads
+        processor.semaphore = threading.Semaphore(args.threads)
+        existing_threads = set(threading.enumerate())
+        processor.process_folder(video_dir)
+        wait_for_threads(existing_threads)
+    elapsed = time.perf_counter() - start
+
+    outputs = [os.path.join(root, name) for root, _, names in os.walk(output_dir) for name in names if name.endswith(".mp4")]
+    results.put({
+        "elapsed": elapsed,
+        "stages": dict(timer.totals),
+        "windows": windows,
+        "outputs": [(os.path.basename(path), os.path.getsize(path)) for path in outputs],
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "frame_check_interval": inference.frame_check_interval,
+    })
+
+def check_planted_windows(result, plants, fps, num_videos):
+    # Every planted range must come out as one saved window of its object whose last detection is the last
+    # sampled frame of the range, anything else that was saved is spurious
+    interval = result["frame_check_interval"]
+    expected = []
+    for object_id, start_frame, end_frame in plants:
+        last_sampled = (end_frame - 1) // interval * interval
+        if last_sampled >= start_frame:
+            expected.append((PLANTED_OBJECTS[object_id][0], last_sampled))
+    saved = [(object_name, timestamp) for object_name, timestamp, saved_to_output in result["windows"] if saved_to_output]
+    unmatched = list(saved)
+    found = 0
+    for object_name, last_sampled in expected * num_videos:
+        for window in unmatched:
+            if window[0] == object_name and abs(window[1] * fps - last_sampled) < 0.5:
+                unmatched.remove(window)
+                found += 1
+                break
+    missing_outputs = num_videos * len({name for name, _ in expected}) - sum(1 for _, size in result["outputs"] if size > 0)
+    return found, len(expected) * num_videos, len(unmatched), max(missing_outputs, 0)
+
+def wait_for_result(process, results, timeout):
+    # Polls so a scenario that crashes is reported right away instead of after the whole timeout. Returns
+    # (result, None) or (None, why it failed)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return results.get(timeout=0.5), None
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may still be in the pipe when the process exits right after sending it
+            try:
+                return results.get(timeout=1), None
+            except queue.Empty:
+                return None, f"crashed with exit code {process.exitcode}"
+        if time.monotonic() >= deadline:
+            process.terminate()
+            return None, f"timed out after {timeout} s"
+
+def benchmark_end_to_end(args):
+    work_dir = tempfile.mkdtemp(prefix="vodetect-bench-")
+    try:
+        video_dir = os.path.join(work_dir, "videos")
+        os.makedirs(video_dir)
+        plants = default_plants(args.frames, args.fps)
+        for index in range(args.videos):
+            generate_planted_video(os.path.join(video_dir, f"synthetic{index}.mp4"), args.width, args.height, args.fps, args.frames, plants)
+
+        context = multiprocessing.get_context("fork")
+        rows = []
+        for entry in args.entries:
+            for output_mode in args.output_modes:
+                results = context.Queue()
+                output_dir = os.path.join(work_dir, f"output-{entry}-{output_mode}")
+                process = context.Process(target=run_scenario, args=(args, entry, output_mode, video_dir, output_dir, results))
+                process.start()
+                result, failure = wait_for_result(process, results, args.timeout)
+                process.join()
+                if failure is not None:
+                    print(f"{entry} {output_mode} {failure}")
+                rows.append((entry, output_mode, result, failure))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_frames = args.frames * args.videos
+    print(f"\n==== End to end ({args.videos} x {args.width}x{args.height}, {args.frames} frames at {args.fps} fps, {args.detector} detector, batch_size {args.batch_size}) ====")
+    for entry, output_mode, result, failure in rows:
+        if result is None:
+            print(f" - {entry:<6} {output_mode:<11}: {failure}")
+            continue
+        stages = result["stages"]
+        other = result["elapsed"] - stages.get("model", 0) - stages.get("clip extraction", 0)
+        line = (f" - {entry:<6} {output_mode:<11}: {result['elapsed']:7.2f} s, {total_frames / result['elapsed']:7.1f} frames/s, "
+                f"model {stages.get('model', 0):6.2f} s, clip extraction {stages.get('clip extraction', 0):6.2f} s, "
+                f"decode/window/write {other:6.2f} s, peak RSS {result['peak_rss_mb']:7.1f} MB")
+        if args.detector == "stub":
+            found, expected, spurious, missing_outputs = check_planted_windows(result, plants, args.fps, args.videos)
+            status = "OK" if found == expected and not spurious and not missing_outputs else "MISMATCH"
+            line += f", planted windows {found}/{expected}, spurious {spurious}, missing outputs {missing_outputs} [{status}]"
+        else:
+            line += f", windows saved {sum(1 for window in result['windows'] if window[2])}"
+        print(line)
+    if "folder" in args.entries:
+        print("   (folder times are wall clock over concurrent threads, model time is summed over them)")
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description="VODetect pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    batch_parser = subparsers.add_parser("batch", help="Compare inference throughput for different batch sizes")
+    batch_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    batch_parser.add_argument("--frames", type=int, default=600)
+    batch_parser.add_argument("--fps", type=int, default=30)
+    batch_parser.add_argument("--resolution", type=parse_resolution, default=(1280, 720))
+    batch_parser.set_defaults(handler=benchmark_batch_sizes)
+
+    reader_parser = subparsers.add_parser("reader", help="Compare reading every frame against grabbing the frames the model skips")
+    reader_parser.add_argument("--intervals", type=int, nargs="+", default=[1, 8, 30])
+    reader_parser.add_argument("--frames", type=int, default=600)
+    reader_parser.add_argument("--fps", type=int, default=30)
+    reader_parser.add_argument("--resolution", type=parse_resolution, default=(1920, 1080))
+    reader_parser.set_defaults(handler=benchmark_frame_reader)
+
+    startup_parser = subparsers.add_parser("startup", help="Time importing the entry modules in a fresh interpreter")
+    startup_parser.add_argument("--modules", nargs="+", default=["processor", "inference"])
+    startup_parser.add_argument("--repeats", type=int, default=5)
+    startup_parser.add_argument("--load-model", action="store_true", help="Also time loading the model on first use")
+    startup_parser.set_defaults(handler=benchmark_startup)
+
+    e2e_parser = subparsers.add_parser("e2e", help="Run the whole pipeline on synthetic clips with planted objects")
+    e2e_parser.add_argument("--detector", choices=["stub", "yolo"], default="stub", help="stub needs no model or GPU, yolo runs the configured model")
+    e2e_parser.add_argument("--entries", nargs="+", choices=["main", "folder"], default=["main", "folder"], help="inference.main per video or processor.process_folder")
+    e2e_parser.add_argument("--output-modes", nargs="+", choices=["reencode", "stream_copy"], default=["reencode", "stream_copy"])
+    e2e_parser.add_argument("--videos", type=int, default=2)
+    e2e_parser.add_argument("--threads", type=int, default=2, help="MAX_INFERENCE_THREADS for the folder entry")
+    e2e_parser.add_argument("--batch-size", type=int, default=4)
+    e2e_parser.add_argument("--frames", type=int, default=900)
+    e2e_parser.add_argument("--fps", type=int, default=30)
+    e2e_parser.add_argument("--resolution", type=parse_resolution, default=(1280, 720))
+    e2e_parser.add_argument("--timeout", type=int, default=1800, help="Seconds before a scenario counts as hung")
+    e2e_parser.set_defaults(handler=benchmark_end_to_end)
+
+    args = parser.parse_args()
+    if hasattr(args, "resolution"):
+        args.width, args.height = args.resolution
+    args.handler(args)
+
+if __name__ == '__main__':
+    main()
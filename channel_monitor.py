@@ -0,0 +1,207 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import twitch_autodownloader
+
+# Channel monitoring and recording on one asyncio event loop. Every ffmpeg recorder is an asyncio subprocess
+# awaited by a task, so dozens of recordings cost no threads. The only threads are the loop's own, a small pool
+# for the blocking status checks (the Helix request and streamlink resolutions) and, with live inference, a pool
+# that runs the model on the recorded segments. Stopping cancels the loop's waits right away and asks every
+# ffmpeg to quit the way it would on 'q' at the keyboard, which finalizes the files on every platform.
+
+MAX_CONCURRENT_CHECKS = 8
+STOP_TIMEOUT_SECONDS = 10
+LIVE_POLL_SECONDS = 1
+
+class Recording:
+    def __init__(self, channel):
+        self.channel = channel
+        self.process = None
+        self.output_path = None
+        self.stream_name = None
+        self.stopping = False
+        self.task = None
+        self.stop_task = None
+
+class ChannelMonitor:
+    def __init__(self, channel_status, check_interval, on_recording_finished, status_poller=None, live=False, inference_workers=1):
+        # channel_status maps every monitored channel to its status and is updated in place.
+        # on_recording_finished(channel, output_path) is called on the loop when a non live recording ends
+        self.channel_status = channel_status
+        self.check_interval = check_interval
+        self.on_recording_finished = on_recording_finished
+        self.status_poller = status_poller
+        self.live = live
+        self.check_executor = ThreadPoolExecutor(MAX_CONCURRENT_CHECKS, thread_name_prefix="channel-check")
+        self.inference_executor = ThreadPoolExecutor(inference_workers, thread_name_prefix="live-inference") if live else None
+        self.recordings = {}
+        self.loop = None
+        self.stop_event = None
+        self.stopped = False
+
+    def run_forever(self):
+        # Blocks the calling thread until stop() is called
+        if sys.platform != "win32" and sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+            # Before Python 3.12 asyncio waits for every child process in a thread of its own unless a pidfd
+            # watcher is installed, newer versions use pidfds by default
+            asyncio.set_child_watcher(asyncio.PidfdChildWatcher())
+        try:
+            asyncio.run(self.run())
+        finally:
+            self.check_executor.shutdown(wait=False, cancel_futures=True)
+            if self.inference_executor is not None:
+                self.inference_executor.shutdown(wait=True)
+
+    def stop(self):
+        # Safe to call from any thread
+        self.stopped = True
+        loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def run(self):
+        self.stop_event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        if sys.platform != "win32" and sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+            asyncio.get_child_watcher().attach_loop(self.loop)
+        if self.stopped:
+            self.stop_event.set()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    await self.until_stopped(self.check_channels())
+                except Exception as e:
+                    print(f"Error while checking the channels: {e}")
+                await self.until_stopped(asyncio.sleep(self.check_interval))
+        finally:
+            print("Stopping channel monitoring.")
+            await self.stop_recordings()
+
+    async def until_stopped(self, coroutine):
+        # Runs the coroutine until it is done or stop() is called, whichever comes first
+        task = asyncio.create_task(coroutine)
+        stop = asyncio.create_task(self.stop_event.wait())
+        await asyncio.wait({task, stop}, return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        if not task.done():
+            task.cancel()
+            return None
+        return task.result()
+
+    async def check_channels(self):
+        statuses = await self.get_statuses()
+        if self.stop_event.is_set():
+            return
+        self.channel_status.update(statuses)
+        for channel, status in self.channel_status.items():
+            recording = self.recordings.get(channel)
+            if status == "online" and recording is None:
+                print(f"Starting download for {channel}")
+                recording = self.recordings[channel] = Recording(channel)
+                recording.task = asyncio.create_task(self.record(recording))
+            elif status == "offline" and recording is not None and not recording.stopping:
+                print(f"Stopping download for {channel}")
+                recording.stop_task = asyncio.create_task(self.stop_recording(recording))
+
+    async def get_statuses(self):
+        # One Helix request per 100 channels, streamlink only confirms the channels that just went live. The
+        # streamlink checks run in parallel on the check pool
+        helix_status = None
+        if self.status_poller is not None:
+            try:
+                helix_status = await self.loop.run_in_executor(self.check_executor, self.status_poller.poll, list(self.channel_status))
+            except Exception as e:
+                print(f"Helix status check failed, checking every channel with streamlink: {e}")
+
+        statuses = {}
+        to_resolve = []
+        for channel, status in self.channel_status.items():
+            if status == "inference":
+                statuses[channel] = status
+            elif helix_status is None or (helix_status[channel] == "online" and status != "online"):
+                to_resolve.append(channel)
+            else:
+                statuses[channel] = helix_status[channel]
+        resolved = await asyncio.gather(*(
+            self.loop.run_in_executor(self.check_executor, self.resolve_status, channel, self.channel_status[channel])
+            for channel in to_resolve
+        ))
+        statuses.update(zip(to_resolve, resolved))
+        return statuses
+
+    def resolve_status(self, channel, status):
+        return twitch_autodownloader.check_channel_status(channel, status)
+
+    def prepare_recording(self, channel):
+        return twitch_autodownloader.prepare_recording(channel, segmented=self.live)
+
+    async def record(self, recording):
+        channel = recording.channel
+        try:
+            prepared = await self.loop.run_in_executor(self.check_executor, self.prepare_recording, channel)
+            if prepared is None or recording.stopping:
+                return
+            cmd, recording.output_path, recording.stream_name = prepared
+            log_dir = recording.output_path if self.live else twitch_autodownloader.OUTPUT_DIR
+            log_prefix = "" if self.live else f"{channel}_"
+            print(f"Recording stream for {channel} to {recording.output_path}...")
+            with open(os.path.join(log_dir, f"{log_prefix}stdout.log"), "w") as stdout_file, open(os.path.join(log_dir, f"{log_prefix}stderr.log"), "w") as stderr_file:
+                recording.process = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE, stdout=stdout_file, stderr=stderr_file)
+            if recording.stopping:
+                # The channel went offline while ffmpeg was starting
+                recording.stop_task = asyncio.create_task(self.stop_recording(recording))
+
+            if self.live:
+                await self.run_live_inference(recording)
+            else:
+                await recording.process.wait()
+        finally:
+            del self.recordings[channel]
+
+        if not self.live and recording.output_path is not None and os.path.exists(recording.output_path):
+            self.on_recording_finished(channel, recording.output_path)
+
+    async def run_live_inference(self, recording):
+        # Every segment goes through the model as soon as ffmpeg lists it as complete
+        # Imported here so monitoring without live inference never loads the inference stack
+        import live_inference
+        session = await self.loop.run_in_executor(self.inference_executor, live_inference.LiveSession, recording.stream_name)
+        processed = 0
+        exited = asyncio.create_task(recording.process.wait())
+        try:
+            while True:
+                finished = exited.done()
+                segments = twitch_autodownloader.get_completed_segments(recording.output_path)
+                for segment_path in segments[processed:]:
+                    if self.stopped:
+                        return
+                    await self.loop.run_in_executor(self.inference_executor, session.process_segment, segment_path)
+                    processed += 1
+                if finished:
+                    break
+                await asyncio.wait({exited}, timeout=LIVE_POLL_SECONDS)
+        finally:
+            await self.loop.run_in_executor(self.inference_executor, session.finish)
+
+    async def stop_recording(self, recording):
+        recording.stopping = True
+        process = recording.process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.stdin.write(b"q")
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            print(f"Timeout expired. Force terminating {recording.channel}")
+            process.kill()
+            await process.wait()
+
+    async def stop_recordings(self):
+        recordings = list(self.recordings.values())
+        await asyncio.gather(*(self.stop_recording(recording) for recording in recordings))
+        await asyncio.gather(*(recording.task for recording in recordings), return_exceptions=True)
@@ -0,0 +1,110 @@
+import json
+import os
+from collections import namedtuple
+import numpy as np
+from detection_cache import DetectionRecorder, Detections
+from windowing import MEDIAN_BINS, WindowState, WindowTracker
+
+# Crash-safe progress of the frame-by-frame pipeline. A checkpoint holds everything main() needs to continue a
+# video from the first frame it had not processed yet: the open windows with their grace counters, the windows
+# saved so far, the detections recorded for the detection cache, the frame the motion gate compares against
+# and how much of the log was written. It is only used again for the same video file with the same settings.
+
+CHECKPOINT_VERSION = 2
+
+Checkpoint = namedtuple("Checkpoint", ["next_frame", "last_sampled_frame", "tracker", "saved_segments", "recorder", "log_size", "gate_reference"])
+
+def get_checkpoint_settings(video_path, settings):
+    # Round trip through JSON so the settings compare equal to the ones read back from a checkpoint
+    stat = os.stat(video_path)
+    return json.loads(json.dumps({"version": CHECKPOINT_VERSION, "video_size": stat.st_size, "video_mtime_ns": stat.st_mtime_ns, **settings}))
+
+def tracker_columns(tracker):
+    states = [(object_id, state) for object_id, state in sorted(tracker.windows.items())]
+    return {
+        "window_object": np.array([object_id for object_id, _ in states], dtype=np.int64),
+        "window_counts": np.array([
+            [state.start_frame, state.last_valid_frame, state.frame_count, state.window_length, state.grace, state.open, state.confidence_count]
+            for _, state in states
+        ], dtype=np.int64).reshape(-1, 7),
+        "window_confidence": np.array([[state.confidence_sum, state.confidence_peak] for _, state in states], dtype=np.float64).reshape(-1, 2),
+        "window_histogram": np.array([state.confidence_histogram for _, state in states], dtype=np.int64).reshape(-1, MEDIAN_BINS),
+    }
+
+def restore_tracker(grace_frames, object_order, data):
+    tracker = WindowTracker(grace_frames)
+    tracker.object_order = object_order
+    for index, object_id in enumerate(data["window_object"].tolist()):
+        start_frame, last_valid_frame, frame_count, window_length, grace, is_open, confidence_count = data["window_counts"][index].tolist()
+        state = WindowState(start_frame)
+        state.last_valid_frame = last_valid_frame
+        state.frame_count = frame_count
+        state.window_length = window_length
+        state.grace = grace
+        state.open = bool(is_open)
+        state.confidence_count = confidence_count
+        state.confidence_sum, state.confidence_peak = data["window_confidence"][index].tolist()
+        state.confidence_histogram = data["window_histogram"][index].copy()
+        tracker.windows[object_id] = state
+        if state.open:
+            tracker.open_objects.add(object_id)
+    return tracker
+
+def save(checkpoint_path, settings, next_frame, last_sampled_frame, tracker, saved_segments, recorder, log_size, gate_reference=None):
+    # gate_reference is the (signature, detections) of the last frame the model ran on with the motion gate
+    metadata = {
+        "settings": settings,
+        "next_frame": next_frame,
+        "last_sampled_frame": last_sampled_frame,
+        "grace_frames": tracker.grace_frames,
+        "object_order": [[object_id, rank] for object_id, rank in tracker.object_order.items()],
+        "saved_segments": {object_name: segments for object_name, segments in saved_segments.items()},
+        "recorded": recorder is not None,
+        "log_size": log_size,
+        "gate_reference": gate_reference is not None,
+    }
+    columns = tracker_columns(tracker)
+    if recorder is not None:
+        columns.update({f"recorder_{name}": column for name, column in recorder.columns().items()})
+    if gate_reference is not None:
+        signature, detections = gate_reference
+        columns.update({
+            "gate_signature": signature,
+            "gate_class_ids": np.asarray(detections.class_ids),
+            "gate_confidences": np.asarray(detections.confidences),
+            "gate_boxes": np.asarray(detections.boxes).reshape(-1, 4),
+        })
+    # Written next to the old checkpoint and swapped in, so a crash while saving leaves the previous one intact
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, metadata=np.array(json.dumps(metadata)), **columns)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+def load(checkpoint_path, settings):
+    if not os.path.exists(checkpoint_path):
+        return None
+    try:
+        with np.load(checkpoint_path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata["settings"] != settings:
+                print(f"Ignoring checkpoint {checkpoint_path}, the video or the settings changed since it was written")
+                return None
+            object_order = {object_id: rank for object_id, rank in metadata["object_order"]}
+            tracker = restore_tracker(metadata["grace_frames"], object_order, data)
+            recorder = None
+            if metadata["recorded"]:
+                recorder = DetectionRecorder.from_columns({name[len("recorder_"):]: data[name] for name in data.files if name.startswith("recorder_")})
+            saved_segments = {object_name: [tuple(segment) for segment in segments] for object_name, segments in metadata["saved_segments"].items()}
+            gate_reference = None
+            if metadata["gate_reference"]:
+                gate_reference = (data["gate_signature"], Detections(data["gate_class_ids"], data["gate_confidences"], data["gate_boxes"]))
+            return Checkpoint(metadata["next_frame"], metadata["last_sampled_frame"], tracker, saved_segments, recorder, metadata["log_size"], gate_reference)
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+        return None
+
+def remove(checkpoint_path):
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
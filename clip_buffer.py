@@ -0,0 +1,97 @@
+import glob
+import os
+import tempfile
+from threading import Lock
+import numpy as np
+
+class MemoryBudget:
+    # Byte budget shared by all clip buffers of one video
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+        self.lock = Lock()
+
+    def reserve(self, num_bytes):
+        with self.lock:
+            if self.used_bytes + num_bytes > self.limit_bytes:
+                return False
+            self.used_bytes += num_bytes
+            return True
+
+    def release(self, num_bytes):
+        with self.lock:
+            self.used_bytes = max(self.used_bytes - num_bytes, 0)
+
+def get_scratch_prefix(name):
+    return f"clipbuffer-{name}-" if name else "clipbuffer-"
+
+def remove_scratch_files(scratch_dir, name):
+    # Scratch files left behind by an earlier run under the same name that crashed or was killed. The files are
+    # named after their video, so other videos sharing the scratch directory keep theirs. mkstemp adds exactly
+    # 8 characters, which keeps a video whose name starts with this one out of the match
+    for path in glob.glob(os.path.join(glob.escape(scratch_dir), f"{glob.escape(get_scratch_prefix(name))}????????.raw")):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Failed to remove stale clip buffer scratch file {path}: {e}")
+
+class ClipBuffer:
+    # Frames of one open detection window. Frames are kept in RAM while the shared budget allows it,
+    # everything after that is appended to a raw scratch file and streamed back in order when the window closes
+    def __init__(self, budget, scratch_dir=None, name=None):
+        self.budget = budget
+        self.scratch_dir = scratch_dir
+        self.name = name
+        self.memory_frames = []
+        self.memory_bytes = 0
+        self.spill_file = None
+        self.spill_path = None
+        self.spilled_frames = 0
+        self.frame_shape = None
+        self.frame_dtype = None
+
+    def __len__(self):
+        return len(self.memory_frames) + self.spilled_frames
+
+    def append(self, frame):
+        # Once a window started spilling every later frame goes to disk as well so the order is preserved
+        if self.spill_file is None and self.budget.reserve(frame.nbytes):
+            self.memory_frames.append(frame)
+            self.memory_bytes += frame.nbytes
+            return
+
+        if self.spill_file is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix=get_scratch_prefix(self.name), suffix=".raw", dir=self.scratch_dir)
+            self.spill_file = os.fdopen(fd, "w+b")
+            self.frame_shape = frame.shape
+            self.frame_dtype = frame.dtype
+        self.spill_file.write(np.ascontiguousarray(frame).data)
+        self.spilled_frames += 1
+
+    def __iter__(self):
+        yield from self.memory_frames
+
+        if self.spilled_frames:
+            # Read the spilled frames back one at a time so only a single frame is resident at once
+            self.spill_file.flush()
+            self.spill_file.seek(0)
+            for _ in range(self.spilled_frames):
+                frame = np.empty(self.frame_shape, dtype=self.frame_dtype)
+                self.spill_file.readinto(frame.data)
+                yield frame
+            self.spill_file.seek(0, os.SEEK_END)
+
+    def clear(self):
+        self.memory_frames = []
+        self.budget.release(self.memory_bytes)
+        self.memory_bytes = 0
+
+        if self.spill_file is not None:
+            self.spill_file.close()
+            try:
+                os.remove(self.spill_path)
+            except OSError as e:
+                print(f"Failed to remove clip buffer scratch file {self.spill_path}: {e}")
+            self.spill_file = None
+            self.spill_path = None
+        self.spilled_frames = 0
@@ -0,0 +1,75 @@
+import os
+import subprocess
+
+# Cuts time ranges out of the source video with ffmpeg stream copy and joins them into one file per object.
+# Seeking on the input side makes ffmpeg start each cut at the keyframe before the requested start, so no
+# frame is decoded or re-encoded and the clips keep the quality of the source.
+
+def merge_segments(segments):
+    # Sort the (start_seconds, end_seconds) ranges and merge the ones that overlap or touch
+    merged = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def cut_segment(video_path, start, end, output_path):
+    cmd = [
+        'ffmpeg', '-y',
+        '-ss', f'{start:.3f}',
+        '-i', video_path,
+        '-t', f'{end - start:.3f}',
+        '-map', '0:v:0', '-map', '0:a?',
+        '-c', 'copy',
+        '-avoid_negative_ts', 'make_zero',
+        output_path
+    ]
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        print(f"Error cutting {start:.2f}-{end:.2f}s from {video_path}: {process.stderr.decode('utf-8', errors='replace')}")
+        return False
+    return True
+
+def concat_segments(part_paths, output_path, work_dir):
+    list_path = os.path.join(work_dir, f'{os.path.basename(output_path)}.concat.txt')
+    with open(list_path, 'w') as list_file:
+        for part_path in part_paths:
+            escaped_path = os.path.abspath(part_path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+
+    cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', output_path]
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    os.remove(list_path)
+    if process.returncode != 0:
+        print(f"Error joining clips into {output_path}: {process.stderr.decode('utf-8', errors='replace')}")
+        return False
+    return True
+
+def extract_clips(video_path, segments, output_path, work_dir):
+    segments = merge_segments(segments)
+    if not segments:
+        return False
+
+    name = os.path.splitext(os.path.basename(output_path))[0]
+    part_paths = []
+    success = True
+    for index, (start, end) in enumerate(segments):
+        part_path = os.path.join(work_dir, f'{name}.part{index:04d}.mp4')
+        if not cut_segment(video_path, start, end, part_path):
+            success = False
+            break
+        part_paths.append(part_path)
+
+    if success:
+        if len(part_paths) == 1:
+            os.replace(part_paths[0], output_path)
+            part_paths = []
+        else:
+            success = concat_segments(part_paths, output_path, work_dir)
+
+    for part_path in part_paths:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return success
@@ -0,0 +1,58 @@
+import os
+from threading import Lock
+import clip_extractor
+
+# Two-resolution workflow. The downloaders can fetch a low quality rendition that is only used to find the
+# detections, the model runs at 640px anyway. Once inference is done with it, the saved windows (with some
+# padding) are downloaded again at the desired quality and joined into the output clips, so the full quality
+# download is limited to the parts of the video that had something in them.
+
+# Path of every analysis video that is waiting for inference -> (download_section, offset_seconds).
+# download_section(start_seconds, end_seconds, output_path) downloads that part of the source at the desired
+# quality and returns True on success. offset_seconds is where the analysis video starts in the source, for
+# trimmed downloads.
+analysis_sources = {}
+analysis_sources_lock = Lock()
+
+def register(analysis_path, download_section, offset_seconds=0):
+    with analysis_sources_lock:
+        analysis_sources[os.path.abspath(analysis_path)] = (download_section, offset_seconds)
+
+def take(video_path):
+    # The download source of an analysis video, None for any other video
+    with analysis_sources_lock:
+        return analysis_sources.pop(os.path.abspath(video_path), None)
+
+def get_source_ranges(time_ranges, padding_seconds, offset_seconds=0):
+    # Pads the (start, end) ranges of the analysis video, moves them to the time of the source and merges the
+    # ones that overlap after padding. A range past the end of the source just ends with the source
+    padded = [(offset_seconds + max(start - padding_seconds, 0), offset_seconds + end + padding_seconds) for start, end in time_ranges]
+    return clip_extractor.merge_segments(padded)
+
+def fetch_clips(source, saved_ranges, output_paths, work_dir, padding_seconds):
+    # saved_ranges maps each object to the time ranges of its saved windows in the analysis video, output_paths
+    # maps it to the clip file to write
+    download_section, offset_seconds = source
+    success = True
+    for object_name, time_ranges in saved_ranges.items():
+        output_path = output_paths[object_name]
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        part_paths = []
+        for index, (start, end) in enumerate(get_source_ranges(time_ranges, padding_seconds, offset_seconds)):
+            part_path = os.path.join(work_dir, f'{name}.hq{index:04d}.mp4')
+            print(f"Downloading {start:.1f}-{end:.1f}s of the source for '{object_name}'")
+            if not download_section(start, end, part_path) or not os.path.exists(part_path):
+                print(f"Failed to download {start:.1f}-{end:.1f}s of the source for '{object_name}'")
+                success = False
+                continue
+            part_paths.append(part_path)
+
+        if len(part_paths) == 1:
+            os.replace(part_paths[0], output_path)
+            part_paths = []
+        elif part_paths and not clip_extractor.concat_segments(part_paths, output_path, work_dir):
+            success = False
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    return success
@@ -0,0 +1,50 @@
+import clip_extractor
+
+# Coarse to fine search for videos where detections are rare. The model first runs on one frame every stride
+# frames, reached by seeking. Every coarse frame with a detection is then refined: the frame_check_interval
+# grid around it is sampled densely, and the refined region keeps growing until it starts and ends with a full
+# grace period without any detection. Inside a region the windows are then exactly the ones a full scan finds,
+# outside of it there are only coarse frames without detections, which can't open a window. What the search
+# can miss are objects that come and go between two coarse frames.
+
+def grid_frames(start_frame, end_frame, frame_check_interval):
+    # The sampled frames in [start_frame, end_frame]
+    first = -(-start_frame // frame_check_interval) * frame_check_interval
+    return range(first, end_frame + 1, frame_check_interval)
+
+def merge_regions(regions, frame_check_interval):
+    # Regions that overlap or whose sampled frames follow on from each other become one
+    merged = clip_extractor.merge_segments([(start, end + frame_check_interval) for start, end in regions])
+    return [(start, end - frame_check_interval) for start, end in merged]
+
+def search(total_frames, frame_check_interval, stride, grace_frames, detect):
+    # detect(frame_nums) runs the model on the frames in the given order and returns, for each one, whether it
+    # had a detection that passed its threshold. A frame the model failed on counts as no detection.
+    # Returns the coarse frames, in order, and the refined regions as inclusive (start, end) frame ranges
+    last_frame = (total_frames - 1) // frame_check_interval * frame_check_interval
+    detected = {}
+    coarse_frames = list(range(0, total_frames, stride))
+    detected.update(zip(coarse_frames, detect(coarse_frames)))
+
+    regions = []
+    pending = merge_regions([
+        (max(frame_num - stride, 0), min(frame_num + stride, last_frame))
+        for frame_num in coarse_frames if detected[frame_num]
+    ], frame_check_interval)
+    while pending:
+        frame_nums = [frame_num for start, end in pending for frame_num in grid_frames(start, end, frame_check_interval) if frame_num not in detected]
+        detected.update(zip(frame_nums, detect(frame_nums)))
+        regions = merge_regions(regions + pending, frame_check_interval)
+
+        # A region has to reach a full grace period before its first and past its last detection, otherwise a
+        # window could start earlier or close later than the region shows
+        pending = []
+        for start, end in regions:
+            hits = [frame_num for frame_num in grid_frames(start, end, frame_check_interval) if detected[frame_num]]
+            if not hits:
+                continue
+            if max(hits[0] - grace_frames, 0) < start:
+                pending.append((max(hits[0] - grace_frames, 0), start - frame_check_interval))
+            if min(hits[-1] + grace_frames, last_frame) > end:
+                pending.append((end + frame_check_interval, min(hits[-1] + grace_frames, last_frame)))
+    return coarse_frames, regions
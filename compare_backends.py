@@ -0,0 +1,136 @@
+import argparse
+import time
+import cv2
+import numpy as np
+from settings import config
+import model_backends
+from inference_server import predict_detections
+from windowing import compute_windows
+
+# Runs the same sampled frames through every inference backend and compares speed and detections against the
+# first backend in the list (pytorch by default)
+
+def read_sampled_frames(video_path, num_frames, frame_check_interval):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    frame_num = 0
+    while frame_num < num_frames:
+        if frame_num % frame_check_interval == 0:
+            success, frame = cap.read()
+            if not success:
+                break
+            frames.append((frame_num, frame))
+        elif not cap.grab():
+            break
+        frame_num += 1
+    cap.release()
+    return frames
+
+def run_backend(model, frames, batch_size):
+    predict_detections(model, [frames[0][1]])
+    detections = []
+    start = time.perf_counter()
+    for index in range(0, len(frames), batch_size):
+        detections.extend(predict_detections(model, [frame for _, frame in frames[index:index + batch_size]]))
+    return detections, time.perf_counter() - start
+
+def box_iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    areas = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(areas - intersection, 1e-9)
+
+def match_detections(reference, candidate, min_confidence, min_iou=0.5):
+    # Greedy one-to-one matching of same-class boxes above min_confidence, returns (matched, reference count,
+    # candidate count, absolute confidence differences of the matches)
+    matched = 0
+    confidence_diffs = []
+    reference_count = candidate_count = 0
+    for ref, cand in zip(reference, candidate):
+        if isinstance(ref, Exception) or isinstance(cand, Exception):
+            continue
+        ref_keep = np.asarray(ref.confidences) >= min_confidence
+        cand_keep = np.asarray(cand.confidences) >= min_confidence
+        ref_boxes, ref_classes, ref_confs = np.asarray(ref.boxes)[ref_keep], np.asarray(ref.class_ids)[ref_keep], np.asarray(ref.confidences)[ref_keep]
+        cand_boxes, cand_classes, cand_confs = np.asarray(cand.boxes)[cand_keep], np.asarray(cand.class_ids)[cand_keep], np.asarray(cand.confidences)[cand_keep]
+        reference_count += len(ref_boxes)
+        candidate_count += len(cand_boxes)
+        used = np.zeros(len(cand_boxes), dtype=bool)
+        for index in np.argsort(-ref_confs):
+            if len(cand_boxes) == 0:
+                break
+            ious = box_iou(ref_boxes[index], cand_boxes)
+            ious[(cand_classes != ref_classes[index]) | used] = 0
+            best = int(np.argmax(ious))
+            if ious[best] >= min_iou:
+                used[best] = True
+                matched += 1
+                confidence_diffs.append(abs(float(ref_confs[index]) - float(cand_confs[best])))
+    return matched, reference_count, candidate_count, confidence_diffs
+
+def detection_windows(frames, detections, min_confidence, grace_frames):
+    sampled_frames, frame_nums, object_ids, confidences = [], [], [], []
+    for (frame_num, _), frame_detections in zip(frames, detections):
+        if isinstance(frame_detections, Exception):
+            continue
+        sampled_frames.append(frame_num)
+        for object_id, conf in zip(frame_detections.class_ids, frame_detections.confidences):
+            if conf >= min_confidence:
+                frame_nums.append(frame_num)
+                object_ids.append(int(object_id))
+                confidences.append(float(conf))
+    windows = compute_windows(sampled_frames, frame_nums, object_ids, confidences, grace_frames)
+    return [(window.object_id, window.start_frame, window.end_frame) for window in windows]
+
+def main():
+    inference_config = config["inference"]
+    parser = argparse.ArgumentParser(description="Compare the speed and detections of the inference backends")
+    parser.add_argument("video", help="Video to run the backends on")
+    parser.add_argument("--model", default=inference_config["model_path"])
+    parser.add_argument("--backends", nargs="+", default=["pytorch", "onnx", "onnx-int8", "openvino", "openvino-int8"],
+                        help="Backends to compare, append -int8 for the quantized variant. The first one is the reference")
+    parser.add_argument("--frames", type=int, default=600, help="Number of video frames to sample from")
+    parser.add_argument("--frame-check-interval", type=int, default=inference_config["frame_check_interval"])
+    parser.add_argument("--batch-size", type=int, default=inference_config.get("batch_size", 1))
+    parser.add_argument("--confidence", type=float, default=inference_config["default_confidence_threshold"])
+    parser.add_argument("--calibration-data", default=inference_config.get("backend_calibration_data"))
+    args = parser.parse_args()
+
+    frames = read_sampled_frames(args.video, args.frames, args.frame_check_interval)
+    if not frames:
+        print(f"Error: Couldn't read any frames from {args.video}")
+        return
+    grace_frames = inference_config["grace_period_val"] * args.frame_check_interval
+
+    results = []
+    for variant in args.backends:
+        backend, _, quantization = variant.partition("-")
+        try:
+            model = model_backends.load_model(args.model, backend, quantization == "int8", args.calibration_data)
+            detections, elapsed = run_backend(model, frames, max(args.batch_size, 1))
+        except Exception as e:
+            print(f"Skipping the {variant} backend: {e}")
+            continue
+        results.append((variant, detections, elapsed))
+
+    if not results:
+        return
+    reference_variant, reference_detections, reference_elapsed = results[0]
+    reference_windows = detection_windows(frames, reference_detections, args.confidence, grace_frames)
+    print(f"\n==== Backends ({len(frames)} sampled frames, reference {reference_variant}, confidence {args.confidence}) ====")
+    for variant, detections, elapsed in results:
+        matched, reference_count, candidate_count, confidence_diffs = match_detections(reference_detections, detections, args.confidence)
+        windows = detection_windows(frames, detections, args.confidence, grace_frames)
+        same_windows = len(set(windows) & set(reference_windows))
+        print(
+            f" - {variant:<14}: {1000 * elapsed / len(frames):7.1f} ms/frame, speedup {reference_elapsed / elapsed:5.2f}x, "
+            f"recall {matched / max(reference_count, 1):6.1%}, precision {matched / max(candidate_count, 1):6.1%}, "
+            f"mean confidence diff {np.mean(confidence_diffs) if confidence_diffs else 0:.3f}, "
+            f"windows identical {same_windows}/{len(reference_windows)} (found {len(windows)})"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+from array import array
+from collections import namedtuple
+import numpy as np
+
+# Raw model output for one sampled frame, before any confidence threshold is applied
+Detections = namedtuple("Detections", ["class_ids", "confidences", "boxes"])
+
+CACHE_VERSION = 3
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_cache_key(video_path, model_path, frame_check_interval, backend="pytorch", sampling=None, region=None, equalization_weight=None):
+    # Only settings that change what the model sees or returns are part of the key, post-processing settings
+    # are not. sampling holds the settings that decide which frames go through the model beyond the interval,
+    # region the part of the frame the model is given and equalization_weight the histogram equalization the
+    # frames got before, None without preprocessing
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"v{CACHE_VERSION}".encode())
+    digest.update(hash_file(video_path).encode())
+    digest.update(hash_file(model_path).encode())
+    digest.update(f"interval={frame_check_interval}".encode())
+    if backend != "pytorch":
+        # Exported and quantized models return slightly different confidences than the .pt model
+        digest.update(f"backend={backend}".encode())
+    if sampling is not None:
+        digest.update(f"sampling={json.dumps(sampling, sort_keys=True)}".encode())
+    if region is not None:
+        digest.update(f"region={json.dumps(region)}".encode())
+    if equalization_weight is not None:
+        digest.update(f"equalization={equalization_weight}".encode())
+    return digest.hexdigest()
+
+class DetectionRecorder:
+    # Collects the detections of a run column by column so they can be written as one compact file
+    def __init__(self):
+        self.sampled_frames = array('q')
+        self.failed_frames = array('q')
+        self.frame_nums = array('q')
+        self.class_ids = array('h')
+        self.confidences = array('f')
+        self.boxes = array('f')
+
+    def add(self, frame_num, detections):
+        self.sampled_frames.append(frame_num)
+        count = len(detections.class_ids)
+        if count:
+            self.frame_nums.extend([frame_num] * count)
+            self.class_ids.extend(int(class_id) for class_id in detections.class_ids)
+            self.confidences.extend(float(conf) for conf in detections.confidences)
+            self.boxes.extend(float(value) for value in np.asarray(detections.boxes).reshape(-1))
+
+    @classmethod
+    def from_columns(cls, columns):
+        # Continues a recording from the arrays columns() returned, e.g. the ones saved in a checkpoint
+        recorder = cls()
+        recorder.sampled_frames.frombytes(np.asarray(columns["sampled_frames"], dtype=np.int64).tobytes())
+        recorder.failed_frames.frombytes(np.asarray(columns["failed_frames"], dtype=np.int64).tobytes())
+        recorder.frame_nums.frombytes(np.asarray(columns["frame"], dtype=np.int64).tobytes())
+        recorder.class_ids.frombytes(np.asarray(columns["class_id"], dtype=np.int16).tobytes())
+        recorder.confidences.frombytes(np.asarray(columns["confidence"], dtype=np.float32).tobytes())
+        recorder.boxes.frombytes(np.asarray(columns["box"], dtype=np.float32).tobytes())
+        return recorder
+
+    def add_failure(self, frame_num):
+        # The model raised on this frame, a replay skips it the same way the original run did
+        self.failed_frames.append(frame_num)
+
+    def extend(self, other):
+        # Append the detections of a recorder that covers later frames, e.g. the next shard of a video
+        self.sampled_frames.extend(other.sampled_frames)
+        self.failed_frames.extend(other.failed_frames)
+        self.frame_nums.extend(other.frame_nums)
+        self.class_ids.extend(other.class_ids)
+        self.confidences.extend(other.confidences)
+        self.boxes.extend(other.boxes)
+
+    def columns(self):
+        return {
+            "sampled_frames": np.frombuffer(self.sampled_frames, dtype=np.int64),
+            "failed_frames": np.frombuffer(self.failed_frames, dtype=np.int64),
+            "frame": np.frombuffer(self.frame_nums, dtype=np.int64),
+            "class_id": np.frombuffer(self.class_ids, dtype=np.int16),
+            "confidence": np.frombuffer(self.confidences, dtype=np.float32),
+            "box": np.frombuffer(self.boxes, dtype=np.float32).reshape(-1, 4),
+        }
+
+    def save(self, cache_path, cache_key, names, total_frames, fps):
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, metadata=np.array(json.dumps(build_metadata(names, total_frames, fps, cache_key))), **self.columns())
+        os.replace(tmp_path, cache_path)
+
+def build_metadata(names, total_frames, fps, cache_key=None):
+    return {
+        "version": CACHE_VERSION,
+        "key": cache_key,
+        "names": {str(class_id): name for class_id, name in names.items()},
+        "total_frames": total_frames,
+        "fps": fps,
+    }
+
+class DetectionCache:
+    def __init__(self, metadata, sampled_frames, failed_frames, frame_nums, class_ids, confidences, boxes):
+        self.names = {int(class_id): name for class_id, name in metadata["names"].items()}
+        self.total_frames = metadata["total_frames"]
+        self.fps = metadata["fps"]
+        self.sampled_frames = sampled_frames
+        self.failed_frames = failed_frames
+        self.frame_nums = frame_nums
+        self.class_ids = class_ids
+        self.confidences = confidences
+        self.boxes = boxes
+        self.known_frames = set(sampled_frames.tolist())
+        self.known_failures = set(failed_frames.tolist())
+
+    def get(self, frame_num):
+        if frame_num in self.known_failures:
+            return RuntimeError(f"frame {frame_num} failed when the detection cache was recorded")
+        if frame_num not in self.known_frames:
+            return KeyError(f"frame {frame_num} is not in the detection cache")
+        # Rows are stored in frame order, so the detections of a frame are one contiguous slice
+        start = np.searchsorted(self.frame_nums, frame_num, side='left')
+        end = np.searchsorted(self.frame_nums, frame_num, side='right')
+        return Detections(self.class_ids[start:end], self.confidences[start:end], self.boxes[start:end])
+
+    @classmethod
+    def from_recorder(cls, recorder, names, total_frames, fps):
+        # Wraps detections that were just recorded so they can be windowed like a loaded cache
+        columns = {name: column.copy() for name, column in recorder.columns().items()}
+        return cls(build_metadata(names, total_frames, fps), columns["sampled_frames"], columns["failed_frames"], columns["frame"], columns["class_id"], columns["confidence"], columns["box"])
+
+def load(cache_path, cache_key):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata.get("version") != CACHE_VERSION or metadata.get("key") != cache_key:
+                return None
+            return DetectionCache(metadata, data["sampled_frames"], data["failed_frames"], data["frame"], data["class_id"], data["confidence"], data["box"])
+    except Exception as e:
+        print(f"Ignoring unreadable detection cache {cache_path}: {e}")
+        return None
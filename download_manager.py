@@ -0,0 +1,75 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+# Downloads several videos at once and hands each one to inference the moment it is complete, so the model
+# works on the first video while the next ones are still downloading. Downloaded videos that inference hasn't
+# finished yet are counted against a disk budget, new downloads wait while the budget is used up and start
+# again as inference gets through the queue.
+
+class DiskBudget:
+    def __init__(self, max_bytes):
+        # max_bytes of 0 or None means no limit
+        self.max_bytes = max_bytes or None
+        # Size of every downloaded video that is still waiting for or going through inference
+        self.queued = {}
+        self.condition = Condition()
+
+    def queued_bytes(self):
+        with self.condition:
+            return sum(self.queued.values())
+
+    def wait_for_space(self, stopped=lambda: False):
+        # Returns False if stopped() turned true while waiting
+        with self.condition:
+            if self.max_bytes is not None and sum(self.queued.values()) >= self.max_bytes:
+                print(f"{sum(self.queued.values()) / 1024 ** 3:.1f}GB of downloaded video is waiting for inference, pausing downloads")
+            while self.max_bytes is not None and sum(self.queued.values()) >= self.max_bytes:
+                if stopped():
+                    return False
+                # Woken up by release(), the timeout only rechecks stopped()
+                self.condition.wait(timeout=1)
+            return not stopped()
+
+    def add(self, path):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with self.condition:
+            self.queued[path] = self.queued.get(path, 0) + size
+
+    def release(self, path):
+        # Called once inference is done with a video, paths that were never added are ignored
+        with self.condition:
+            if self.queued.pop(path, None) is not None:
+                self.condition.notify_all()
+
+class DownloadManager:
+    def __init__(self, inference_queue, budget, max_parallel=2, stopped=lambda: False):
+        self.inference_queue = inference_queue
+        self.budget = budget
+        self.stopped = stopped
+        self.executor = ThreadPoolExecutor(max(1, max_parallel), thread_name_prefix="download")
+        self.futures = []
+
+    def submit(self, download, *args):
+        # download(*args) returns the path of the downloaded video, or None if it failed
+        self.futures.append(self.executor.submit(self.run, download, args))
+
+    def run(self, download, args):
+        if not self.budget.wait_for_space(self.stopped):
+            return None
+        try:
+            path = download(*args)
+        except Exception as e:
+            print(f"Download failed: {e}")
+            return None
+        # A failed download must not reach the queue, None tells the inference worker to exit
+        if path is None or self.stopped():
+            return None
+        self.budget.add(path)
+        self.inference_queue.put(path)
+        return path
+
+    def join(self):
+        # Waits for every submitted download, returns the paths that were queued for inference
+        self.executor.shutdown(wait=True)
+        return [future.result() for future in self.futures if future.result() is not None]
@@ -1,21 +1,29 @@
-from ultralytics import YOLO
-import torch
 from tqdm import tqdm
 import cv2
 import os
 import logging
+import time
 from collections import defaultdict
 from queue import Queue
-from threading import Thread, Lock
-from statistics import median
-import json
+from threading import Event, Thread, Lock
+from settings import config
+import numpy as np
+from clip_buffer import ClipBuffer, MemoryBudget, remove_scratch_files
+import clip_extractor
+from windowing import WindowTracker, compute_windows, window_detection_percentage
+import checkpoint
+import detection_cache
+import coarse_search
+import keyframe_screening
+import roi
+from detection_cache import DetectionCache, DetectionRecorder
+from video_io import FrameRangeReader, open_capture_at, seek_capture
+from inference_server import InferenceServer, predict_detections
+import model_backends
+from metrics import NULL_METRICS, PipelineMetrics
 
 logging.getLogger('ultralytics').setLevel(logging.CRITICAL)
 
-# Load configuration from config.json
-with open('config.json', 'r') as config_file:
-    config = json.load(config_file)
-
 # Fetch inference settings from config
 inference_config = config["inference"]
 
@@ -25,27 +33,67 @@ log_output_only = inference_config["log_output_only"]
 enable_preprocessing = inference_config["enable_preprocessing"]
 histogram_equalization_weight = inference_config["histogram_equalization_weight"]
 frame_check_interval = inference_config["frame_check_interval"]
+# Longest gap between sampled frames while no object is in its detection window, frame_check_interval is used
+# while any is. Equal to frame_check_interval unless adaptive sampling is wanted
+max_frame_check_interval = max(int(inference_config.get("max_frame_check_interval", frame_check_interval)), frame_check_interval)
 grace_period_val = inference_config["grace_period_val"]
 min_detect_percent = inference_config["min_detect_percent"]
 default_confidence_threshold = inference_config["default_confidence_threshold"]
 user_defined_confidence_thresholds = inference_config["user_defined_confidence_thresholds"]
 model_path = inference_config["model_path"]
-
-model = YOLO(model_path)
+batch_size = max(int(inference_config.get("batch_size", 1)), 1)
+clip_buffer_memory_mb = inference_config.get("clip_buffer_memory_mb", 1024)
+clip_buffer_scratch_dir = inference_config.get("clip_buffer_scratch_dir")
+output_mode = inference_config.get("output_mode", "reencode")
+enable_detection_cache = inference_config.get("detection_cache", True)
+shards = max(int(inference_config.get("shards", 1)), 1)
+use_inference_server = inference_config.get("inference_server", False)
+inference_server_batch_frames = max(int(inference_config.get("inference_server_batch_frames", 16)), 1)
+inference_server_max_wait_ms = inference_config.get("inference_server_max_wait_ms", 20)
+backend = inference_config.get("backend", "pytorch")
+backend_int8 = inference_config.get("backend_int8", False)
+backend_calibration_data = inference_config.get("backend_calibration_data")
+enable_metrics = inference_config.get("metrics", False)
+metrics_interval_seconds = inference_config.get("metrics_interval_seconds", 5)
+checkpoint_interval_seconds = inference_config.get("checkpoint_interval_seconds", 300)
+# A sampled frame that looks like the last frame the model ran on reuses its detections. Tiny greyscale copies
+# of the two frames are compared tile by tile, the mean absolute difference (0-255) of the tile that changed
+# most must reach this for the model to run again. 0 disables the gate
+motion_gate_threshold = inference_config.get("motion_gate_threshold", 0)
+MOTION_GATE_SIZE = (64, 36)
+MOTION_GATE_TILES = (8, 6)
+# Searches sparse videos coarse to fine, the model first sees one frame every this many seconds and only the
+# surroundings of the frames with a detection are sampled every frame_check_interval frames. 0 disables it
+coarse_search_seconds = inference_config.get("coarse_search_seconds", 0)
+# Coarse frames further apart than this are reached by seeking, closer ones by decoding forward
+COARSE_SEARCH_MAX_FORWARD_SECONDS = 1
+# Only runs the model on the keyframes and reports the stretches around the ones with a detection as candidate
+# ranges instead of detection windows
+enable_keyframe_screening = inference_config.get("keyframe_screening", False)
+# Channel or folder -> [x, y, width, height] as fractions of the frame, the model only sees that part of the
+# videos of the channel or in the folder
+regions_of_interest = inference_config.get("regions_of_interest", {})
+
+# The model stack (torch and ultralytics) is only imported and the model only loaded by the first video that
+# runs it, so downloading or replaying cached detections never pays for it, see get_model
+model = None
+model_lock = Lock()
+# Extra model instances for the shards of a sharded run, shard 0 uses the main model
+shard_models = []
+shard_models_lock = Lock()
+# Shared model process used by every video when inference_server is enabled, see start_inference_server
+inference_server = None
+inference_server_lock = Lock()
 
 #-----------------------------------
 # Create necessary directories
 os.makedirs(output_dir, exist_ok=True)
 print_lock = Lock()
 
-def log_detection_window(log_queue, object_name, timestamp, frame_count, window_length, detection_percentage, confidence_values, saved_to_output):
+def log_detection_window(log_queue, object_name, timestamp, frame_count, window_length, detection_percentage, avg_confidence, median_confidence, peak_confidence, saved_to_output):
     if log_output_only and not saved_to_output:
         return
 
-    avg_confidence = sum(confidence_values) / max(len(confidence_values), 1)
-    median_confidence = median(confidence_values) if confidence_values else 0
-    peak_confidence = max(confidence_values, default=0)
-
     log_message = (
         f"\n==== Detection Window for '{object_name}' ====\n"
         f" - Timestamp: {timestamp:.2f} seconds\n"
@@ -62,27 +110,391 @@ def log_detection_window(log_queue, object_name, timestamp, frame_count, window_
 def get_confidence_threshold(object_name):
     return user_defined_confidence_thresholds.get(object_name, default_confidence_threshold)
 
+def get_output_filename(object_name, filename, video_output_dir):
+    return os.path.join(video_output_dir, f'{object_name}-{os.path.splitext(filename)[0]}.mp4')
+
 def initialize_video_writer(object_name, filename, frame_width, frame_height, fps, video_output_dir):
-    output_filename = os.path.join(video_output_dir, f'{object_name}-{os.path.splitext(filename)[0]}.mp4')
+    output_filename = get_output_filename(object_name, filename, video_output_dir)
     return cv2.VideoWriter(output_filename, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
 
-def frame_reader(cap, queue):
+def write_stream_copy_clips(video_path, filename, saved_segments, fps, video_output_dir, debug_dir):
+    # Cut every saved window out of the source video without re-encoding, one output file per object
+    for object_name, segments in saved_segments.items():
+        output_filename = get_output_filename(object_name, filename, video_output_dir)
+        time_ranges = [(start_frame / fps, (end_frame + 1) / fps) for start_frame, end_frame in segments]
+        if not clip_extractor.extract_clips(video_path, time_ranges, output_filename, debug_dir):
+            print(f"Failed to write clips for '{object_name}' from {filename}")
+
+def draw_detections(frame, detections, object_names):
+    frame = frame.copy()
+    for object_id, conf, box in zip(detections.class_ids, detections.confidences, detections.boxes):
+        x1, y1, x2, y2 = (int(v) for v in box)
+        label = f"{object_names.get(int(object_id), object_id)} {conf:.2f}"
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(frame, label, (x1, max(y1 - 5, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    return frame
+
+def get_model_options():
+    return (model_path, backend, backend_int8, backend_calibration_data)
+
+def load_model():
+    return model_backends.load_model(*get_model_options())
+
+def get_model():
+    global model
+    with model_lock:
+        if model is None:
+            model = load_model()
+    return model
+
+def start_inference_server():
+    global inference_server
+    with inference_server_lock:
+        if use_inference_server and inference_server is None:
+            inference_server = InferenceServer(get_model_options(), inference_server_batch_frames, inference_server_max_wait_ms).start()
+    return inference_server
+
+def stop_inference_server():
+    # Videos started after this run the model in their own thread again, until the server is started again
+    global inference_server
+    with inference_server_lock:
+        server, inference_server = inference_server, None
+    if server is not None:
+        server.stop()
+
+def get_model_names():
+    return inference_server.names if inference_server is not None else get_model().names
+
+def run_model_batch(frames, predictor=None, region_of_interest=None):
+    # Detections (or the Exception the model raised) for every frame, through the inference server if one runs.
+    # With a region of interest the frames are its crops and the boxes are mapped back to the full frame
+    if inference_server is not None:
+        results = inference_server.predict(frames)
+    else:
+        results = predict_detections(predictor or get_model(), frames)
+    if region_of_interest is None:
+        return results
+    return [detections if isinstance(detections, Exception) else region_of_interest.map_detections(detections) for detections in results]
+
+def get_model_input(frame, region_of_interest):
+    return frame if region_of_interest is None else region_of_interest.crop(frame)
+
+def get_frame_signature(frame):
+    # What the motion gate compares, small enough that comparing two frames costs next to nothing
+    return cv2.cvtColor(cv2.resize(frame, MOTION_GATE_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+def scene_changed(signature, reference):
+    # Per tile rather than over the whole frame, so a small object appearing isn't averaged away
+    difference = cv2.absdiff(signature, reference)
+    return float(cv2.resize(difference, MOTION_GATE_TILES, interpolation=cv2.INTER_AREA).max()) >= motion_gate_threshold
+
+def frame_reader(cap, queue, decode_all_frames=True, metrics=NULL_METRICS, start_frame=0, signatures=None, region_of_interest=None, model_inputs=None):
+    # With the motion gate the signature of every frame the model may sample is put in signatures before the
+    # frame is queued, with a region of interest its crop is put in model_inputs. The gate then only looks at
+    # the region too
+    frame_num = start_frame
     while True:
-        success, frame = cap.read()
-        if not success:
+        start = metrics.now()
+        if decode_all_frames or frame_num % frame_check_interval == 0:
+            success, frame = cap.read()
+            if not success:
+                break
+            if enable_preprocessing:
+                frame = apply_histogram_equalization(frame)
+            metrics.record("read", start)
+            model_input = frame
+            if model_inputs is not None and frame_num % frame_check_interval == 0:
+                start = metrics.now()
+                model_input = model_inputs[frame_num] = region_of_interest.crop(frame)
+                metrics.record("roi_crop", start)
+            if signatures is not None and frame_num % frame_check_interval == 0:
+                start = metrics.now()
+                signatures[frame_num] = get_frame_signature(model_input)
+                metrics.record("motion_gate", start)
+            start = metrics.now()
+            queue.put((frame_num, frame))
+            metrics.record("read_wait", start)
+            metrics.sample_queue("frame_queue", queue)
+        elif not cap.grab():
+            # OpenCV still decodes grabbed frames, but the model never sees them so the colour conversion,
+            # the copy out of the decoder and the preprocessing are skipped
+            break
+        else:
+            metrics.record("read", start)
+        frame_num += 1
+    queue.put(None)
+
+def get_shard_model(shard_index):
+    if shard_index == 0:
+        return get_model()
+    # Every extra shard gets its own model instance so the shards don't share predictor state
+    with shard_models_lock:
+        while len(shard_models) < shard_index:
+            shard_models.append(load_model())
+        return shard_models[shard_index - 1]
+
+def detect_shard(video_path, start_frame, end_frame, fps, predictor, recorder, progress_bar, metrics=NULL_METRICS, region_of_interest=None):
+    # Runs the model over the sampled frames in [start_frame, end_frame) with a capture of its own, an end_frame
+    # of None reads to the end of the video
+    cap = open_capture_at(video_path, start_frame, fps)
+    if cap is None:
+        print(f"Error seeking to frame {start_frame} of {video_path}, the shard is skipped")
+        with print_lock:
+            progress_bar.update(max((end_frame if end_frame is not None else progress_bar.total) - start_frame, 0))
+        return
+
+    def flush(batch):
+        start = metrics.now()
+        results = run_model_batch([frame for _, frame in batch], predictor, region_of_interest)
+        metrics.record_model(start, len(batch))
+        for (frame_num, _), detections in zip(batch, results):
+            if isinstance(detections, Exception):
+                print(f"Error processing frame {frame_num}: {detections}")
+                recorder.add_failure(frame_num)
+            else:
+                recorder.add(frame_num, detections)
+
+    batch = []
+    frame_num = start_frame
+    last_progress = start_frame
+    while end_frame is None or frame_num < end_frame:
+        start = metrics.now()
+        if frame_num % frame_check_interval == 0:
+            success, frame = cap.read()
+            if not success:
+                break
+            if enable_preprocessing:
+                frame = apply_histogram_equalization(frame)
+            batch.append((frame_num, get_model_input(frame, region_of_interest)))
+        elif not cap.grab():
             break
+        metrics.record("read", start)
+        frame_num += 1
+
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+            with print_lock:
+                progress_bar.update(frame_num - last_progress)
+                metrics.set_frames(progress_bar.n)
+            last_progress = frame_num
+    if batch:
+        flush(batch)
+    with print_lock:
+        progress_bar.update((end_frame if end_frame is not None else frame_num) - last_progress)
+    cap.release()
+
+def run_sharded_detection(video_path, total_frames, fps, progress_bar, metrics=NULL_METRICS, region_of_interest=None):
+    # Split the video into time ranges that start on a sampled frame and detect them in parallel. The
+    # recorders are joined in frame order, so windowing them gives the same result as a sequential run.
+    # total_frames is only the container's estimate, so the last shard reads on to the end of the video
+    boundaries = [round(total_frames * i / shards / frame_check_interval) * frame_check_interval for i in range(shards)] + [None]
+    recorders = [DetectionRecorder() for _ in range(shards)]
+    threads = []
+    for shard_index in range(shards):
+        start_frame, end_frame = boundaries[shard_index], boundaries[shard_index + 1]
+        if end_frame is not None and start_frame >= end_frame:
+            continue
+        # The inference server batches the shards together, without it every shard needs a model of its own
+        predictor = get_shard_model(shard_index) if inference_server is None else None
+        thread = Thread(target=detect_shard, args=(video_path, start_frame, end_frame, fps, predictor, recorders[shard_index], progress_bar, metrics, region_of_interest))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    merged = recorders[0]
+    for shard_recorder in recorders[1:]:
+        merged.extend(shard_recorder)
+    return merged
+
+def get_coarse_search_stride(fps):
+    return max(round(coarse_search_seconds * fps / frame_check_interval), 1) * frame_check_interval
+
+def run_coarse_search(video_path, total_frames, fps, progress_bar, metrics=NULL_METRICS, region_of_interest=None):
+    # Returns a recorder with the detections of every frame the search ran the model on, in frame order
+    reader = FrameRangeReader(video_path, fps, apply_histogram_equalization if enable_preprocessing else None, COARSE_SEARCH_MAX_FORWARD_SECONDS)
+    names = get_model_names()
+    results = {}
+
+    def flush(batch):
+        start = metrics.now()
+        detections = run_model_batch([frame for _, frame in batch], region_of_interest=region_of_interest)
+        metrics.record_model(start, len(batch))
+        results.update(zip([frame_num for frame_num, _ in batch], detections))
+
+    def detect(frame_nums):
+        batch = []
+        for frame_num in frame_nums:
+            start = metrics.now()
+            frame = next(reader.read_range(frame_num, frame_num), None)
+            metrics.record("read", start)
+            if frame is None:
+                results[frame_num] = RuntimeError("couldn't read the frame")
+            else:
+                batch.append((frame_num, get_model_input(frame, region_of_interest)))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+            with print_lock:
+                progress_bar.update(max(frame_num + 1 - progress_bar.n, 0))
+        if batch:
+            flush(batch)
+        return [
+            not isinstance(results[frame_num], Exception) and any(
+                conf >= get_confidence_threshold(names.get(int(object_id)))
+                for object_id, conf in zip(results[frame_num].class_ids, results[frame_num].confidences)
+            )
+            for frame_num in frame_nums
+        ]
+
+    stride = get_coarse_search_stride(fps)
+    coarse_frames, regions = coarse_search.search(total_frames, frame_check_interval, stride, grace_period_val * frame_check_interval, detect)
+    reader.release()
+    with print_lock:
+        progress_bar.update(max(total_frames - progress_bar.n, 0))
+    print(f"Coarse search ran the model on {len(results)} frames: {len(coarse_frames)} every {stride} frames and {len(results) - len(coarse_frames)} in {len(regions)} refined regions")
+
+    recorder = DetectionRecorder()
+    for frame_num in sorted(results):
+        if isinstance(results[frame_num], Exception):
+            print(f"Error processing frame {frame_num}: {results[frame_num]}")
+            recorder.add_failure(frame_num)
+        else:
+            recorder.add(frame_num, results[frame_num])
+    return recorder
+
+def screen_keyframes(video_path, position, video_output_dir, debug_dir, write_clips, metrics=NULL_METRICS):
+    # Returns the candidate time ranges (start, end) in seconds of every object, cut out of the source with
+    # stream copy if write_clips
+    filename = os.path.basename(video_path)
+    cap = cv2.VideoCapture(video_path)
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    opened = cap.isOpened()
+    cap.release()
+    if not opened:
+        print(f"Error: Couldn't open video file {video_path}")
+        metrics.close()
+        return
+    region = roi.find_region(video_path, regions_of_interest)
+    region_of_interest = roi.RegionOfInterest(region, frame_width, frame_height) if region is not None else None
+
+    names = get_model_names()
+    keyframes = []
+    # Object name -> keyframe index -> peak confidence on that keyframe
+    detected = defaultdict(dict)
+    with print_lock:
+        progress_bar = tqdm(total=total_frames, position=position, leave=True, desc=filename)
+
+    def flush(batch):
+        start = metrics.now()
+        results = run_model_batch([frame for _, _, frame in batch], region_of_interest=region_of_interest)
+        metrics.record_model(start, len(batch))
+        for (index, frame_num, _), detections in zip(batch, results):
+            if isinstance(detections, Exception):
+                print(f"Error processing frame {frame_num}: {detections}")
+                continue
+            for object_id, conf in zip(detections.class_ids, detections.confidences):
+                object_name = names.get(int(object_id), f"Error! Unknown object {object_id}")
+                if conf >= get_confidence_threshold(object_name):
+                    detected[object_name][index] = max(detected[object_name].get(index, 0), float(conf))
+
+    batch = []
+    start = metrics.now()
+    for frame_num, frame in keyframe_screening.read_keyframes(video_path, frame_width, frame_height, fps):
         if enable_preprocessing:
             frame = apply_histogram_equalization(frame)
-        queue.put(frame)
-    queue.put(None)
+        metrics.record("read", start)
+        batch.append((len(keyframes), frame_num, get_model_input(frame, region_of_interest)))
+        keyframes.append(frame_num)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+        with print_lock:
+            progress_bar.update(max(frame_num + 1 - progress_bar.n, 0))
+            metrics.set_frames(progress_bar.n)
+        start = metrics.now()
+    if batch:
+        flush(batch)
+    with print_lock:
+        progress_bar.update(max(total_frames - progress_bar.n, 0))
+        progress_bar.close()
+
+    candidates = {}
+    with open(os.path.join(debug_dir, f'{filename}.log'), 'w') as log_file:
+        for object_name, peaks in detected.items():
+            candidates[object_name] = keyframe_screening.candidate_ranges(keyframes, sorted(peaks), total_frames)
+            for start_frame, end_frame in candidates[object_name]:
+                range_peaks = [peak for index, peak in peaks.items() if start_frame <= keyframes[index] <= end_frame]
+                log_file.write(
+                    f"\n==== Candidate range for '{object_name}' ====\n"
+                    f" - Start: {start_frame / fps:.2f} seconds\n"
+                    f" - End: {(end_frame + 1) / fps:.2f} seconds\n"
+                    f" - Keyframes with detections: {len(range_peaks)}\n"
+                    f" - Peak confidence level: {max(range_peaks):.2f}\n"
+                )
+    average_gop = total_frames / max(len(keyframes), 1) / fps
+    print(f"Screened {len(keyframes)} keyframes of {filename}, one every {average_gop:.1f} seconds on average, {sum(len(ranges) for ranges in candidates.values())} candidate ranges")
+
+    if write_clips and candidates:
+        start = metrics.now()
+        write_stream_copy_clips(video_path, filename, candidates, fps, video_output_dir, debug_dir)
+        metrics.record("clip_extraction", start)
+    metrics.set_frames(total_frames)
+    metrics.close()
+    return {object_name: [(start_frame / fps, (end_frame + 1) / fps) for start_frame, end_frame in ranges] for object_name, ranges in candidates.items()}
+
+def get_sampling_settings():
+    # With adaptive sampling the frames the model sees depend on which windows are open, so everything that
+    # opens or closes a window is part of the detection cache key. Frames the motion gate lets through reuse
+    # earlier detections, so its threshold is part of it too. The coarse search replaces both
+    if coarse_search_seconds > 0:
+        return {
+            "coarse_search_seconds": coarse_search_seconds,
+            "grace_period_val": grace_period_val,
+            "default_confidence_threshold": default_confidence_threshold,
+            "user_defined_confidence_thresholds": user_defined_confidence_thresholds,
+        }
+    settings = {}
+    if max_frame_check_interval > frame_check_interval:
+        settings.update({
+            "max_frame_check_interval": max_frame_check_interval,
+            "grace_period_val": grace_period_val,
+            "default_confidence_threshold": default_confidence_threshold,
+            "user_defined_confidence_thresholds": user_defined_confidence_thresholds,
+        })
+    if motion_gate_threshold > 0:
+        settings["motion_gate_threshold"] = motion_gate_threshold
+    return settings or None
+
+def replay_cached_windows(cache):
+    # Apply the current confidence thresholds to the cached detections and window them all at once
+    object_ids, row_objects = np.unique(cache.class_ids, return_inverse=True)
+    thresholds = np.array([get_confidence_threshold(cache.names.get(int(object_id))) for object_id in object_ids], dtype=np.float64)
+    passed = cache.confidences.astype(np.float64) >= thresholds[row_objects]
+    return compute_windows(
+        cache.sampled_frames,
+        cache.frame_nums[passed],
+        cache.class_ids[passed],
+        cache.confidences[passed],
+        grace_period_val * frame_check_interval,
+        failed_frames=cache.failed_frames,
+    )
 
-def frame_writer(queue, video_writer):
+def frame_writer(queue, video_writer, metrics=NULL_METRICS):
     while True:
+        start = metrics.now()
         item = queue.get()
+        metrics.record("write_wait", start)
         if item is None:
             break
         frame, object_name = item
+        start = metrics.now()
         video_writer[object_name].write(frame)
+        metrics.record("write", start)
         
 def apply_histogram_equalization(frame):
     ycrcb = cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb)
@@ -98,17 +510,30 @@ def create_directories(path_list):
     for path in path_list:
         os.makedirs(path, exist_ok=True)
         
-def logger_thread(log_queue, log_filepath):
-    with open(log_filepath, 'w') as log_file:
+def logger_thread(log_queue, log_filepath, metrics=NULL_METRICS, resume_log_size=None):
+    # A resumed video keeps its log up to the checkpoint and appends to it
+    if resume_log_size is not None and os.path.exists(log_filepath):
+        with open(log_filepath, 'r+') as log_file:
+            log_file.truncate(resume_log_size)
+    with open(log_filepath, 'w' if resume_log_size is None else 'a') as log_file:
         while True:
             log_message = log_queue.get()
             if log_message is None:
                 break
+            if isinstance(log_message, Event):
+                # Checkpoint barrier, everything queued before it is on disk once it is set
+                log_file.flush()
+                log_message.set()
+                continue
+            start = metrics.now()
             log_file.write(log_message)
+            metrics.record("log", start)
 
 #---------------------------------
 # Main program
-def main(video_path, position=1, input_directory="vods"):
+def main(video_path, position=1, input_directory="vods", write_clips=True):
+    # Returns the time ranges (start, end) in seconds of the saved windows of every object. Without write_clips
+    # only the windows are found and no output clips are written, like stream copy output without the cuts
     # Get the video name and define output directories
     filename = os.path.basename(video_path)
     video_name = os.path.splitext(filename)[0]
@@ -117,22 +542,77 @@ def main(video_path, position=1, input_directory="vods"):
 
     create_directories([output_dir, video_output_dir, debug_dir])
 
+    # Per stage timings, queue depths and model latencies, written to the debug directory while the video runs
+    metrics = NULL_METRICS
+    if enable_metrics:
+        metrics = PipelineMetrics(video_name, os.path.join(debug_dir, f'{video_name}.prom'), os.path.join(debug_dir, f'{video_name}-metrics.json'), metrics_interval_seconds)
+
+    print(f"Processing video: {filename}")
+    video_path = os.path.join(input_directory, filename)
+    if enable_keyframe_screening:
+        return screen_keyframes(video_path, position, video_output_dir, debug_dir, write_clips, metrics)
+
+    region = roi.find_region(video_path, regions_of_interest)
+
+    # Reuse the raw detections of an earlier run of the same video, model and frame interval if there is one
+    cache = None
+    recorder = None
+    if enable_detection_cache:
+        cache_key = detection_cache.get_cache_key(video_path, model_path, frame_check_interval, model_backends.variant_name(backend, backend_int8), get_sampling_settings(), region, histogram_equalization_weight if enable_preprocessing else None)
+        cache_path = os.path.join(video_output_dir, f'{video_name}-detections-{cache_key[:16]}.npz')
+        cache = detection_cache.load(cache_path, cache_key)
+        if cache is None:
+            recorder = detection_cache.DetectionRecorder()
+        else:
+            print(f"Replaying cached detections from {cache_path}")
+
+    # Continue an interrupted run of the same video and settings from its last checkpoint
+    checkpoint_path = os.path.join(debug_dir, f'{video_name}-checkpoint.npz')
+    checkpoint_settings = None
+    resume = None
+    if checkpoint_interval_seconds > 0 and cache is None:
+        checkpoint_settings = checkpoint.get_checkpoint_settings(video_path, {
+            "model_path": model_path,
+            "backend": model_backends.variant_name(backend, backend_int8),
+            "frame_check_interval": frame_check_interval,
+            "max_frame_check_interval": max_frame_check_interval,
+            "motion_gate_threshold": motion_gate_threshold,
+            "coarse_search_seconds": coarse_search_seconds,
+            "region_of_interest": region,
+            "grace_period_val": grace_period_val,
+            "min_detect_percent": min_detect_percent,
+            "default_confidence_threshold": default_confidence_threshold,
+            "user_defined_confidence_thresholds": user_defined_confidence_thresholds,
+            "enable_preprocessing": enable_preprocessing,
+            "histogram_equalization_weight": histogram_equalization_weight,
+            "output_mode": output_mode,
+            "write_clips": write_clips,
+            "log_output_only": log_output_only,
+            "detection_cache": enable_detection_cache,
+        })
+        resume = checkpoint.load(checkpoint_path, checkpoint_settings)
+        if resume is not None and resume.recorder is not None:
+            recorder = resume.recorder
+
     # Start the logger thread
     log_queue = Queue()
     log_filepath = os.path.join(debug_dir, f'{video_name}.log')
-    logger_thread_instance = Thread(target=logger_thread, args=(log_queue, log_filepath))
+    checkpoint_log_path = log_filepath
+    logger_thread_instance = Thread(target=logger_thread, args=(log_queue, log_filepath, metrics, resume.log_size if resume is not None else None))
     logger_thread_instance.start()
-
-    print(f"Processing video: {filename}")
-    video_path = os.path.join(input_directory, filename)
     
-    detection_windows = defaultdict(list)
-    currently_detected = defaultdict(bool)
-    gracep_counters = defaultdict(int)
     video_writers = {}
-    confidence_values = defaultdict(list)
-    # Initialize dictionary to store frames for each detected object
-    object_frames = defaultdict(list)
+    # Stream copy output only needs the first and last frame of every saved window
+    stream_copy = output_mode == "stream_copy" or not write_clips
+    saved_segments = defaultdict(list)
+    # Initialize dictionary to store frames for each detected object, bounded by the clip buffer memory budget
+    clip_buffer_budget = MemoryBudget(clip_buffer_memory_mb * 1024 * 1024)
+    scratch_dir = clip_buffer_scratch_dir or debug_dir
+    os.makedirs(scratch_dir, exist_ok=True)
+    # Resuming after a crash leaves the scratch files of the windows that were open at the time
+    scratch_name = video_name
+    remove_scratch_files(scratch_dir, scratch_name)
+    object_frames = defaultdict(lambda: ClipBuffer(clip_buffer_budget, scratch_dir, scratch_name))
     
     cap = cv2.VideoCapture(video_path)
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -142,135 +622,312 @@ def main(video_path, position=1, input_directory="vods"):
     
     if not cap.isOpened():
         print(f"Error: Couldn't open video file {video_path}")
+        log_queue.put(None)
+        metrics.close()
         return
+    region_of_interest = roi.RegionOfInterest(region, frame_width, frame_height) if region is not None else None
+
+    if resume is not None:
+        cap = seek_capture(cap, video_path, resume.next_frame, fps)
+        if cap is None:
+            print(f"Error: Couldn't seek {video_path} to the checkpoint at frame {resume.next_frame}, starting over")
+            resume = None
+            cap = cv2.VideoCapture(video_path)
 
     video_name = os.path.basename(video_path)
     with print_lock:
         progress_bar = tqdm(total=total_frames, position=position, leave=True, desc=video_name)
+        if resume is not None:
+            progress_bar.update(resume.next_frame)
     
     log_filepath = os.path.join(debug_dir, f'{video_name}.log')
     debug_video_output = None
     if debug:
         debug_video_output = cv2.VideoWriter(os.path.join(debug_dir, f'{video_name}-debug.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
     
-    frame_num = 0
     detected_object_ids = set()
     saved_objects = set()
 
+    # A coarse to fine search or long videos split into shards that are detected in parallel are detected up
+    # front and windowed afterwards. Shards not with adaptive sampling or the motion gate, where every sampled
+    # frame depends on the frames before it
+    coarse = coarse_search_seconds > 0 and cache is None and not debug and total_frames > 0 and resume is None
+    sequential_sampling = get_sampling_settings() is not None
+    sharded = shards > 1 and cache is None and not debug and total_frames > 0 and resume is None and not sequential_sampling
+    if coarse or sharded:
+        if coarse:
+            print(f"Searching {filename} coarse to fine")
+            detected_recorder = run_coarse_search(video_path, total_frames, fps, progress_bar, metrics, region_of_interest)
+        else:
+            print(f"Detecting {filename} in {shards} parallel shards")
+            detected_recorder = run_sharded_detection(video_path, total_frames, fps, progress_bar, metrics, region_of_interest)
+        cache = DetectionCache.from_recorder(detected_recorder, get_model_names(), total_frames, fps)
+        if recorder is not None:
+            recorder = detected_recorder
+
     frame_queue = Queue(maxsize=10)
     writer_queue = Queue(maxsize=10)
-    reader_thread = Thread(target=frame_reader, args=(cap, frame_queue))
-    writer_thread = Thread(target=frame_writer, args=(writer_queue, video_writers))
-    reader_thread.start()
+    # Without reencoded output or a debug video only the sampled frames need to be decoded
+    decode_all_frames = debug or not stream_copy
+    # A cached run that needs no pixels is windowed in one go straight from the cached arrays. So is a run that
+    # was detected up front, its reencoded output then only decodes the frames of the saved windows
+    replay_from_cache = cache is not None and (not decode_all_frames or coarse or sharded)
+    window_reader = FrameRangeReader(video_path, fps, apply_histogram_equalization if enable_preprocessing else None)
+    # Replayed detections already went through the motion gate when they were recorded
+    signatures = {} if motion_gate_threshold > 0 and cache is None else None
+    # The crops of the sampled frames, taken by the reader so the main loop only hands them to the model
+    model_inputs = {} if region_of_interest is not None and cache is None else None
+    reader_thread = Thread(target=frame_reader, args=(cap, frame_queue, decode_all_frames, metrics, resume.next_frame if resume is not None else 0, signatures, region_of_interest, model_inputs))
+    writer_thread = Thread(target=frame_writer, args=(writer_queue, video_writers, metrics))
+    if not replay_from_cache:
+        reader_thread.start()
     writer_thread.start()
 
+    object_names = cache.names if cache is not None else get_model_names()
+
+    def close_window(window):
+        object_id = window.object_id
+        object_name = object_names.get(object_id, f"Error! Unknown object {object_id}")
+        detection_percentage = window_detection_percentage(window)
+        saved_to_output = detection_percentage >= min_detect_percent
+
+        # Write the frames to the output file if the detection percentage meets the threshold
+        if saved_to_output:
+            saved_objects.add(object_name)
+            saved_segments[object_name].append((window.start_frame, window.end_frame))
+        if saved_to_output and not stream_copy:
+            if object_name not in video_writers:
+                video_writers[object_name] = initialize_video_writer(object_name, filename, frame_width, frame_height, fps, video_output_dir)
+            if replay_from_cache:
+                output_frames = window_reader.read_range(window.start_frame + 1, window.end_frame)
+            else:
+                output_frames = object_frames[object_id]
+            for output_frame in output_frames:
+                writer_queue.put((output_frame, object_name))
+                metrics.sample_queue("writer_queue", writer_queue)
+
+        log_detection_window(
+            log_queue=log_queue,
+            object_name=object_name,
+            timestamp=window.last_valid_frame / fps,
+            frame_count=window.frame_count,
+            window_length=window.window_length,
+            detection_percentage=detection_percentage,
+            avg_confidence=window.avg_confidence,
+            median_confidence=window.median_confidence,
+            peak_confidence=window.peak_confidence,
+            saved_to_output=saved_to_output,
+        )
+
+        # Clear the list of frames for the object at the end of the detection window
+        if object_id in object_frames:
+            object_frames[object_id].clear()
+
     with open(log_filepath, 'w') as log_file:
-        
-        object_names = model.names
-        while True:
-            frame = frame_queue.get()
-            if frame is None:
-                break
 
-            run_model = frame_num % frame_check_interval == 0
-
-            if run_model:
-                try:
-                    results = model(frame)
-                    detected_objects = set()
-                    for i, conf in enumerate(results[0].boxes.conf.cpu().numpy()):
-                        object_id = int(results[0].boxes.cls[i].cpu().numpy())
-                        object_name = results[0].names.get(object_id)
-                        if conf >= get_confidence_threshold(object_name):
-                            detected_objects.add(object_id)
-                            confidence_values[object_id].append(conf)
-
-                except Exception as e:
-                    print(f"Error processing frame {frame_num}: {e}")
-                    # Skipping the current frame
-                    frame_num += 1
-                    progress_bar.update(1)
+        if replay_from_cache:
+            start = metrics.now()
+            for window in replay_cached_windows(cache):
+                close_window(window)
+            metrics.record("windowing", start)
+            with print_lock:
+                progress_bar.update(max(total_frames - progress_bar.n, 0))
+
+        tracker = WindowTracker(grace_period_val * frame_check_interval)
+        last_sampled_frame = None
+        # (signature, detections) of the last frame the model ran on, sampled frames that look the same reuse them
+        gate_reference = None
+        gated_frames = 0
+        sampled_frames = 0
+        if resume is not None:
+            print(f"Resuming {filename} from its checkpoint at frame {resume.next_frame}")
+            tracker = resume.tracker
+            last_sampled_frame = resume.last_sampled_frame
+            gate_reference = resume.gate_reference
+            saved_segments.update(resume.saved_segments)
+            saved_objects.update(resume.saved_segments)
+            if not stream_copy:
+                # The output files of the interrupted run were never finalized, write the windows saved so far
+                # again and refill the clip buffers of the windows that are still open
+                for object_name, segments in resume.saved_segments.items():
+                    video_writers[object_name] = initialize_video_writer(object_name, filename, frame_width, frame_height, fps, video_output_dir)
+                    for start_frame, end_frame in segments:
+                        for output_frame in window_reader.read_range(start_frame + 1, end_frame):
+                            writer_queue.put((output_frame, object_name))
+                for object_id in sorted(tracker.open_objects):
+                    start_frame = tracker.windows[object_id].start_frame
+                    for output_frame in window_reader.read_range(start_frame + 1, resume.next_frame - 1):
+                        object_frames[object_id].append(output_frame)
+
+        def save_checkpoint(next_frame):
+            # Wait until the log holds every window closed so far, a resume cuts it back to this size
+            log_written = Event()
+            log_queue.put(log_written)
+            log_written.wait()
+            checkpoint.save(checkpoint_path, checkpoint_settings, next_frame, last_sampled_frame, tracker, saved_segments, recorder, os.path.getsize(checkpoint_log_path), gate_reference)
+
+        def sampling_interval():
+            # Dense while any object has grace left, sparse otherwise
+            return frame_check_interval if tracker.open_objects else max_frame_check_interval
+
+        def is_sampled(frame_num):
+            if frame_num % frame_check_interval != 0:
+                return False
+            return last_sampled_frame is None or frame_num - last_sampled_frame >= sampling_interval()
+
+        def is_gated(signature, reference):
+            return signature is not None and reference is not None and not scene_changed(signature, reference)
+
+        def upcoming_samples(index):
+            # The frames of the batch from index on that are sampled if no window opens or closes until its end,
+            # without the ones the motion gate would skip if every frame before them was detected as expected
+            interval = sampling_interval()
+            items = []
+            last_frame = last_sampled_frame
+            reference = gate_reference[0] if gate_reference is not None else None
+            for n, f in pending_frames[index:]:
+                if n % frame_check_interval == 0 and (last_frame is None or n - last_frame >= interval):
+                    last_frame = n
+                    signature = signatures.get(n) if signatures is not None else None
+                    if is_gated(signature, reference):
+                        continue
+                    items.append((n, f))
+                    reference = signature
+            return items
+
+        def detect(items):
+            if cache is not None:
+                return [cache.get(n) for n, _ in items]
+            start = metrics.now()
+            results = run_model_batch([model_inputs.pop(n) if model_inputs is not None else f for n, f in items], region_of_interest=region_of_interest)
+            metrics.record_model(start, len(items))
+            return results
+
+        last_checkpoint_time = time.monotonic()
+        pending_frames = []
+        pending_sampled = 0
+        end_of_video = replay_from_cache
+        while not end_of_video:
+            start = metrics.now()
+            item = frame_queue.get()
+            metrics.record("main_wait", start)
+            if item is None:
+                end_of_video = True
+            else:
+                # Collect frames until the batch holds batch_size frames that the model has to see
+                pending_frames.append(item)
+                if item[0] % frame_check_interval == 0:
+                    pending_sampled += 1
+                if pending_sampled < batch_size:
                     continue
 
-                # Update the frame with detection results if in debug mode
-                if debug:
-                    frame = results[0].plot()
-            else:
-                detected_objects = set()
-
-            # Write the (potentially updated) frame to the debug video
-            if debug:
-                debug_video_output.write(frame)
-            
-            for object_id in currently_detected:
-                if currently_detected[object_id]:
-                    object_frames[object_id].append(frame)
-            
-            for object_id in detected_objects:
-                detection_windows[object_id].append(frame_num)
-                gracep_counters[object_id] = grace_period_val * frame_check_interval
-
-            for object_id in gracep_counters:
-                object_name = object_names[object_id] if object_id < len(object_names) else f"Error! Unknown object {object_id}"
-
-                if object_id not in detected_objects and run_model:
-                    if gracep_counters[object_id] > 0:
-                        detection_windows[object_id].append(-1)
-                        gracep_counters[object_id] -= frame_check_interval
+            # Detections of the frames of this batch the model already ran on. Without adaptive sampling that is
+            # every sampled frame of the batch in one model call. With it the frames are chosen one by one as the
+            # windows open and close, and the model runs on the frames the current interval would sample next
+            # whenever it reaches one it has no detections for
+            batch_results = {}
+            start = metrics.now()
+            for index, (frame_num, frame) in enumerate(pending_frames):
+                run_model = is_sampled(frame_num)
+
+                if run_model:
+                    sampled_frames += 1
+                    signature = signatures.get(frame_num) if signatures is not None else None
+                    if is_gated(signature, gate_reference[0] if gate_reference is not None else None):
+                        detections = gate_reference[1]
+                        gated_frames += 1
+                        metrics.record_gated(1)
                     else:
-                        gracep_counters[object_id] = 0
-
-            for object_id, window in detection_windows.items():
-                object_name = object_names.get(object_id, f"Error! Unknown object {object_id}")
-
-                if gracep_counters[object_id] > 0:
-                    currently_detected[object_id] = True
-                else:
-                    if currently_detected[object_id]:
-                        detection_percentage = sum(1 for f in window if f >= 0) / max(len(window), 1)
-                        last_valid_frame = max((f for f in window if f >= 0), default=frame_num)
-                        timestamp = last_valid_frame / fps
-                        saved_to_output = detection_percentage >= min_detect_percent
-                        
-                        # Write the frames to the output file if the detection percentage meets the threshold
-                        if saved_to_output:
-                            saved_objects.add(object_name)
-                            if object_name not in video_writers:
-                                video_writers[object_name] = initialize_video_writer(object_name, filename, frame_width, frame_height, fps, video_output_dir)
-                            for output_frame in object_frames[object_id]:
-                                writer_queue.put((output_frame, object_name))
-
-                        log_detection_window(
-                            log_queue=log_queue,
-                            object_name=object_name,
-                            timestamp=timestamp,
-                            frame_count=len([f for f in window if f >= 0]),
-                            window_length=len(window),
-                            detection_percentage=detection_percentage,
-                            confidence_values=confidence_values[object_id],
-                            saved_to_output=saved_to_output,
-                        )
-                        
-                         # Clear the list of frames for the object at the end of the detection window
-                        object_frames[object_id] = []
-
-                        detection_windows[object_id] = []
-                        currently_detected[object_id] = False
-                        confidence_values[object_id] = []
+                        if frame_num not in batch_results:
+                            items = upcoming_samples(index)
+                            batch_results.update(zip([n for n, _ in items], detect(items)))
+                        detections = batch_results[frame_num]
+                        if signature is not None:
+                            # A failed frame has nothing to reuse, the next sample runs the model again
+                            gate_reference = None if isinstance(detections, Exception) else (signature, detections)
+                    # Only the frames that were used are recorded, so the cache replays the same sampling
+                    if recorder is not None and cache is None:
+                        if isinstance(detections, Exception):
+                            recorder.add_failure(frame_num)
+                        else:
+                            recorder.add(frame_num, detections)
+                    if isinstance(detections, Exception):
+                        print(f"Error processing frame {frame_num}: {detections}")
+                        # Skipping the current frame, the next sample must not spend grace for it either
+                        last_sampled_frame = frame_num
+                        progress_bar.update(frame_num + 1 - progress_bar.n)
+                        continue
+
+                    detected_objects = defaultdict(list)
+                    for object_id, conf in zip(detections.class_ids, detections.confidences):
+                        object_id = int(object_id)
+                        if conf >= get_confidence_threshold(object_names.get(object_id)):
+                            detected_objects[object_id].append(conf)
+
+                    # Update the frame with detection results if in debug mode
+                    if debug:
+                        frame = draw_detections(frame, detections, object_names)
+
+                # Write the (potentially updated) frame to the debug video
+                if debug:
+                    debug_video_output.write(frame)
+
+                if not stream_copy:
+                    for object_id in tracker.open_objects:
+                        object_frames[object_id].append(frame)
+
+                if run_model:
+                    gap = frame_num - last_sampled_frame if last_sampled_frame is not None else frame_check_interval
+                    last_sampled_frame = frame_num
+                    for window in tracker.update(frame_num, detected_objects, gap):
+                        close_window(window)
+
+                with print_lock:
+                    progress_bar.update(frame_num + 1 - progress_bar.n)
+
+            metrics.record("windowing", start)
+            metrics.set_frames(progress_bar.n)
+            for frame_num, _ in pending_frames:
+                if signatures is not None:
+                    signatures.pop(frame_num, None)
+                if model_inputs is not None:
+                    model_inputs.pop(frame_num, None)
+            if checkpoint_settings is not None and not end_of_video and time.monotonic() - last_checkpoint_time >= checkpoint_interval_seconds:
+                start = metrics.now()
+                save_checkpoint(pending_frames[-1][0] + 1)
+                metrics.record("checkpoint", start)
+                last_checkpoint_time = time.monotonic()
+            pending_frames = []
+            pending_sampled = 0
 
-            with print_lock:
-                progress_bar.update(1)
-            frame_num += 1
-            
         detected_object_names = [object_names.get(object_id, f"Error! Unknown object {object_id}") for object_id in detected_object_ids]
         with print_lock:
+            if not decode_all_frames and not replay_from_cache:
+                # Grabbed frames after the last sampled one never reach this loop
+                progress_bar.update(max(total_frames - progress_bar.n, 0))
             progress_bar.close()
         
         writer_queue.put(None)
         writer_thread.join()
+
+        # Drop the frames of windows that were still open at the end of the video
+        for clip_buffer in object_frames.values():
+            clip_buffer.clear()
         
         for writer in video_writers.values():
             writer.release()
+
+        if recorder is not None:
+            recorder.save(cache_path, cache_key, object_names, total_frames, fps)
+
+        if stream_copy and write_clips and saved_segments:
+            start = metrics.now()
+            write_stream_copy_clips(video_path, filename, saved_segments, fps, video_output_dir, debug_dir)
+            metrics.record("clip_extraction", start)
+        if checkpoint_settings is not None:
+            checkpoint.remove(checkpoint_path)
+        if signatures is not None:
+            print(f"Motion gate reused detections for {gated_frames} of {sampled_frames} sampled frames of {filename}")
         print(f"\n------------\nProcessed video: {filename}")
         # Organizing the output
         #with print_lock:
@@ -287,7 +944,12 @@ def main(video_path, position=1, input_directory="vods"):
     if debug:    
         debug_video_output.release()
     cap.release()
+    window_reader.release()
     log_queue.put(None)
+    logger_thread_instance.join()
+    metrics.set_frames(progress_bar.n)
+    metrics.close()
+    return {object_name: [(start_frame / fps, (end_frame + 1) / fps) for start_frame, end_frame in segments] for object_name, segments in saved_segments.items()}
         
 if __name__ == '__main__':
     main()
@@ -0,0 +1,179 @@
+import itertools
+import multiprocessing
+import queue
+import time
+from threading import Event, Lock, Thread
+from detection_cache import Detections
+import model_backends
+
+# How often a waiting predict() checks that the server process is still running
+SERVER_CHECK_SECONDS = 1
+
+# A separate process that owns the YOLO model. Every video pipeline submits its batches of sampled frames
+# through a request queue, the server coalesces the requests that arrive within max_wait_ms of each other
+# (from any number of videos) into one model call of up to max_batch_frames frames and sends the detections
+# back. Inference threads then only decode and window, and the model runs one large batch at a time instead
+# of several small ones fighting over the GIL.
+
+def result_to_detections(result):
+    boxes = result.boxes
+    return Detections(boxes.cls.cpu().numpy().astype(int), boxes.conf.cpu().numpy(), boxes.xyxy.cpu().numpy())
+
+def picklable_error(error):
+    # Exceptions go back through the response queue, one that can't be pickled would be dropped by the queue's
+    # feeder thread and leave the client waiting, so only the type and message are sent
+    return RuntimeError(f"{type(error).__name__}: {error}")
+
+def predict_detections(predictor, frames):
+    # Run every frame through the predictor in a single call
+    global batch_failure_logged
+    try:
+        return [result_to_detections(result) for result in predictor(frames)]
+    except Exception as e:
+        if not batch_failure_logged:
+            batch_failure_logged = True
+            print(f"Batched inference failed, running the frames one at a time instead: {e}")
+    # Fall back to one call per frame so a single bad frame is skipped like before instead of the whole batch
+    detections = []
+    for frame in frames:
+        try:
+            detections.append(result_to_detections(predictor(frame)[0]))
+        except Exception as e:
+            detections.append(e)
+    return detections
+
+batch_failure_logged = False
+
+def collect_batch(request_queue, max_batch_frames, max_wait_ms):
+    # Blocks for the first request, then keeps adding requests until the batch is full or the wait runs out
+    first = request_queue.get()
+    if first is None:
+        return None
+    requests = [first]
+    num_frames = len(first[1])
+    deadline = time.monotonic() + max_wait_ms / 1000
+    while num_frames < max_batch_frames:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            request = request_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if request is None:
+            request_queue.put(None)
+            break
+        requests.append(request)
+        num_frames += len(request[1])
+    return requests
+
+def serve(model_options, request_queue, response_queue, max_batch_frames, max_wait_ms):
+    # Runs in the server process, the model stack is only imported here. model_options are the arguments of
+    # model_backends.load_model
+    import logging
+    logging.getLogger('ultralytics').setLevel(logging.CRITICAL)
+
+    try:
+        model = model_backends.load_model(*model_options)
+    except Exception as e:
+        response_queue.put(("error", picklable_error(e)))
+        return
+    response_queue.put(("ready", dict(model.names)))
+
+    while True:
+        requests = collect_batch(request_queue, max_batch_frames, max_wait_ms)
+        if requests is None:
+            break
+        frames = [frame for _, request_frames in requests for frame in request_frames]
+        detections = [
+            picklable_error(detection) if isinstance(detection, Exception) else detection
+            for detection in predict_detections(model, frames)
+        ]
+        offset = 0
+        for request_id, request_frames in requests:
+            response_queue.put((request_id, detections[offset:offset + len(request_frames)]))
+            offset += len(request_frames)
+
+class InferenceServer:
+    # Client side handle of the server process, predict() may be called from any number of threads
+    def __init__(self, model_options, max_batch_frames=16, max_wait_ms=20):
+        context = multiprocessing.get_context("spawn")
+        self.request_queue = context.Queue()
+        self.response_queue = context.Queue()
+        self.process = context.Process(
+            target=serve,
+            args=(model_options, self.request_queue, self.response_queue, max_batch_frames, max_wait_ms),
+            daemon=True,
+        )
+        self.request_ids = itertools.count()
+        self.pending = {}
+        self.pending_lock = Lock()
+        self.names = None
+        self.dispatcher = None
+
+    def start(self):
+        self.process.start()
+        while True:
+            try:
+                status, payload = self.response_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Inference server exited with code {self.process.exitcode} while loading the model")
+        if status == "error":
+            self.process.join()
+            raise RuntimeError(f"Inference server failed to load the model: {payload}")
+        self.names = payload
+        self.dispatcher = Thread(target=self.dispatch_responses, daemon=True)
+        self.dispatcher.start()
+        return self
+
+    def dispatch_responses(self):
+        # Hands every response to the thread waiting for it
+        while True:
+            item = self.response_queue.get()
+            if item is None:
+                break
+            request_id, detections = item
+            with self.pending_lock:
+                waiting = self.pending.pop(request_id, None)
+            # predict() gives up on a request when the server dies, a response can still arrive for it afterwards
+            if waiting is None:
+                continue
+            done, results = waiting
+            results.append(detections)
+            done.set()
+
+    def predict(self, frames):
+        # Returns one Detections (or the Exception the model raised) per frame, in order
+        if not frames:
+            return []
+        request_id = next(self.request_ids)
+        done = Event()
+        results = []
+        with self.pending_lock:
+            self.pending[request_id] = (done, results)
+        if self.process.is_alive():
+            self.request_queue.put((request_id, list(frames)))
+        while not done.wait(SERVER_CHECK_SECONDS if self.process.is_alive() else 0):
+            if self.process.is_alive():
+                continue
+            with self.pending_lock:
+                abandoned = self.pending.pop(request_id, None) is not None
+            if abandoned:
+                # The frames fail like a model error would, so the callers skip them and carry on
+                error = RuntimeError(f"Inference server isn't running (exit code {self.process.exitcode})")
+                return [error] * len(frames)
+            # The dispatcher took the response just before the check, it's about to be handed over
+            done.wait()
+        return results[0]
+
+    def stop(self):
+        self.request_queue.put(None)
+        self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.response_queue.put(None)
+        if self.dispatcher is not None:
+            self.dispatcher.join()
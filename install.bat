@@ -21,4 +21,7 @@ pip install requests
 pip install streamlink
 pip install windows-curses
 
+REM Optional, only needed for the onnx and openvino inference backends (see backend in the README)
+REM pip install onnx onnxruntime openvino
+
 echo All necessary libraries have been installed!
\ No newline at end of file
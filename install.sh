@@ -19,4 +19,7 @@ pip3 install requests
 # Replace this line with the relevant torch version from this site https://pytorch.org/get-started/locally/
 pip3 install torch torchvision torchaudio
 
+# Optional, only needed for the onnx and openvino inference backends (see backend in the README)
+# pip3 install onnx onnxruntime openvino
+
 echo "All necessary libraries have been installed!"
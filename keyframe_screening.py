@@ -0,0 +1,100 @@
+import json
+import re
+import subprocess
+from queue import Queue
+from threading import Thread
+import numpy as np
+import clip_extractor
+
+# First pass screening that only decodes the keyframes of a video. ffmpeg is told to skip every frame that
+# isn't a keyframe before decoding it, so a VOD with a 2 second GOP costs a 60th of the decoding at 30 fps. The
+# model runs on those frames and every keyframe with a detection marks the stretch between the keyframes
+# around it as a candidate range, to be cut out or searched at the full frame rate afterwards.
+
+# The timestamp of every frame comes from the showinfo filter on stderr, in the same order as the raw frames
+# on stdout. GOPs don't have a fixed length (streams insert keyframes on scene cuts, recordings can switch
+# between 2 and 10 second GOPs), so frame numbers are always taken from the timestamps and never counted
+SHOWINFO_PTS_TIME = re.compile(r"\bpts_time:\s*(-?[0-9.]+)")
+
+# -fps_mode replaced -vsync in ffmpeg 5.1, older builds only know -vsync. Looked up once, see get_passthrough_args
+passthrough_args = None
+
+def get_passthrough_args():
+    # Every decoded keyframe has to come out once, without passthrough the rawvideo output is made constant
+    # frame rate and the keyframes are duplicated to fill the gaps between them
+    global passthrough_args
+    if passthrough_args is None:
+        try:
+            options = subprocess.run(['ffmpeg', '-hide_banner', '-h', 'long'], capture_output=True).stdout
+        except OSError:
+            options = b''
+        passthrough_args = ['-vsync', 'passthrough'] if b'-fps_mode' not in options and b'-vsync' in options else ['-fps_mode', 'passthrough']
+    return passthrough_args
+
+def get_start_time(video_path):
+    # ffmpeg moves the start of the file to pts_time 0, but the video stream of a recording or a cut VOD often
+    # starts later than the file (audio priming, a stream joined mid GOP). OpenCV counts frames from the video
+    # stream's first frame, so the video's start relative to the file is taken off every timestamp
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=start_time:format=start_time', '-of', 'json', video_path]
+    try:
+        output = subprocess.run(cmd, capture_output=True).stdout
+    except OSError:
+        print(f"ffprobe isn't on the PATH, the keyframes of {video_path} may be numbered a frame or so off")
+        return 0.0
+    try:
+        info = json.loads(output)
+        return float(info["streams"][0]["start_time"]) - float(info["format"]["start_time"])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return 0.0
+
+def read_timestamps(stderr, timestamps):
+    for line in stderr:
+        match = SHOWINFO_PTS_TIME.search(line.decode(errors='replace'))
+        if match:
+            timestamps.put(float(match.group(1)))
+    timestamps.put(None)
+
+def read_keyframes(video_path, width, height, fps):
+    # Yields (frame_num, frame) for every keyframe, frame_num counted from the first frame like OpenCV does
+    start_time = get_start_time(video_path)
+    cmd = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-loglevel', 'info',
+        '-skip_frame', 'nokey', '-i', video_path,
+        '-map', '0:v:0', '-vf', f'showinfo,scale={width}:{height}', *get_passthrough_args(),
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-',
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    timestamps = Queue()
+    timestamp_reader = Thread(target=read_timestamps, args=(process.stderr, timestamps), daemon=True)
+    timestamp_reader.start()
+    frame_size = width * height * 3
+    finished = False
+    try:
+        while True:
+            buffer = bytearray(frame_size)
+            if process.stdout.readinto(buffer) < frame_size:
+                finished = True
+                break
+            pts_time = timestamps.get()
+            if pts_time is None:
+                finished = True
+                break
+            yield int(round((pts_time - start_time) * fps)), np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+    finally:
+        process.stdout.close()
+        if not finished:
+            process.kill()
+        if process.wait() != 0 and finished:
+            print(f"ffmpeg couldn't decode the keyframes of {video_path}")
+        timestamp_reader.join()
+        process.stderr.close()
+
+def candidate_ranges(keyframes, detected, total_frames):
+    # keyframes holds the frame numbers of the keyframes in order, detected the indices of the ones with a
+    # detection. The frames between keyframes were never looked at, so an object seen on one may have been there
+    # since the keyframe before and stay until the one after. Returns inclusive (start_frame, end_frame) ranges
+    ranges = [
+        (keyframes[index - 1] if index > 0 else 0, keyframes[index + 1] if index + 1 < len(keyframes) else total_frames - 1)
+        for index in detected
+    ]
+    return clip_extractor.merge_segments(ranges)
@@ -0,0 +1,187 @@
+import os
+from collections import defaultdict
+from queue import Queue
+from threading import Thread
+import cv2
+import clip_extractor
+import inference
+import roi
+from clip_buffer import ClipBuffer, MemoryBudget, remove_scratch_files
+from windowing import WindowTracker, window_detection_percentage
+
+# Inference on a stream that is still being recorded. The recorder writes short MPEG-TS segments and every
+# segment is handed to a LiveSession as soon as it is complete. Frame numbers, open windows and clip buffers
+# carry over from one segment to the next, so the windows are the same as if the whole recording was processed
+# at once. Each saved window is written as its own clip the moment it closes instead of one file per object at
+# the end, which puts the clips a segment length or so behind live.
+
+class LiveSession:
+    def __init__(self, stream_name):
+        self.stream_name = stream_name
+        self.video_output_dir = os.path.join(inference.output_dir, stream_name)
+        self.debug_dir = os.path.join(self.video_output_dir, "debug")
+        inference.create_directories([inference.output_dir, self.video_output_dir, self.debug_dir])
+
+        self.log_queue = Queue()
+        self.logger = Thread(target=inference.logger_thread, args=(self.log_queue, os.path.join(self.debug_dir, f'{stream_name}.log')))
+        self.logger.start()
+
+        self.stream_copy = inference.output_mode == "stream_copy"
+        self.tracker = WindowTracker(inference.grace_period_val * inference.frame_check_interval)
+        self.last_sampled_frame = None
+        clip_buffer_budget = MemoryBudget(inference.clip_buffer_memory_mb * 1024 * 1024)
+        scratch_dir = inference.clip_buffer_scratch_dir or self.debug_dir
+        os.makedirs(scratch_dir, exist_ok=True)
+        # Named after the channel, which only has one live session at a time, so a new session removes the
+        # scratch files an earlier one left when the program was killed
+        channel_name = stream_name.rsplit('_', 1)[0]
+        remove_scratch_files(scratch_dir, channel_name)
+        self.object_frames = defaultdict(lambda: ClipBuffer(clip_buffer_budget, scratch_dir, channel_name))
+        self.object_names = None
+        self.fps = None
+        self.frame_size = None
+        self.region_of_interest = None
+        # (path, first frame) of every segment seen so far, stream copy clips are cut from them
+        self.segments = []
+        self.next_frame = 0
+        self.saved_windows = 0
+
+    def process_segment(self, segment_path):
+        cap = cv2.VideoCapture(segment_path)
+        if not cap.isOpened():
+            print(f"Error: Couldn't open stream segment {segment_path}")
+            return
+        if self.fps is None:
+            self.fps = cap.get(cv2.CAP_PROP_FPS)
+            self.frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            self.object_names = inference.get_model_names()
+            # Recordings are named after their channel, so are the segments
+            region = roi.find_region(segment_path, inference.regions_of_interest)
+            if region is not None:
+                self.region_of_interest = roi.RegionOfInterest(region, *self.frame_size)
+        self.segments.append((segment_path, self.next_frame))
+
+        pending_frames = []
+        pending_sampled = 0
+        while True:
+            frame_num = self.next_frame
+            if not self.stream_copy or frame_num % inference.frame_check_interval == 0:
+                success, frame = cap.read()
+                if not success:
+                    break
+                if inference.enable_preprocessing:
+                    frame = inference.apply_histogram_equalization(frame)
+                pending_frames.append((frame_num, frame))
+                if frame_num % inference.frame_check_interval == 0:
+                    pending_sampled += 1
+            elif not cap.grab():
+                break
+            self.next_frame += 1
+
+            if pending_sampled >= inference.batch_size:
+                self.process_frames(pending_frames)
+                pending_frames = []
+                pending_sampled = 0
+        # Nothing is held back at the end of a segment, the next one may only arrive seconds later
+        self.process_frames(pending_frames)
+        cap.release()
+
+    def process_frames(self, pending_frames):
+        sampled_items = [(n, f) for n, f in pending_frames if n % inference.frame_check_interval == 0]
+        model_inputs = [inference.get_model_input(f, self.region_of_interest) for _, f in sampled_items]
+        batch_results = iter(inference.run_model_batch(model_inputs, region_of_interest=self.region_of_interest) if sampled_items else [])
+
+        for frame_num, frame in pending_frames:
+            run_model = frame_num % inference.frame_check_interval == 0
+            if run_model:
+                detections = next(batch_results)
+                if isinstance(detections, Exception):
+                    print(f"Error processing frame {frame_num} of {self.stream_name}: {detections}")
+                    self.last_sampled_frame = frame_num
+                    continue
+
+                detected_objects = defaultdict(list)
+                for object_id, conf in zip(detections.class_ids, detections.confidences):
+                    object_id = int(object_id)
+                    if conf >= inference.get_confidence_threshold(self.object_names.get(object_id)):
+                        detected_objects[object_id].append(conf)
+
+            if not self.stream_copy:
+                for object_id in self.tracker.open_objects:
+                    self.object_frames[object_id].append(frame)
+
+            if run_model:
+                gap = frame_num - self.last_sampled_frame if self.last_sampled_frame is not None else inference.frame_check_interval
+                self.last_sampled_frame = frame_num
+                for window in self.tracker.update(frame_num, detected_objects, gap):
+                    self.close_window(window)
+
+    def close_window(self, window):
+        object_id = window.object_id
+        object_name = self.object_names.get(object_id, f"Error! Unknown object {object_id}")
+        detection_percentage = window_detection_percentage(window)
+        saved_to_output = detection_percentage >= inference.min_detect_percent
+
+        if saved_to_output:
+            output_filename = os.path.join(self.video_output_dir, f'{object_name}-{self.stream_name}-{self.saved_windows:04d}.mp4')
+            self.saved_windows += 1
+            if self.stream_copy:
+                self.write_stream_copy_clip(window, output_filename)
+            else:
+                video_writer = cv2.VideoWriter(output_filename, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.frame_size)
+                for output_frame in self.object_frames[object_id]:
+                    video_writer.write(output_frame)
+                video_writer.release()
+
+        inference.log_detection_window(
+            log_queue=self.log_queue,
+            object_name=object_name,
+            timestamp=window.last_valid_frame / self.fps,
+            frame_count=window.frame_count,
+            window_length=window.window_length,
+            detection_percentage=detection_percentage,
+            avg_confidence=window.avg_confidence,
+            median_confidence=window.median_confidence,
+            peak_confidence=window.peak_confidence,
+            saved_to_output=saved_to_output,
+        )
+        if object_id in self.object_frames:
+            self.object_frames[object_id].clear()
+
+    def write_stream_copy_clip(self, window, output_filename):
+        # Same time range main() cuts, taken from every segment the window spans and joined like the parts of
+        # extract_clips
+        start_frame, end_frame = window.start_frame, window.end_frame + 1
+        name = os.path.splitext(os.path.basename(output_filename))[0]
+        part_paths = []
+        success = True
+        for index, (segment_path, first_frame) in enumerate(self.segments):
+            next_first_frame = self.segments[index + 1][1] if index + 1 < len(self.segments) else self.next_frame
+            if next_first_frame <= start_frame or first_frame >= end_frame:
+                continue
+            part_path = os.path.join(self.debug_dir, f'{name}.part{len(part_paths):04d}.mp4')
+            start = (max(start_frame, first_frame) - first_frame) / self.fps
+            end = (min(end_frame, next_first_frame) - first_frame) / self.fps
+            if not clip_extractor.cut_segment(segment_path, start, end, part_path):
+                success = False
+                break
+            part_paths.append(part_path)
+
+        if success and len(part_paths) == 1:
+            os.replace(part_paths[0], output_filename)
+            part_paths = []
+        elif success:
+            success = clip_extractor.concat_segments(part_paths, output_filename, self.debug_dir)
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        if not success:
+            print(f"Failed to write the clip {output_filename} from {self.stream_name}")
+
+    def finish(self):
+        # Windows still open when the stream ends are dropped, like at the end of a video
+        for clip_buffer in self.object_frames.values():
+            clip_buffer.clear()
+        self.log_queue.put(None)
+        self.logger.join()
+        print(f"\n------------\nProcessed stream: {self.stream_name}")
@@ -0,0 +1,181 @@
+import json
+import os
+import time
+from array import array
+from collections import defaultdict
+from threading import Event, Lock, Thread
+import numpy as np
+
+# Per video pipeline instrumentation. Every stage reports the time it spent (now() before, record() after),
+# queue depths are sampled whenever an item goes through, and the model reports the latency of every call.
+# The totals are written live as a Prometheus text file and as a JSON summary when the video is done.
+# NullMetrics has the same interface and does nothing, so a disabled run only pays for a few empty calls.
+
+MODEL_LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+class NullMetrics:
+    def now(self):
+        return 0
+
+    def record(self, stage, start):
+        pass
+
+    def record_model(self, start, num_frames):
+        pass
+
+    def record_gated(self, num_frames):
+        pass
+
+    def sample_queue(self, name, queue):
+        pass
+
+    def set_frames(self, frames):
+        pass
+
+    def close(self):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+class PipelineMetrics:
+    def __init__(self, video_name, prometheus_path, json_path, interval_seconds=5):
+        self.video_name = video_name
+        self.prometheus_path = prometheus_path
+        self.json_path = json_path
+        self.interval_seconds = interval_seconds
+        self.start_time = time.perf_counter()
+        self.lock = Lock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.model_latencies = array('d')
+        self.model_frames = 0
+        self.gated_frames = 0
+        self.queue_depth = {}
+        self.queue_depth_max = defaultdict(int)
+        self.queue_depth_sum = defaultdict(int)
+        self.queue_samples = defaultdict(int)
+        self.frames = 0
+        self.stopped = Event()
+        self.exporter = Thread(target=self.export_loop, daemon=True)
+        self.exporter.start()
+
+    def now(self):
+        return time.perf_counter()
+
+    def record(self, stage, start):
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.stage_seconds[stage] += elapsed
+            self.stage_calls[stage] += 1
+
+    def record_model(self, start, num_frames):
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.stage_seconds["model"] += elapsed
+            self.stage_calls["model"] += 1
+            self.model_latencies.append(elapsed)
+            self.model_frames += num_frames
+
+    def record_gated(self, num_frames):
+        # Sampled frames that reused earlier detections instead of running the model
+        with self.lock:
+            self.gated_frames += num_frames
+
+    def sample_queue(self, name, queue):
+        depth = queue.qsize()
+        with self.lock:
+            self.queue_depth[name] = depth
+            self.queue_depth_max[name] = max(self.queue_depth_max[name], depth)
+            self.queue_depth_sum[name] += depth
+            self.queue_samples[name] += 1
+
+    def set_frames(self, frames):
+        self.frames = frames
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.start_time
+            latencies = np.frombuffer(self.model_latencies, dtype=np.float64).copy()
+            return {
+                "video": self.video_name,
+                "elapsed_seconds": elapsed,
+                "frames": self.frames,
+                "frames_per_second": self.frames / elapsed if elapsed > 0 else 0,
+                "stages": {
+                    stage: {"seconds": seconds, "calls": self.stage_calls[stage]}
+                    for stage, seconds in sorted(self.stage_seconds.items())
+                },
+                "model": {
+                    "calls": len(latencies),
+                    "frames": self.model_frames,
+                    "gated_frames": self.gated_frames,
+                    "latency_seconds": {
+                        str(quantile): float(np.quantile(latencies, quantile)) if len(latencies) else 0
+                        for quantile in MODEL_LATENCY_QUANTILES
+                    },
+                },
+                "queues": {
+                    name: {
+                        "depth": self.queue_depth[name],
+                        "max_depth": self.queue_depth_max[name],
+                        "mean_depth": self.queue_depth_sum[name] / max(self.queue_samples[name], 1),
+                    }
+                    for name in sorted(self.queue_depth)
+                },
+            }
+
+    def prometheus_text(self, summary):
+        video = summary["video"].replace("\\", "\\\\").replace('"', '\\"')
+        lines = [
+            "# HELP vodetect_frames_total Frames of the video processed so far",
+            "# TYPE vodetect_frames_total counter",
+            f'vodetect_frames_total{{video="{video}"}} {summary["frames"]}',
+            "# HELP vodetect_frames_per_second Frames processed per second since the video started",
+            "# TYPE vodetect_frames_per_second gauge",
+            f'vodetect_frames_per_second{{video="{video}"}} {summary["frames_per_second"]:.3f}',
+            "# HELP vodetect_stage_seconds_total Time spent in each pipeline stage",
+            "# TYPE vodetect_stage_seconds_total counter",
+        ]
+        for stage, values in summary["stages"].items():
+            lines.append(f'vodetect_stage_seconds_total{{video="{video}",stage="{stage}"}} {values["seconds"]:.6f}')
+        lines += ["# HELP vodetect_stage_calls_total Number of times each pipeline stage ran", "# TYPE vodetect_stage_calls_total counter"]
+        for stage, values in summary["stages"].items():
+            lines.append(f'vodetect_stage_calls_total{{video="{video}",stage="{stage}"}} {values["calls"]}')
+        lines += ["# HELP vodetect_model_latency_seconds Latency of the model calls", "# TYPE vodetect_model_latency_seconds summary"]
+        for quantile, latency in summary["model"]["latency_seconds"].items():
+            lines.append(f'vodetect_model_latency_seconds{{video="{video}",quantile="{quantile}"}} {latency:.6f}')
+        lines.append(f'vodetect_model_latency_seconds_count{{video="{video}"}} {summary["model"]["calls"]}')
+        lines += [
+            "# HELP vodetect_gated_frames_total Sampled frames that reused the previous detections because the scene hadn't changed",
+            "# TYPE vodetect_gated_frames_total counter",
+            f'vodetect_gated_frames_total{{video="{video}"}} {summary["model"]["gated_frames"]}',
+        ]
+        lines += ["# HELP vodetect_queue_depth Items waiting in the queue at the last sample", "# TYPE vodetect_queue_depth gauge"]
+        for name, values in summary["queues"].items():
+            lines.append(f'vodetect_queue_depth{{video="{video}",queue="{name}"}} {values["depth"]}')
+        lines += ["# HELP vodetect_queue_depth_max Largest number of items seen waiting in the queue", "# TYPE vodetect_queue_depth_max gauge"]
+        for name, values in summary["queues"].items():
+            lines.append(f'vodetect_queue_depth_max{{video="{video}",queue="{name}"}} {values["max_depth"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, summary):
+        # Written to a temporary file first so a scraper never reads half a file
+        tmp_path = f"{self.prometheus_path}.tmp"
+        with open(tmp_path, 'w') as prometheus_file:
+            prometheus_file.write(self.prometheus_text(summary))
+        os.replace(tmp_path, self.prometheus_path)
+
+    def export_loop(self):
+        while not self.stopped.wait(self.interval_seconds):
+            try:
+                self.write_prometheus(self.summary())
+            except OSError as e:
+                print(f"Failed to write metrics to {self.prometheus_path}: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.exporter.join()
+        summary = self.summary()
+        self.write_prometheus(summary)
+        with open(self.json_path, 'w') as json_file:
+            json.dump(summary, json_file, indent=4)
@@ -0,0 +1,223 @@
+import argparse
+import hashlib
+import json
+import math
+import secrets
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the Helix streams, users and videos endpoints and the app token endpoint, used by the tests
+# and to try the status poller with hundreds of channels without a Twitch account. It enforces the 100 logins
+# per request limit and a token bucket rate limit with the same Ratelimit-* headers and 429 responses as
+# Twitch, and answers If-None-Match with 304 when the response didn't change.
+
+class MockHelixServer:
+    def __init__(self, live_logins=(), rate_limit=800, window_seconds=60, client_id="mock-client-id", port=0,
+                 client_secret="mock-client-secret", require_app_token=False, token_lifetime=3600, videos_per_user=25):
+        self.live_logins = {login.lower() for login in live_logins}
+        self.rate_limit = rate_limit
+        self.window_seconds = window_seconds
+        self.client_id = client_id
+        self.client_secret = client_secret
+        # With require_app_token only tokens handed out by the token endpoint are accepted, any other bearer
+        # token otherwise
+        self.require_app_token = require_app_token
+        self.token_lifetime = token_lifetime
+        self.issued_tokens = {}
+        self.token_requests = 0
+        # Requests answered with 304 Not Modified
+        self.not_modified = 0
+        self.videos_per_user = videos_per_user
+        self.user_logins = {}
+        # Remote ports the requests came from, one per kept-alive connection
+        self.connections = set()
+        self.lock = Lock()
+        self.remaining = rate_limit
+        self.reset_time = math.ceil(time.time() + window_seconds)
+        # Every request as (path, params), and a list of status codes to answer with before serving normally
+        self.requests = []
+        self.forced_statuses = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.make_handler())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/helix"
+
+    @property
+    def token_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/oauth2/token"
+
+    def expire_tokens(self):
+        # Every app token handed out so far is rejected from now on
+        with self.lock:
+            self.issued_tokens.clear()
+
+    def issue_token(self, params):
+        with self.lock:
+            self.token_requests += 1
+            if params.get("client_id") != [self.client_id] or params.get("client_secret") != [self.client_secret]:
+                return 403, {"status": 403, "message": "invalid client secret"}
+            token = secrets.token_hex(15)
+            self.issued_tokens[token] = time.time() + self.token_lifetime
+            return 200, {"access_token": token, "expires_in": self.token_lifetime, "token_type": "bearer"}
+
+    def token_is_valid(self, authorization):
+        if not authorization.startswith("Bearer "):
+            return False
+        if not self.require_app_token:
+            return True
+        with self.lock:
+            expires_at = self.issued_tokens.get(authorization[len("Bearer "):])
+        return expires_at is not None and time.time() < expires_at
+
+    def set_live(self, live_logins):
+        with self.lock:
+            self.live_logins = {login.lower() for login in live_logins}
+
+    def take_token(self):
+        # Returns the status code to answer with and the rate limit headers
+        with self.lock:
+            now = time.time()
+            if now >= self.reset_time:
+                self.remaining = self.rate_limit
+                self.reset_time = math.ceil(now + self.window_seconds)
+            if self.forced_statuses:
+                status = self.forced_statuses.pop(0)
+            elif self.remaining <= 0:
+                status = 429
+            else:
+                self.remaining -= 1
+                status = 200
+            headers = {
+                "Ratelimit-Limit": str(self.rate_limit),
+                "Ratelimit-Remaining": str(self.remaining),
+                "Ratelimit-Reset": str(self.reset_time),
+            }
+            return status, headers
+
+    def streams_response(self, params):
+        logins = [login.lower() for login in params.get("user_login", [])]
+        if len(logins) > 100:
+            return 400, {"error": "Bad Request", "status": 400, "message": "The parameter \"user_login\" was malformed: the value must be less than or equal to 100"}
+        with self.lock:
+            live = [login for login in logins if login in self.live_logins]
+        data = [
+            {"id": str(index), "user_login": login, "user_name": login, "type": "live", "title": "mock stream", "viewer_count": 1}
+            for index, login in enumerate(live)
+        ]
+        return 200, {"data": data, "pagination": {}}
+
+    def user_id(self, login):
+        user_id = str(zlib.crc32(login.encode()))
+        with self.lock:
+            self.user_logins[user_id] = login
+        return user_id
+
+    def users_response(self, params):
+        logins = [login.lower() for login in params.get("login", [])]
+        data = [{"id": self.user_id(login), "login": login, "display_name": login, "type": ""} for login in logins]
+        return 200, {"data": data}
+
+    def videos_response(self, params):
+        user_id = params.get("user_id", [""])[0]
+        with self.lock:
+            login = self.user_logins.get(user_id)
+        if login is None:
+            return 200, {"data": [], "pagination": {}}
+        first = int(params.get("first", ["20"])[0])
+        offset = int(params.get("after", ["0"])[0])
+        videos = [
+            {"id": f"{user_id}{index:04d}", "user_id": user_id, "user_login": login, "title": f"{login} vod {index}", "type": "archive"}
+            for index in range(offset, min(offset + first, self.videos_per_user))
+        ]
+        cursor = str(offset + first) if offset + first < self.videos_per_user else None
+        return 200, {"data": videos, "pagination": {"cursor": cursor} if cursor else {}}
+
+    def make_handler(self):
+        server = self
+
+        endpoints = {
+            "/helix/streams": server.streams_response,
+            "/helix/users": server.users_response,
+            "/helix/videos": server.videos_response,
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keeps connections open between requests like Twitch does
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                with server.lock:
+                    server.requests.append((url.path, params))
+                    server.connections.add(self.client_address[1])
+
+                if self.headers.get("Client-ID") != server.client_id or not server.token_is_valid(self.headers.get("Authorization", "")):
+                    return self.reply(401, {"error": "Unauthorized", "status": 401, "message": "invalid access token"}, {})
+                status, headers = server.take_token()
+                if status != 200:
+                    return self.reply(status, {"error": "Error", "status": status, "message": "mock error"}, headers)
+                if url.path not in endpoints:
+                    return self.reply(404, {"error": "Not Found", "status": 404, "message": ""}, headers)
+                status, body = endpoints[url.path](params)
+                self.reply(status, body, headers)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                params = parse_qs(self.rfile.read(length).decode())
+                with server.lock:
+                    server.connections.add(self.client_address[1])
+                if url.path != "/oauth2/token":
+                    return self.reply(404, {"status": 404, "message": ""}, {})
+                status, body = server.issue_token(params)
+                self.reply(status, body, {})
+
+            def reply(self, status, body, headers):
+                payload = json.dumps(body).encode()
+                etag = f'"{hashlib.sha1(payload).hexdigest()[:16]}"'
+                if status == 200 and self.command == "GET" and self.headers.get("If-None-Match") == etag:
+                    status, payload = 304, b""
+                    with server.lock:
+                        server.not_modified += 1
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status in (200, 304) and self.command == "GET":
+                    self.send_header("ETag", etag)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a mock Helix streams endpoint")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--live", nargs="*", default=[], help="Logins to report as live")
+    parser.add_argument("--rate-limit", type=int, default=800, help="Requests allowed per window")
+    parser.add_argument("--window-seconds", type=int, default=60)
+    parser.add_argument("--client-id", default="mock-client-id")
+    parser.add_argument("--client-secret", default="mock-client-secret")
+    args = parser.parse_args()
+    mock = MockHelixServer(args.live, args.rate_limit, args.window_seconds, args.client_id, args.port, args.client_secret)
+    print(f"Mock Helix server on {mock.base_url}, tokens from {mock.token_url}, CLIENT_ID {args.client_id}, CLIENT_SECRET {args.client_secret}")
+    mock.server.serve_forever()
@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+from threading import Lock
+
+# Runtimes the model can run on. For anything but pytorch the .pt model is exported once with ultralytics and
+# the export is cached next to it, ultralytics then runs the export with the matching runtime and returns the
+# same Results objects, so nothing after the model call changes with the backend
+BACKENDS = ("pytorch", "onnx", "openvino")
+
+export_lock = Lock()
+
+def variant_name(backend, int8):
+    return f"{backend}-int8" if int8 and backend != "pytorch" else backend
+
+def get_export_path(model_path, backend, int8):
+    stem = os.path.splitext(model_path)[0]
+    if backend == "onnx":
+        return f"{stem}_int8.onnx" if int8 else f"{stem}.onnx"
+    # Same names ultralytics itself uses for OpenVINO exports
+    return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+
+def get_export_options(backend, int8, calibration_data):
+    # Everything besides the .pt file that changes what the export contains. Exports are made with a dynamic
+    # input shape so batches of any size can be run through them, without it the export only takes one frame
+    options = {"backend": backend, "int8": bool(int8), "dynamic": True}
+    if int8 and backend == "openvino":
+        options["calibration_data"] = calibration_data
+        if calibration_data and os.path.exists(calibration_data):
+            options["calibration_data_mtime"] = os.path.getmtime(calibration_data)
+    return options
+
+def get_options_path(export_path):
+    return f"{export_path}.options.json"
+
+def is_export_current(model_path, export_path, options):
+    if not os.path.exists(export_path) or os.path.getmtime(export_path) < os.path.getmtime(model_path):
+        return False
+    # Exports made with other options, or before the options were recorded, are made again
+    try:
+        with open(get_options_path(export_path)) as f:
+            return json.load(f) == options
+    except (OSError, ValueError):
+        return False
+
+def save_export_options(export_path, options):
+    with open(get_options_path(export_path), 'w') as f:
+        json.dump(options, f)
+
+def quantize_onnx(source_path, target_path):
+    # Dynamic quantization needs no calibration images: weights are stored as int8, activations are
+    # quantized on the fly per batch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(source_path, target_path, weight_type=QuantType.QUInt8)
+
+def export_model(model_path, backend, int8, calibration_data):
+    from ultralytics import YOLO
+    export_path = get_export_path(model_path, backend, int8)
+    model = YOLO(model_path)
+    if backend == "onnx":
+        onnx_path = model.export(format="onnx", dynamic=True)
+        if int8:
+            quantize_onnx(onnx_path, export_path)
+        return export_path
+
+    options = {"dynamic": True}
+    if int8:
+        options["int8"] = True
+        # OpenVINO int8 is calibrated on a dataset, ultralytics downloads coco8 when none is given
+        if calibration_data:
+            options["data"] = calibration_data
+    exported_path = model.export(format="openvino", **options)
+    if os.path.abspath(exported_path) != os.path.abspath(export_path):
+        shutil.rmtree(export_path, ignore_errors=True)
+        os.replace(exported_path, export_path)
+    return export_path
+
+def load_model(model_path, backend="pytorch", int8=False, calibration_data=None):
+    from ultralytics import YOLO
+    if backend not in BACKENDS:
+        print(f"Unknown inference backend '{backend}', using pytorch")
+        backend = "pytorch"
+    if backend == "pytorch":
+        if int8:
+            print("backend_int8 only applies to the onnx and openvino backends, running the pytorch model unquantized")
+        return YOLO(model_path)
+
+    with export_lock:
+        export_path = get_export_path(model_path, backend, int8)
+        options = get_export_options(backend, int8, calibration_data)
+        if not is_export_current(model_path, export_path, options):
+            print(f"Exporting {model_path} for the {variant_name(backend, int8)} backend, this only happens once")
+            export_model(model_path, backend, int8, calibration_data)
+            save_export_options(export_path, options)
+    return YOLO(export_path, task="detect")
@@ -2,23 +2,29 @@ import os
 import threading
 import twitch_downloader
 import twitch_autodownloader
+import twitch_api
+import twitch_status
 import youtube_downloader
 import inference
+import channel_monitor
+import download_manager
+import clip_fetcher
 import time
 import queue
 import cv2
 import subprocess
-import json
+from settings import config
 
-# Load configuration from config.json
-with open('config.json', 'r') as config_file:
-    config = json.load(config_file)
 
 MAX_INFERENCE_THREADS = config["processor"]["MAX_INFERENCE_THREADS"]
 TARGET_SIZE = tuple(config["folder_processing"]["VIDEO_RESOLUTION"])
 FOLDER_RESIZE = config["folder_processing"]["RESIZE_VIDEOS"]
+MAX_PARALLEL_DOWNLOADS = config["processor"].get("MAX_PARALLEL_DOWNLOADS", 2)
+DOWNLOAD_DISK_BUDGET_GB = config["processor"].get("DOWNLOAD_DISK_BUDGET_GB", 0)
+CLIP_PADDING_SECONDS = config["processor"].get("CLIP_PADDING_SECONDS", 5)
+LIVE_INFERENCE = config["twitch_autodownloader"].get("LIVE_INFERENCE", False)
+HELIX_STATUS = config["twitch_autodownloader"].get("HELIX_STATUS", False)
 TWITCH_OUTPUT_DIR = "vods"
-channel_flags = {}
 #channel_status = {}
 STOP_MONITORING = False
 STOP_INFERENCE = False
@@ -27,14 +33,33 @@ STOP_INFERENCE = False
 semaphore = threading.Semaphore(MAX_INFERENCE_THREADS)
 print_lock = threading.Lock()
 waiting_for_inference = queue.Queue()
+# Downloaded videos that inference isn't done with yet
+queued_footage = download_manager.DiskBudget(DOWNLOAD_DISK_BUDGET_GB * 1024 ** 3)
 
 channel_names = config["twitch_autodownloader"]["channels"]
 channel_status = {channel: 'offline' for channel in channel_names}
+status_poller = None
+channel_monitor_instance = None
+
+def fetch_full_quality_clips(video_file, source, saved_ranges):
+    # The video was a low quality analysis download, the clips come from the source at the desired quality
+    filename = os.path.basename(video_file)
+    video_output_dir = os.path.join(inference.output_dir, os.path.splitext(filename)[0])
+    output_paths = {object_name: inference.get_output_filename(object_name, filename, video_output_dir) for object_name in saved_ranges}
+    if not clip_fetcher.fetch_clips(source, saved_ranges, output_paths, os.path.join(video_output_dir, "debug"), CLIP_PADDING_SECONDS):
+        print(f"Some full quality clips of {filename} could not be downloaded")
 
 def run_inference(video_file, position=0):
     directory = os.path.dirname(video_file)  # Extract the directory from the video_file path
+    analysis_source = clip_fetcher.take(video_file)
+    semaphore_held = True
     try:
-        inference.main(video_file, position, input_directory=directory)
+        saved_ranges = inference.main(video_file, position, input_directory=directory, write_clips=analysis_source is None)
+        if analysis_source is not None and saved_ranges:
+            # Downloading the clips doesn't need an inference slot, the next video can start in the meantime
+            semaphore.release()
+            semaphore_held = False
+            fetch_full_quality_clips(video_file, analysis_source, saved_ranges)
     finally:
         #print(f"Releasing semaphore for {video_file}.")
         #get channel name from video_file
@@ -43,12 +68,20 @@ def run_inference(video_file, position=0):
         set_channel_status(channel_name, "offline")
         position -= 1
         #print(f"Set {channel_name} status to offline because inference was complete.")
-        semaphore.release()
+        queued_footage.release(video_file)
+        if semaphore_held:
+            semaphore.release()
 
 def inference_worker():
     global channel_status
     #print("Inference worker started.")
+    try:
+        # Starts the shared model process on the first job if inference_server is enabled in the config
+        inference.start_inference_server()
+    except Exception as e:
+        print(f"Failed to start the inference server, running the model in each inference thread: {e}")
     position = 1
+    inference_threads = []
     while True:
         video_file = waiting_for_inference.get()
         
@@ -63,83 +96,64 @@ def inference_worker():
         print(f"Starting inference on {video_file}.")
         #print("Trying to acquire semaphore.")
         semaphore.acquire()
-        threading.Thread(target=run_inference, args=(video_file, position)).start()
+        inference_thread = threading.Thread(target=run_inference, args=(video_file, position))
+        inference_thread.start()
+        inference_threads.append(inference_thread)
         position += 1
 
-def get_twitch_channels_status():
-    global STOP_MONITORING, channel_status
-    
-    if STOP_MONITORING:
-        print("Stopping channel monitoring.")
-        for channel in channel_names:
-            set_channel_status(channel, "offline")
-        return channel_status
-    
-    for channel in channel_names:
-        status = twitch_autodownloader.check_channel_status(channel, channel_status[channel])
-        channel_status[channel] = status
+    # The model process is shut down once the videos still being processed are done with it
+    for inference_thread in inference_threads:
+        inference_thread.join()
+    inference.stop_inference_server()
 
-    return channel_status
+def get_status_poller():
+    global status_poller
+    if status_poller is None:
+        status_poller = twitch_status.HelixStatusPoller(twitch_api.get_client())
+    return status_poller
 
 def set_channel_status(channel, status):
     global channel_status
     channel_status[channel] = status
 
+def on_recording_finished(channel, output_path):
+    if not STOP_INFERENCE:  # Check the flag here
+        # Add the downloaded video to the queue for inference
+        waiting_for_inference.put(output_path)
+        set_channel_status(channel, "inference")
+        print(f"Set {channel} status to {channel_status[channel]}.")
+        print(f"Added {output_path} to the inference queue.")
+
 def monitor_channels(form):
-    global channel_flags
-    while not form.stop_thread:
-        channel_status = get_twitch_channels_status()
-        for channel, status in channel_status.items():
-
-            # If channel is live and not currently being downloaded
-            if status == "online" and not channel_flags.get(channel, False):
-                print(f"Starting download for {channel}")
-                channel_flags[channel] = True
-                thread = threading.Thread(target=start_live_download, args=(channel,))
-                thread.start()
-                form.threads.append(thread)
-
-            # If channel was live but is now offline
-            elif status == "offline" and channel_flags.get(channel, False):
-                print(f"Stopping download for {channel}")
-                channel_flags[channel] = False
-                twitch_autodownloader.stop_download(channel)  # Stop only the download for this specific channel
-
-                # Explicitly start inference here
-                output_path = twitch_autodownloader.generate_output_path(channel)  # Assuming this function generates the same path as before
-                if not STOP_INFERENCE and output_path:  # Check the flag and if output_path is not None
-                    waiting_for_inference.put(output_path)
-                    set_channel_status(channel, "inference")
-                    print(f"Explicitly set {channel} status to {channel_status[channel]}.")
-                    print(f"Explicitly added {output_path} to the inference queue.")
-
-        time.sleep(config["twitch_autodownloader"]["CHECK_INTERVAL"])
-        
-        if form.stop_thread:
-            print("Stopping channel monitoring thread.")
-            break
+    # Runs the channel monitor on this thread until stop_monitoring() is called
+    global channel_monitor_instance
+    twitch_config = config["twitch_autodownloader"]
+    check_interval = twitch_config.get("CHECK_INTERVAL_SECONDS", twitch_config.get("CHECK_INTERVAL", 5))
+    channel_monitor_instance = channel_monitor.ChannelMonitor(
+        channel_status,
+        check_interval,
+        on_recording_finished,
+        status_poller=get_status_poller() if HELIX_STATUS else None,
+        live=LIVE_INFERENCE,
+        inference_workers=MAX_INFERENCE_THREADS,
+    )
+    if not STOP_MONITORING and not form.stop_thread:
+        channel_monitor_instance.run_forever()
+    for channel in channel_names:
+        set_channel_status(channel, "offline")
 
-def start_live_download(channel):
-    try:
-        output_path = twitch_autodownloader.download_stream(channel)
-        if output_path:
-            if not STOP_INFERENCE:  # Check the flag here
-                # Add the downloaded video to the queue for inference
-                waiting_for_inference.put(output_path)
-                set_channel_status(channel, "inference")
-                print(f"Set {channel} status to {channel_status[channel]}.")
-                print(f"Added {output_path} to the inference queue.")
-    finally:
-        # Update the flag when the download is finished
-        channel_flags[channel] = False
+def stop_monitoring():
+    # Stops checking the channels and stops every recording, safe to call from any thread
+    global STOP_MONITORING
+    STOP_MONITORING = True
+    if channel_monitor_instance is not None:
+        channel_monitor_instance.stop()
 
 def stop_all_downloads():
-    for channel in channel_flags.keys():
-        twitch_autodownloader.stop_download(channel)
+    stop_monitoring()
 
 def stop_all_processing():
-    global STOP_MONITORING
-    STOP_MONITORING = True
+    stop_monitoring()
     for _ in range(MAX_INFERENCE_THREADS):
         waiting_for_inference.put(None)
 
@@ -181,6 +195,17 @@ def process_folder(folder_path, common_size=TARGET_SIZE):
     for _ in range(MAX_INFERENCE_THREADS):
         waiting_for_inference.put(None)
 
+def download_and_queue(downloads):
+    # downloads is a list of (download function, *args). Runs them MAX_PARALLEL_DOWNLOADS at a time, queues every
+    # video for inference as soon as it is downloaded and tells the inference worker to exit once all are done
+    manager = download_manager.DownloadManager(waiting_for_inference, queued_footage, MAX_PARALLEL_DOWNLOADS, stopped=lambda: STOP_INFERENCE)
+    for download, *args in downloads:
+        manager.submit(download, *args)
+    manager.join()
+    # Put sentinel values for each inference worker thread to signal them to exit
+    for _ in range(MAX_INFERENCE_THREADS):
+        waiting_for_inference.put(None)
+
 def resize_video(video_path, output_path, target_size):
     width, height = target_size
     cmd = [
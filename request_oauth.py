@@ -1,25 +1,13 @@
-import requests
+import twitch_api
 
-CLIENT_ID = 'ENTER CLIENT_ID HERE'
-CLIENT_SECRET = 'ENTER CLIENT_SECRET HERE'
+# Not needed to run VODetect anymore, with CLIENT_SECRET in config.json the app access token is requested and
+# renewed automatically. Prints a token for the CLIENT_ID and CLIENT_SECRET in the config, for other tools or
+# for OAUTH_TOKEN.
 
-def get_oauth_token():
-    url = "https://id.twitch.tv/oauth2/token"
-    payload = {
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
-        'grant_type': 'client_credentials',
-        'scope': 'user:read:broadcast'  # Scope for reading non-public channel information
-    }
-    
-    response = requests.post(url, data=payload)
-    data = response.json()
-    
-    if 'access_token' in data:
-        return data['access_token']
-    else:
-        print("Error:", data['message'])
-        return None
-
-oauth_token = get_oauth_token()
-print("OAuth Token:", oauth_token)
+client = twitch_api.get_client()
+if client.client_secret is None:
+    print("Error: Set CLIENT_SECRET in the twitch_downloader section of config.json")
+else:
+    oauth_token, expires_in = client.request_app_token()
+    print("OAuth Token:", oauth_token)
+    print(f"Expires in {expires_in // 86400} days")
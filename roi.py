@@ -0,0 +1,50 @@
+import os
+import cv2
+import numpy as np
+from detection_cache import Detections
+
+# Region of interest cropping. Channels with a fixed layout only show the objects worth detecting in a known
+# part of the screen, so the model is only given that part. The crop is taken while the frame is read, shrunk
+# to the model's input size if it is larger, and the boxes the model returns are mapped back to the full frame.
+# Small objects get the same share of the model input as the whole frame would, and the rest of the frame
+# isn't resized or sent to an inference server at all. Output clips always keep the full frame.
+
+# The model letterboxes its input to this size, larger crops are shrunk to it while the frame is read
+MODEL_INPUT_SIZE = 640
+
+class RegionOfInterest:
+    def __init__(self, region, frame_width, frame_height):
+        # region is [x, y, width, height] as fractions of the frame, so it fits every quality of a VOD
+        x, y, width, height = (float(value) for value in region)
+        self.x0 = min(max(int(round(x * frame_width)), 0), frame_width - 1)
+        self.y0 = min(max(int(round(y * frame_height)), 0), frame_height - 1)
+        self.x1 = min(max(int(round((x + width) * frame_width)), self.x0 + 1), frame_width)
+        self.y1 = min(max(int(round((y + height) * frame_height)), self.y0 + 1), frame_height)
+        crop_width, crop_height = self.x1 - self.x0, self.y1 - self.y0
+        scale = min(MODEL_INPUT_SIZE / max(crop_width, crop_height), 1)
+        self.size = (max(int(round(crop_width * scale)), 1), max(int(round(crop_height * scale)), 1))
+        self.scale_x = self.size[0] / crop_width
+        self.scale_y = self.size[1] / crop_height
+
+    def crop(self, frame):
+        crop = frame[self.y0:self.y1, self.x0:self.x1]
+        if self.size != (crop.shape[1], crop.shape[0]):
+            return cv2.resize(crop, self.size, interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(crop)
+
+    def map_detections(self, detections):
+        boxes = np.asarray(detections.boxes, dtype=np.float32).reshape(-1, 4)
+        scale = np.array([self.scale_x, self.scale_y, self.scale_x, self.scale_y], dtype=np.float32)
+        offset = np.array([self.x0, self.y0, self.x0, self.y0], dtype=np.float32)
+        return Detections(detections.class_ids, detections.confidences, boxes / scale + offset)
+
+def find_region(video_path, regions):
+    # regions maps a channel or a folder to its region. Recordings are named <channel>_<time>, so a channel
+    # matches the start of the file name, a folder matches the folder the video is in by name or by path.
+    # The longest matching key wins, so a channel called name_2 isn't taken for name
+    filename = os.path.basename(video_path).lower()
+    folder = os.path.abspath(os.path.dirname(video_path))
+    for key in sorted(regions, key=len, reverse=True):
+        if filename.startswith(f"{key.lower()}_") or os.path.basename(folder) == key or folder == os.path.abspath(key):
+            return regions[key]
+    return None
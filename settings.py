@@ -0,0 +1,26 @@
+import json
+from threading import Lock
+
+CONFIG_PATH = 'config.json'
+
+class LazyConfig:
+    # config.json is parsed once, on first access, and shared by every module that imports it from here
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.lock = Lock()
+
+    def load(self):
+        with self.lock:
+            if self.data is None:
+                with open(self.path, 'r') as config_file:
+                    self.data = json.load(config_file)
+        return self.data
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+config = LazyConfig(CONFIG_PATH)
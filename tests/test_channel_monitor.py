@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+import pytest
+from mock_helix_server import MockHelixServer
+from twitch_api import TwitchClient
+from twitch_status import HelixStatusPoller
+
+CHANNELS = [f"channel{index:03d}" for index in range(200)]
+LIVE = sorted(set(CHANNELS[::10] + CHANNELS[5:15]))
+# Stands in for ffmpeg: records until it reads 'q' on stdin, then writes its output file
+RECORDER = "import sys; sys.stdin.read(1); open(sys.argv[1], 'w').write('video')"
+
+@pytest.fixture
+def channel_monitor(tmp_path, monkeypatch):
+    pytest.importorskip("streamlink")
+    # twitch_autodownloader creates its output directory and log file in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    import channel_monitor
+    import twitch_autodownloader
+    monkeypatch.setattr(twitch_autodownloader, "OUTPUT_DIR", str(tmp_path))
+    return channel_monitor
+
+def client_threads():
+    # Threads outside the mock server, which serves every kept-alive connection on a thread of its own
+    return [thread for thread in threading.enumerate() if "process_request_thread" not in thread.name]
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_records_live_channels_and_stops_cleanly(channel_monitor, tmp_path):
+    mock = MockHelixServer(LIVE).start()
+    resolved = []
+    finished = []
+
+    class TestMonitor(channel_monitor.ChannelMonitor):
+        def resolve_status(self, channel, status):
+            resolved.append(channel)
+            return "online"
+
+        def prepare_recording(self, channel):
+            output_path = str(tmp_path / f"{channel}.mp4")
+            return [sys.executable, "-c", RECORDER, output_path], output_path, channel
+
+    channel_status = {channel: "offline" for channel in CHANNELS}
+    poller = HelixStatusPoller(TwitchClient(mock.client_id, oauth_token="token", base_url=mock.base_url))
+    monitor = TestMonitor(channel_status, 0.05, lambda channel, path: finished.append((channel, path)), status_poller=poller)
+    threads_before = len(client_threads())
+    thread = threading.Thread(target=monitor.run_forever)
+    thread.start()
+    try:
+        wait_for(lambda: len(monitor.recordings) == len(LIVE) and all(r.process is not None for r in monitor.recordings.values()))
+        # No thread per recording, only the monitor thread and the check pool
+        assert len(client_threads()) <= threads_before + 1 + channel_monitor.MAX_CONCURRENT_CHECKS
+        # Streamlink only ran for the channels that went live
+        assert sorted(resolved) == sorted(LIVE)
+
+        # Channels that go offline get their recording stopped and handed over
+        mock.set_live(LIVE[:5])
+        wait_for(lambda: len(finished) == len(LIVE) - 5)
+        assert {channel for channel, _ in finished} == set(LIVE[5:])
+        assert all(os.path.exists(path) for _, path in finished)
+        processes = [recording.process for recording in monitor.recordings.values()]
+    finally:
+        start = time.monotonic()
+        monitor.stop()
+        thread.join(10)
+        mock.stop()
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 5
+    assert all(process.returncode == 0 for process in processes)
+    assert {channel for channel, _ in finished} == set(LIVE)
+    assert sorted(resolved) == sorted(LIVE)
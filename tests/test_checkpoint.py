@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import checkpoint
+from detection_cache import Detections, DetectionRecorder
+from windowing import WindowTracker
+from test_windowing import random_samples, tracker_windows
+
+#---------------------------------
+# Interrupting a run at a checkpoint and resuming from it must close exactly the windows an uninterrupted run does
+def run_with_checkpoint(samples, frame_check_interval, grace_period_val, checkpoint_index, checkpoint_path, settings):
+    tracker = WindowTracker(grace_period_val * frame_check_interval)
+    last_sampled_frame = None
+    windows = []
+    saved_segments = {"object": [(0, 8)]}
+    for index, (frame_num, detections) in enumerate(samples):
+        if index == checkpoint_index:
+            checkpoint.save(checkpoint_path, settings, frame_num, last_sampled_frame, tracker, saved_segments, None, 123)
+            resume = checkpoint.load(checkpoint_path, settings)
+            assert resume.next_frame == frame_num
+            assert resume.saved_segments == saved_segments
+            assert resume.log_size == 123
+            tracker, last_sampled_frame = resume.tracker, resume.last_sampled_frame
+        if detections is None:
+            last_sampled_frame = frame_num
+            continue
+        gap = frame_num - last_sampled_frame if last_sampled_frame is not None else frame_check_interval
+        last_sampled_frame = frame_num
+        windows.extend(tracker.update(frame_num, detections, gap))
+    return windows
+
+@pytest.fixture
+def checkpoint_setup(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"video")
+    settings = checkpoint.get_checkpoint_settings(str(video_path), {"frame_check_interval": 8, "thresholds": {"a": 0.5}})
+    return str(video_path), str(tmp_path / "checkpoint.npz"), settings
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("checkpoint_index", [0, 37, 150, 299])
+def test_resume_matches_uninterrupted_run(checkpoint_setup, seed, checkpoint_index):
+    _, checkpoint_path, settings = checkpoint_setup
+    samples = random_samples(seed, 300, 8, failure_rate=0.05)
+    assert run_with_checkpoint(samples, 8, 3, checkpoint_index, checkpoint_path, settings) == tracker_windows(samples, 8, 3)
+
+def test_recorder_round_trip(checkpoint_setup):
+    _, checkpoint_path, settings = checkpoint_setup
+    recorder = DetectionRecorder()
+    recorder.add(0, Detections([1, 2], [0.5, 0.75], np.arange(8, dtype=np.float32).reshape(2, 4)))
+    recorder.add_failure(8)
+    checkpoint.save(checkpoint_path, settings, 9, 8, WindowTracker(24), {}, recorder, 0)
+    restored = checkpoint.load(checkpoint_path, settings).recorder
+    restored.add(16, Detections([3], [0.25], np.zeros((1, 4), dtype=np.float32)))
+    recorder.add(16, Detections([3], [0.25], np.zeros((1, 4), dtype=np.float32)))
+    for name, column in recorder.columns().items():
+        np.testing.assert_array_equal(restored.columns()[name], column)
+
+def test_gate_reference_round_trip(checkpoint_setup):
+    _, checkpoint_path, settings = checkpoint_setup
+    checkpoint.save(checkpoint_path, settings, 9, 8, WindowTracker(24), {}, None, 0)
+    assert checkpoint.load(checkpoint_path, settings).gate_reference is None
+    signature = np.arange(64 * 36, dtype=np.uint8).reshape(36, 64)
+    detections = Detections(np.array([1, 2]), np.array([0.5, 0.75], dtype=np.float32), np.arange(8, dtype=np.float32).reshape(2, 4))
+    checkpoint.save(checkpoint_path, settings, 9, 8, WindowTracker(24), {}, None, 0, (signature, detections))
+    restored_signature, restored_detections = checkpoint.load(checkpoint_path, settings).gate_reference
+    np.testing.assert_array_equal(restored_signature, signature)
+    for restored, column in zip(restored_detections, detections):
+        np.testing.assert_array_equal(restored, column)
+
+def test_changed_video_or_settings_are_ignored(checkpoint_setup):
+    video_path, checkpoint_path, settings = checkpoint_setup
+    checkpoint.save(checkpoint_path, settings, 9, 8, WindowTracker(24), {}, None, 0)
+    assert checkpoint.load(checkpoint_path, settings) is not None
+    assert checkpoint.load(checkpoint_path, {**settings, "frame_check_interval": 4}) is None
+    with open(video_path, 'ab') as f:
+        f.write(b"more")
+    assert checkpoint.load(checkpoint_path, checkpoint.get_checkpoint_settings(video_path, {"frame_check_interval": 8, "thresholds": {"a": 0.5}})) is None
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import clip_buffer
+from clip_buffer import ClipBuffer, MemoryBudget
+
+def make_frames(count):
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 256, (6, 8, 3), dtype=np.uint8) for _ in range(count)]
+
+#---------------------------------
+# Frames past the memory budget go to the scratch file and come back in order and unchanged
+def test_spilled_frames_come_back_in_order(tmp_path):
+    frames = make_frames(10)
+    budget = MemoryBudget(3 * frames[0].nbytes)
+    buffer = ClipBuffer(budget, str(tmp_path), "video")
+    for frame in frames:
+        buffer.append(frame)
+
+    assert len(buffer) == 10
+    assert len(buffer.memory_frames) == 3
+    assert buffer.spilled_frames == 7
+    assert os.path.basename(buffer.spill_path).startswith("clipbuffer-video-")
+    for _ in range(2):
+        read_back = list(buffer)
+        assert len(read_back) == 10
+        assert all(a.tobytes() == b.tobytes() for a, b in zip(read_back, frames))
+
+    # Appending after a read keeps the order
+    buffer.append(frames[0])
+    assert list(buffer)[-1].tobytes() == frames[0].tobytes()
+
+    buffer.clear()
+    assert len(buffer) == 0
+    assert budget.used_bytes == 0
+    assert os.listdir(tmp_path) == []
+
+#---------------------------------
+# Only the scratch files of the given name are removed
+def test_remove_scratch_files(tmp_path):
+    names = ["clipbuffer-video-abcd_123.raw", "clipbuffer-video-x-abcd_123.raw", "clipbuffer-other-abcd_123.raw", "video.log"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"x")
+    clip_buffer.remove_scratch_files(str(tmp_path), "video")
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:])
@@ -0,0 +1,31 @@
+import clip_fetcher
+
+def test_ranges_are_padded_offset_and_merged():
+    time_ranges = [(10.0, 12.0), (14.0, 20.0), (60.0, 61.0), (1.0, 2.0)]
+    assert clip_fetcher.get_source_ranges(time_ranges, 3, offset_seconds=300) == [(300.0, 305.0), (307.0, 323.0), (357.0, 364.0)]
+
+def test_registered_sources_are_taken_once(tmp_path):
+    video_path = str(tmp_path / "vod.mp4")
+    clip_fetcher.register(video_path, print, 60)
+    assert clip_fetcher.take(str(tmp_path / "other.mp4")) is None
+    assert clip_fetcher.take(video_path) == (print, 60)
+    assert clip_fetcher.take(video_path) is None
+
+def test_each_object_gets_its_clip_from_the_source(tmp_path):
+    downloaded = []
+
+    def download_section(start, end, output_path):
+        downloaded.append((start, end))
+        if start > 100:
+            return False
+        with open(output_path, "w") as f:
+            f.write(f"{start}-{end}")
+        return True
+
+    saved_ranges = {"red": [(10.0, 12.0)], "green": [(200.0, 210.0)]}
+    output_paths = {name: str(tmp_path / f"{name}-vod.mp4") for name in saved_ranges}
+    assert not clip_fetcher.fetch_clips((download_section, 0), saved_ranges, output_paths, str(tmp_path), 2)
+    assert downloaded == [(8.0, 14.0), (198.0, 212.0)]
+    assert (tmp_path / "red-vod.mp4").read_text() == "8.0-14.0"
+    assert not (tmp_path / "green-vod.mp4").exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["red-vod.mp4"]
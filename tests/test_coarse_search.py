@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import coarse_search
+from test_windowing import array_windows
+
+#---------------------------------
+# Around every event the coarse search finds, the windows must be exactly the ones a full scan finds
+def sparse_samples(seed, num_samples, frame_check_interval, stride):
+    # Objects show up in a few bursts that last several strides, with short dropouts, and nothing in between
+    rng = np.random.default_rng(seed)
+    detections = [{} for _ in range(num_samples)]
+    for object_id in range(3):
+        for _ in range(4):
+            length = int(rng.integers(3, 6)) * stride // frame_check_interval
+            first = int(rng.integers(0, num_samples - length))
+            for index in range(first, first + length):
+                if rng.random() < 0.8:
+                    detections[index][object_id] = [float(rng.uniform(0.3, 1.0))]
+    return [(index * frame_check_interval, frame_detections) for index, frame_detections in enumerate(detections)]
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("frame_check_interval, grace_period_val", [(2, 6), (8, 3)])
+def test_refined_windows_match_full_scan(seed, frame_check_interval, grace_period_val):
+    stride = 20 * frame_check_interval
+    samples = sparse_samples(seed, 3000, frame_check_interval, stride)
+    by_frame = dict(samples)
+    total_frames = len(samples) * frame_check_interval
+    model_frames = []
+
+    def detect(frame_nums):
+        model_frames.extend(frame_nums)
+        return [bool(by_frame[frame_num]) for frame_num in frame_nums]
+
+    coarse_frames, regions = coarse_search.search(total_frames, frame_check_interval, stride, grace_period_val * frame_check_interval, detect)
+    assert len(model_frames) == len(set(model_frames))
+    searched = set(coarse_frames).union(*(coarse_search.grid_frames(start, end, frame_check_interval) for start, end in regions))
+    assert searched == set(model_frames)
+
+    searched_samples = [(frame_num, detections) for frame_num, detections in samples if frame_num in searched]
+    assert array_windows(searched_samples, frame_check_interval, grace_period_val) == array_windows(samples, frame_check_interval, grace_period_val)
+    assert len(model_frames) < len(samples) / 2
+
+def test_nothing_detected_only_runs_the_coarse_pass():
+    detect_calls = []
+
+    def detect(frame_nums):
+        detect_calls.append(list(frame_nums))
+        return [False] * len(frame_nums)
+
+    coarse_frames, regions = coarse_search.search(1000, 2, 100, 12, detect)
+    assert coarse_frames == list(range(0, 1000, 100))
+    assert regions == []
+    assert detect_calls == [coarse_frames]
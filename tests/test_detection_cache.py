@@ -0,0 +1,50 @@
+import numpy as np
+import detection_cache
+from detection_cache import Detections, DetectionRecorder
+
+#---------------------------------
+# A saved cache must replay the recorded detections and failures, and only for the key it was saved with
+def test_save_and_load_round_trip(tmp_path):
+    recorder = DetectionRecorder()
+    recorder.add(0, Detections([1, 2], [0.5, 0.75], np.arange(8, dtype=np.float32).reshape(2, 4)))
+    recorder.add(8, Detections([], [], np.zeros((0, 4), dtype=np.float32)))
+    recorder.add_failure(16)
+    recorder.add(24, Detections([3], [0.25], np.ones((1, 4), dtype=np.float32)))
+    cache_path = str(tmp_path / "video-detections.npz")
+    recorder.save(cache_path, "key", {1: "a", 2: "b", 3: "c"}, 30, 29.97)
+
+    assert detection_cache.load(cache_path, "other key") is None
+    cache = detection_cache.load(cache_path, "key")
+    assert cache.names == {1: "a", 2: "b", 3: "c"}
+    assert (cache.total_frames, cache.fps) == (30, 29.97)
+    first = cache.get(0)
+    assert list(first.class_ids) == [1, 2]
+    np.testing.assert_allclose(first.confidences, [0.5, 0.75])
+    np.testing.assert_array_equal(first.boxes, np.arange(8, dtype=np.float32).reshape(2, 4))
+    assert len(cache.get(8).class_ids) == 0
+    assert isinstance(cache.get(16), RuntimeError)
+    assert list(cache.get(24).class_ids) == [3]
+    assert isinstance(cache.get(4), KeyError)
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    cache_path = tmp_path / "video-detections.npz"
+    cache_path.write_bytes(b"not a cache")
+    assert detection_cache.load(str(cache_path), "key") is None
+
+def test_key_follows_what_the_model_sees(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"video")
+    model_path = tmp_path / "model.pt"
+    model_path.write_bytes(b"model")
+
+    def key(**options):
+        return detection_cache.get_cache_key(str(video_path), str(model_path), 8, **options)
+
+    base = key()
+    assert key() == base
+    assert key(equalization_weight=0.5) != base
+    assert key(equalization_weight=0.5) != key(equalization_weight=0.25)
+    assert key(region=[0, 0, 0.5, 0.5]) != base
+    assert key(sampling={"motion_gate_threshold": 8}) != base
+    assert key(backend="onnx") != base
+    assert detection_cache.get_cache_key(str(video_path), str(model_path), 4) != base
@@ -0,0 +1,70 @@
+import queue
+import threading
+import time
+from download_manager import DiskBudget, DownloadManager
+
+def fake_download(tmp_path, started, size=1000, release=None):
+    def download(name):
+        started.append(name)
+        if release is not None:
+            release.wait(5)
+        if name.startswith("broken"):
+            return None
+        path = tmp_path / name
+        path.write_bytes(b"x" * size)
+        return str(path)
+    return download
+
+def test_downloads_run_in_parallel_and_are_queued_when_done(tmp_path):
+    inference_queue = queue.Queue()
+    started = []
+    release = threading.Event()
+    manager = DownloadManager(inference_queue, DiskBudget(None), max_parallel=3)
+    for name in ["a", "broken", "c"]:
+        manager.submit(fake_download(tmp_path, started, release=release), name)
+    deadline = time.monotonic() + 5
+    while len(started) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    release.set()
+    queued = manager.join()
+    # The failed download is left out, a None in the queue would stop the inference worker
+    assert sorted(queued) == [str(tmp_path / "a"), str(tmp_path / "c")]
+    assert sorted(inference_queue.get_nowait() for _ in range(2)) == sorted(queued)
+    assert inference_queue.empty()
+
+def test_budget_pauses_downloads_until_inference_catches_up(tmp_path):
+    inference_queue = queue.Queue()
+    budget = DiskBudget(1500)
+    started = []
+    manager = DownloadManager(inference_queue, budget, max_parallel=1)
+    for name in ["a", "b", "c"]:
+        manager.submit(fake_download(tmp_path, started), name)
+
+    # Two 1000 byte videos are over the budget, the third download waits
+    first = inference_queue.get(timeout=5)
+    second = inference_queue.get(timeout=5)
+    time.sleep(0.2)
+    assert started == ["a", "b"]
+    assert budget.queued_bytes() == 2000
+
+    # Inference finishing the first one makes room again
+    budget.release(first)
+    assert inference_queue.get(timeout=5) == str(tmp_path / "c")
+    manager.join()
+    assert started == ["a", "b", "c"]
+    assert budget.queued_bytes() == 2000
+    budget.release(second)
+
+def test_waiting_downloads_give_up_when_stopped(tmp_path):
+    inference_queue = queue.Queue()
+    budget = DiskBudget(100)
+    started = []
+    stop = threading.Event()
+    manager = DownloadManager(inference_queue, budget, max_parallel=1, stopped=stop.is_set)
+    manager.submit(fake_download(tmp_path, started), "a")
+    manager.submit(fake_download(tmp_path, started), "b")
+    inference_queue.get(timeout=5)
+    stop.set()
+    assert manager.join() == [str(tmp_path / "a")]
+    assert started == ["a"]
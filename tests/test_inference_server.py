@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+from threading import Lock, Thread
+import numpy as np
+import inference_server
+from inference_server import InferenceServer
+
+def exit_on_first_request(request_queue):
+    # Stands in for a server process that crashes in the middle of a model call
+    request_queue.get()
+    os._exit(3)
+
+class UnpicklableError(Exception):
+    def __init__(self):
+        super().__init__("model failed")
+        self.lock = Lock()
+
+class FailingModel:
+    names = {0: "object"}
+
+    def __call__(self, frames):
+        raise UnpicklableError()
+
+#---------------------------------
+# A server that dies while a request is waiting must fail the frames instead of leaving the caller waiting
+def test_predict_fails_when_server_dies(monkeypatch):
+    monkeypatch.setattr(inference_server, "SERVER_CHECK_SECONDS", 0.05)
+    server = InferenceServer(("model.pt",))
+    server.process = multiprocessing.get_context("spawn").Process(target=exit_on_first_request, args=(server.request_queue,), daemon=True)
+    server.process.start()
+    server.dispatcher = Thread(target=server.dispatch_responses, daemon=True)
+    server.dispatcher.start()
+
+    frames = [np.zeros((4, 4, 3), dtype=np.uint8)] * 3
+    results = server.predict(frames)
+    assert len(results) == 3
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert server.pending == {}
+
+    # Later calls fail straight away
+    started = time.monotonic()
+    assert all(isinstance(result, RuntimeError) for result in server.predict(frames))
+    assert time.monotonic() - started < 1
+    server.response_queue.put(None)
+    server.dispatcher.join()
+
+#---------------------------------
+# Model errors go back to the client even when the exception itself can't be pickled
+def test_serve_sends_picklable_errors(monkeypatch):
+    monkeypatch.setattr(inference_server.model_backends, "load_model", lambda *options: FailingModel())
+    request_queue, response_queue = queue.Queue(), queue.Queue()
+    server = Thread(target=inference_server.serve, args=(("model.pt",), request_queue, response_queue, 16, 0))
+    server.start()
+    assert response_queue.get(timeout=5) == ("ready", {0: "object"})
+
+    request_queue.put((7, [np.zeros((4, 4, 3), dtype=np.uint8)] * 2))
+    request_queue.put(None)
+    server.join(timeout=5)
+    request_id, detections = response_queue.get(timeout=5)
+    assert request_id == 7
+    assert len(detections) == 2
+    assert all(isinstance(detection, RuntimeError) and "UnpicklableError: model failed" in str(detection) for detection in detections)
+    pickle.dumps(detections)
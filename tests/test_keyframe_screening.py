@@ -0,0 +1,59 @@
+import shutil
+import subprocess
+import pytest
+import keyframe_screening
+from test_video_io import FPS, HEIGHT, NUM_FRAMES, WIDTH, frame_index, write_indexed_frames
+
+# Keyframes 2 to 5 seconds apart and one forced in between, like a stream that inserts one on a scene cut
+KEYFRAME_SECONDS = [0, 2, 2.5, 7.5]
+
+#---------------------------------
+# Every keyframe must come out with the frame number OpenCV gives it, whatever the length of its GOP
+@pytest.fixture(scope="module")
+def keyframe_clip(tmp_path_factory):
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not on the PATH")
+    work_dir = tmp_path_factory.mktemp("keyframes")
+    source_path = str(work_dir / "source.avi")
+    write_indexed_frames(source_path, "MJPG")
+    path = str(work_dir / "clip.mp4")
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', source_path, '-c:v', 'libx264', '-bf', '3',
+        '-x264-params', f'keyint={NUM_FRAMES}:scenecut=0', '-force_key_frames', ",".join(str(seconds) for seconds in KEYFRAME_SECONDS), path,
+    ], check=True)
+    return path
+
+def test_keyframes_map_to_their_frame_numbers(keyframe_clip):
+    keyframes = list(keyframe_screening.read_keyframes(keyframe_clip, WIDTH, HEIGHT, FPS))
+    assert [frame_num for frame_num, _ in keyframes] == [round(seconds * FPS) for seconds in KEYFRAME_SECONDS]
+    for frame_num, frame in keyframes:
+        assert frame.shape == (HEIGHT, WIDTH, 3)
+        assert frame_index(frame) == frame_num
+
+#---------------------------------
+# In a recording the audio often starts before the video, OpenCV still counts the first video frame as frame 0
+def test_keyframes_of_a_video_that_starts_after_its_audio(keyframe_clip, tmp_path):
+    if shutil.which("ffprobe") is None:
+        pytest.skip("ffprobe is not on the PATH")
+    path = str(tmp_path / "late.mp4")
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', keyframe_clip, '-f', 'lavfi', '-i', f'sine=d={NUM_FRAMES / FPS}',
+        '-map', '0:v', '-map', '1:a', '-c:v', 'copy', '-c:a', 'aac', '-output_ts_offset', '10', path,
+    ], check=True)
+    assert keyframe_screening.get_start_time(path) > 0
+    keyframes = list(keyframe_screening.read_keyframes(path, WIDTH, HEIGHT, FPS))
+    assert [frame_num for frame_num, _ in keyframes] == [round(seconds * FPS) for seconds in KEYFRAME_SECONDS]
+
+def test_stopping_early_ends_ffmpeg(keyframe_clip):
+    keyframes = keyframe_screening.read_keyframes(keyframe_clip, WIDTH, HEIGHT, FPS)
+    assert next(keyframes)[0] == 0
+    keyframes.close()
+
+def test_candidate_ranges_reach_the_neighbouring_keyframes():
+    keyframes = [0, 60, 75, 225, 290]
+    assert keyframe_screening.candidate_ranges(keyframes, [], 300) == []
+    assert keyframe_screening.candidate_ranges(keyframes, [0], 300) == [(0, 60)]
+    assert keyframe_screening.candidate_ranges(keyframes, [2], 300) == [(60, 225)]
+    # Neighbouring hits join into one range, the last keyframe's range runs to the end of the video
+    assert keyframe_screening.candidate_ranges(keyframes, [1, 2], 300) == [(0, 225)]
+    assert keyframe_screening.candidate_ranges(keyframes, [0, 4], 300) == [(0, 60), (225, 299)]
@@ -0,0 +1,92 @@
+import json
+import os
+import cv2
+import numpy as np
+import pytest
+from detection_cache import Detections
+from test_video_io import BITS, FPS, HEIGHT, NUM_FRAMES, WIDTH, frame_index
+
+# Frame ranges the stand-in model detects its object in, both cross a segment boundary
+PLANTED = [(80, 140), (185, 260)]
+SEGMENT_STARTS = [0, 100, 200]
+
+#---------------------------------
+# Segments whose frames carry their index in the whole recording, like test_video_io's clips
+def write_segment(path, start_frame, end_frame):
+    video_writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
+    for frame_num in range(start_frame, end_frame):
+        frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        for bit in range(BITS):
+            if frame_num >> bit & 1:
+                frame[:, bit * 32:(bit + 1) * 32] = 255
+        video_writer.write(frame)
+    video_writer.release()
+
+def detect(frames, predictor=None, region_of_interest=None):
+    detections = []
+    for frame in frames:
+        found = any(start <= frame_index(frame) < end for start, end in PLANTED)
+        detections.append(Detections([0] * found, [0.9] * found, np.zeros((int(found), 4), dtype=np.float32)))
+    return detections
+
+@pytest.fixture
+def inference(tmp_path, monkeypatch):
+    # inference reads config.json from the working directory on import
+    settings = {
+        "output_dir": str(tmp_path / "output"), "debug": False, "log_output_only": False, "enable_preprocessing": False,
+        "histogram_equalization_weight": 0.5, "frame_check_interval": 5, "grace_period_val": 3, "min_detect_percent": 0,
+        "default_confidence_threshold": 0.5, "user_defined_confidence_thresholds": {}, "model_path": "model.pt",
+    }
+    monkeypatch.chdir(tmp_path)
+    with open(tmp_path / "config.json", 'w') as f:
+        json.dump({"inference": settings}, f)
+    import inference
+    settings.update({
+        "output_mode": "reencode", "batch_size": 4, "regions_of_interest": {}, "clip_buffer_scratch_dir": None,
+        "run_model_batch": detect, "get_model_names": lambda: {0: "marker"},
+    })
+    # The module may have been imported with other settings already
+    for name, value in settings.items():
+        monkeypatch.setattr(inference, name, value)
+    return inference
+
+def run_session(inference, monkeypatch, stream_name, segment_dir, segment_starts):
+    import live_inference
+    windows = []
+    monkeypatch.setattr(inference, "log_detection_window", lambda log_queue, **window: windows.append(window))
+    os.makedirs(segment_dir)
+    session = live_inference.LiveSession(stream_name)
+    for index, start_frame in enumerate(segment_starts):
+        end_frame = segment_starts[index + 1] if index + 1 < len(segment_starts) else NUM_FRAMES
+        segment_path = os.path.join(segment_dir, f"{stream_name}_{index:05d}.mp4")
+        write_segment(segment_path, start_frame, end_frame)
+        session.process_segment(segment_path)
+    session.finish()
+
+    clips = []
+    for index in range(session.saved_windows):
+        cap = cv2.VideoCapture(os.path.join(session.video_output_dir, f"marker-{stream_name}-{index:04d}.mp4"))
+        frames = []
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+            frames.append(frame_index(frame))
+        cap.release()
+        clips.append(frames)
+    return windows, clips
+
+#---------------------------------
+# Windows that are open at the end of a segment carry over into the next one, so the windows and clips are the
+# same as when the recording is processed as a single segment
+def test_windows_carry_over_segments(inference, monkeypatch, tmp_path):
+    whole_windows, whole_clips = run_session(inference, monkeypatch, "channel_20260101000000", str(tmp_path / "whole"), [0])
+    windows, clips = run_session(inference, monkeypatch, "channel_20260101000100", str(tmp_path / "segments"), SEGMENT_STARTS)
+
+    assert len(whole_windows) == len(PLANTED)
+    assert windows == whole_windows
+    assert clips == whole_clips
+    for boundary, clip in zip(SEGMENT_STARTS[1:], clips):
+        # Every clip runs through its segment boundary without a gap
+        assert clip[0] < boundary <= clip[-1]
+        assert clip == list(range(clip[0], clip[-1] + 1))
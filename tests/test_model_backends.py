@@ -0,0 +1,35 @@
+import os
+import model_backends
+
+#---------------------------------
+# An export is only reused while the .pt file and the options it was made with are unchanged
+def test_export_is_remade_when_options_change(tmp_path):
+    model_path = str(tmp_path / "model.pt")
+    calibration_path = str(tmp_path / "data.yaml")
+    for path in (model_path, calibration_path):
+        with open(path, 'w') as f:
+            f.write("x")
+    export_path = model_backends.get_export_path(model_path, "openvino", True)
+    os.makedirs(export_path)
+    options = model_backends.get_export_options("openvino", True, calibration_path)
+
+    # Exports from before the options were recorded
+    assert not model_backends.is_export_current(model_path, export_path, options)
+    model_backends.save_export_options(export_path, options)
+    assert model_backends.is_export_current(model_path, export_path, options)
+    assert options["dynamic"]
+
+    assert not model_backends.is_export_current(model_path, export_path, model_backends.get_export_options("openvino", True, None))
+    os.utime(calibration_path, (0, os.path.getmtime(calibration_path) + 10))
+    assert not model_backends.is_export_current(model_path, export_path, model_backends.get_export_options("openvino", True, calibration_path))
+
+    options = model_backends.get_export_options("openvino", True, calibration_path)
+    model_backends.save_export_options(export_path, options)
+    os.utime(model_path, (0, os.path.getmtime(export_path) + 10))
+    assert not model_backends.is_export_current(model_path, export_path, options)
+
+#---------------------------------
+# Calibration data only matters for the OpenVINO int8 export
+def test_calibration_data_ignored_without_openvino_int8():
+    assert model_backends.get_export_options("onnx", True, "data.yaml") == model_backends.get_export_options("onnx", True, None)
+    assert model_backends.get_export_options("openvino", False, "data.yaml") == model_backends.get_export_options("openvino", False, None)
@@ -0,0 +1,40 @@
+import numpy as np
+import roi
+from detection_cache import Detections
+
+#---------------------------------
+# Crops are taken from the region, shrunk to the model input size, and boxes come back in full frame coordinates
+def test_small_region_is_cropped_without_scaling():
+    frame = np.arange(180 * 320 * 3, dtype=np.uint32).astype(np.uint8).reshape(180, 320, 3)
+    region_of_interest = roi.RegionOfInterest([0.25, 0.5, 0.5, 0.5], 320, 180)
+    crop = region_of_interest.crop(frame)
+    np.testing.assert_array_equal(crop, frame[90:180, 80:240])
+    assert crop.flags['C_CONTIGUOUS']
+    mapped = region_of_interest.map_detections(Detections([1], [0.5], np.array([[10, 20, 30, 40]], dtype=np.float32)))
+    np.testing.assert_allclose(mapped.boxes, [[90, 110, 110, 130]])
+    assert list(mapped.class_ids) == [1] and list(mapped.confidences) == [0.5]
+
+def test_large_region_is_shrunk_to_the_model_input_size():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    frame[540:560, 960:1000] = 255
+    region_of_interest = roi.RegionOfInterest([0.25, 0.25, 0.5, 0.5], 1920, 1080)
+    crop = region_of_interest.crop(frame)
+    assert crop.shape == (360, 640, 3)
+    # The bright block sits at (480, 270)-(520, 290) of the 960x540 crop, two thirds of that after shrinking
+    rows, cols = np.nonzero(crop[:, :, 0] > 128)
+    box = np.array([[cols.min(), rows.min(), cols.max() + 1, rows.max() + 1]], dtype=np.float32)
+    mapped = region_of_interest.map_detections(Detections([0], [0.9], box))
+    np.testing.assert_allclose(mapped.boxes, [[960, 540, 1000, 560]], atol=2)
+
+def test_region_is_clamped_to_the_frame():
+    region_of_interest = roi.RegionOfInterest([0.9, -0.1, 0.5, 0.5], 100, 100)
+    assert (region_of_interest.x0, region_of_interest.y0, region_of_interest.x1, region_of_interest.y1) == (90, 0, 100, 40)
+
+def test_find_region_by_channel_or_folder(tmp_path):
+    regions = {"streamer": [0, 0, 0.5, 0.5], "streamer_two": [0.5, 0.5, 0.5, 0.5], "vods": [0, 0.5, 1, 0.5]}
+    assert roi.find_region("livevods/streamer_20240101120000.mp4", regions) == regions["streamer"]
+    assert roi.find_region("livevods/Streamer_Two_20240101120000.mp4", regions) == regions["streamer_two"]
+    assert roi.find_region("livevods/streamer_20240101120000/streamer_20240101120000_00003.ts", regions) == regions["streamer"]
+    assert roi.find_region("vods/some_vod_title.mp4", regions) == regions["vods"]
+    assert roi.find_region(str(tmp_path / "other" / "video.mp4"), regions) is None
+    assert roi.find_region(str(tmp_path / "other" / "video.mp4"), {str(tmp_path / "other"): [0, 0, 1, 1]}) == [0, 0, 1, 1]
@@ -0,0 +1,72 @@
+import time
+import pytest
+from mock_helix_server import MockHelixServer
+import twitch_api
+from twitch_api import TwitchClient
+
+@pytest.fixture
+def mock_helix():
+    mock = MockHelixServer(require_app_token=True).start()
+    yield mock
+    mock.stop()
+
+def make_client(mock):
+    return TwitchClient(mock.client_id, mock.client_secret, base_url=mock.base_url, token_url=mock.token_url, sleep=lambda seconds: None)
+
+def paths(mock):
+    return [path for path, _ in mock.requests]
+
+def test_user_id_is_looked_up_once_while_paging(mock_helix):
+    client = make_client(mock_helix)
+    user_id = client.get_user_id("SomeChannel")
+    first_page, cursor = client.get_videos(user_id, 10)
+    second_page, cursor = client.get_videos(client.get_user_id("somechannel"), 10, cursor)
+    assert [vod["title"] for vod in first_page + second_page] == [f"somechannel vod {index}" for index in range(20)]
+    assert paths(mock_helix) == ["/helix/users", "/helix/videos", "/helix/videos"]
+    # One token and one kept-alive connection for all of it
+    assert mock_helix.token_requests == 1
+    assert len(mock_helix.connections) == 1
+
+def test_pages_are_cached_and_revalidated(mock_helix, monkeypatch):
+    client = make_client(mock_helix)
+    user_id = client.get_user_id("channel")
+    page = client.get_videos(user_id, 10)
+    assert client.get_videos(user_id, 10) == page
+    assert paths(mock_helix).count("/helix/videos") == 1
+
+    # Once the entry is stale the page is asked for again with its ETag and the cached copy is kept on a 304
+    monkeypatch.setattr(twitch_api, "VOD_PAGE_CACHE_SECONDS", 0)
+    for entry in client.cache.values():
+        entry.expires_at = 0
+    assert client.get_videos(user_id, 10) == page
+    assert client.get_videos(user_id, 10) == page
+    assert paths(mock_helix).count("/helix/videos") == 3
+    assert mock_helix.not_modified == 2
+
+def test_uncached_requests_always_reach_the_api(mock_helix):
+    client = make_client(mock_helix)
+    client.get("streams", [("user_login", "channel")])
+    client.get("streams", [("user_login", "channel")])
+    assert paths(mock_helix) == ["/helix/streams", "/helix/streams"]
+
+def test_rejected_token_is_replaced(mock_helix):
+    client = make_client(mock_helix)
+    client.get_user_id("channel")
+    mock_helix.expire_tokens()
+    assert client.get("streams", [("user_login", "channel")]) == {"data": [], "pagination": {}}
+    assert mock_helix.token_requests == 2
+
+def test_token_is_renewed_before_it_expires(mock_helix):
+    mock_helix.token_lifetime = twitch_api.TOKEN_REFRESH_MARGIN_SECONDS + 60
+    client = make_client(mock_helix)
+    client.get("streams", [])
+    client.token_expires_at = time.time() + twitch_api.TOKEN_REFRESH_MARGIN_SECONDS - 1
+    client.get("streams", [])
+    assert mock_helix.token_requests == 2
+    assert len(paths(mock_helix)) == 2
+
+def test_static_token_is_not_replaced(mock_helix):
+    client = TwitchClient(mock_helix.client_id, oauth_token="revoked", base_url=mock_helix.base_url)
+    with pytest.raises(Exception):
+        client.get("streams", [])
+    assert mock_helix.token_requests == 0
@@ -0,0 +1,55 @@
+import time
+import pytest
+from mock_helix_server import MockHelixServer
+from twitch_api import TwitchClient
+from twitch_status import HelixStatusPoller
+
+CHANNELS = [f"channel{index:03d}" for index in range(250)]
+
+@pytest.fixture
+def mock_helix():
+    mock = MockHelixServer(live_logins=["channel007", "Channel120", "channel249"]).start()
+    yield mock
+    mock.stop()
+
+def make_poller(mock, sleeps=None, **options):
+    sleep = sleeps.append if sleeps is not None else time.sleep
+    return HelixStatusPoller(TwitchClient(mock.client_id, oauth_token="token", base_url=mock.base_url, sleep=sleep, **options))
+
+def test_batches_100_logins_per_request(mock_helix):
+    status = make_poller(mock_helix).poll(CHANNELS)
+    assert {channel for channel, value in status.items() if value == "online"} == {"channel007", "channel120", "channel249"}
+    assert set(status) == set(CHANNELS)
+    assert [len(params["user_login"]) for _, params in mock_helix.requests] == [100, 100, 50]
+
+def test_logins_are_case_insensitive(mock_helix):
+    assert make_poller(mock_helix).poll(["CHANNEL007", "channel008"]) == {"CHANNEL007": "online", "channel008": "offline"}
+
+def test_retries_server_errors_with_backoff(mock_helix):
+    mock_helix.forced_statuses = [500, 503]
+    sleeps = []
+    status = make_poller(mock_helix, sleeps).poll(["channel007"])
+    assert status == {"channel007": "online"}
+    assert sleeps == [1, 2]
+    assert len(mock_helix.requests) == 3
+
+def test_waits_for_the_rate_limit_reset(mock_helix):
+    mock_helix.rate_limit = mock_helix.remaining = 2
+    sleeps = []
+
+    def sleep(seconds):
+        # Stands in for the wait, the bucket refills as if the reset time had passed
+        sleeps.append(seconds)
+        mock_helix.reset_time = 0
+
+    poller = HelixStatusPoller(TwitchClient(mock_helix.client_id, oauth_token="token", base_url=mock_helix.base_url, sleep=sleep))
+    assert poller.poll(CHANNELS)["channel249"] == "online"
+    # Two requests empty the bucket, the third waits for the reset instead of running into a 429
+    assert len(sleeps) == 1 and 0 < sleeps[0] <= mock_helix.window_seconds + 1
+    assert len(mock_helix.requests) == 3
+
+def test_gives_up_after_max_retries(mock_helix):
+    mock_helix.forced_statuses = [500] * 10
+    with pytest.raises(RuntimeError):
+        make_poller(mock_helix, [], max_retries=2).poll(["channel007"])
+    assert len(mock_helix.requests) == 3
@@ -0,0 +1,108 @@
+import shutil
+import subprocess
+import cv2
+import numpy as np
+import pytest
+from video_io import FrameRangeReader, open_capture_at
+from windowing import compute_windows
+
+NUM_FRAMES = 300
+FPS = 30
+WIDTH, HEIGHT = 320, 180
+BITS = 9
+
+#---------------------------------
+# Clips whose frames carry their own index as a row of black and white bars
+def write_indexed_frames(path, fourcc):
+    video_writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), FPS, (WIDTH, HEIGHT))
+    for frame_num in range(NUM_FRAMES):
+        frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        for bit in range(BITS):
+            if frame_num >> bit & 1:
+                frame[:, bit * 32:(bit + 1) * 32] = 255
+        video_writer.write(frame)
+    video_writer.release()
+
+def frame_index(frame):
+    return sum(1 << bit for bit in range(BITS) if frame[HEIGHT // 2, bit * 32 + 16].mean() > 128)
+
+@pytest.fixture(scope="module", params=["mp4v", "h264-ts"])
+def indexed_clip(request, tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp(request.param)
+    if request.param == "mp4v":
+        path = str(work_dir / "clip.mp4")
+        write_indexed_frames(path, "mp4v")
+        return path
+
+    # MPEG-TS with B-frames and a long GOP, like a streamlink recording. OpenCV's own seek lands far off on these
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not on the PATH")
+    source_path = str(work_dir / "source.avi")
+    write_indexed_frames(source_path, "MJPG")
+    path = str(work_dir / "clip.ts")
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', source_path, '-c:v', 'libx264', '-g', '120', '-bf', '3', '-f', 'mpegts', path], check=True)
+    return path
+
+def read_all(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(frame_index(frame))
+    cap.release()
+    return frames
+
+def test_open_capture_at_lands_on_the_requested_frame(indexed_clip):
+    for frame_num in [0, 1, 7, 50, 119, 120, 121, 200, 257, NUM_FRAMES - 1]:
+        cap = open_capture_at(indexed_clip, frame_num, FPS)
+        success, frame = cap.read()
+        cap.release()
+        assert success
+        assert frame_index(frame) == frame_num
+
+def test_frame_range_reader(indexed_clip):
+    reader = FrameRangeReader(indexed_clip, FPS)
+    # Forward steps, a step back and a range running past the end of the clip
+    for start_frame, end_frame in [(5, 9), (12, 20), (150, 160), (40, 44), (NUM_FRAMES - 5, NUM_FRAMES + 10)]:
+        frames = [frame_index(frame) for frame in reader.read_range(start_frame, end_frame)]
+        assert frames == list(range(start_frame, min(end_frame, NUM_FRAMES - 1) + 1))
+    reader.release()
+
+#---------------------------------
+# Sharded detection reads every shard with a capture of its own, the merged result must match a sequential read
+def detect(frame_num):
+    # Deterministic stand-in for the model: two objects that come and go in bursts
+    return [object_id for object_id in (0, 1) if (frame_num // (40 + 25 * object_id)) % 2 == 0]
+
+def sampled_detections(indices, frame_check_interval):
+    rows = [(frame_num, object_id) for frame_num in indices if frame_num % frame_check_interval == 0 for object_id in detect(frame_num)]
+    return [frame_num for frame_num in indices if frame_num % frame_check_interval == 0], rows
+
+def read_shards(path, num_shards, frame_check_interval):
+    boundaries = [round(NUM_FRAMES * i / num_shards / frame_check_interval) * frame_check_interval for i in range(num_shards)] + [NUM_FRAMES]
+    indices = []
+    for start_frame, end_frame in zip(boundaries, boundaries[1:]):
+        cap = open_capture_at(path, start_frame, FPS)
+        for _ in range(start_frame, end_frame):
+            success, frame = cap.read()
+            if not success:
+                break
+            indices.append(frame_index(frame))
+        cap.release()
+    return indices
+
+@pytest.mark.parametrize("num_shards", [2, 3, 4])
+def test_sharded_matches_sequential(indexed_clip, num_shards):
+    frame_check_interval = 4
+    sequential = read_all(indexed_clip)
+    sharded = read_shards(indexed_clip, num_shards, frame_check_interval)
+    assert sharded == sequential == list(range(NUM_FRAMES))
+
+    windows = []
+    for indices in (sequential, sharded):
+        sampled_frames, rows = sampled_detections(indices, frame_check_interval)
+        frame_nums, object_ids = zip(*rows)
+        windows.append(compute_windows(sampled_frames, frame_nums, object_ids, [0.5] * len(rows), 3 * frame_check_interval))
+    assert windows[0] and windows[0] == windows[1]
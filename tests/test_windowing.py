@@ -0,0 +1,166 @@
+import statistics
+from collections import defaultdict
+import numpy as np
+import pytest
+from windowing import MEDIAN_BINS, WindowTracker, compute_windows
+
+#---------------------------------
+# Reference: the dict based windowing loop inference.py used before the tracker, reduced to the sampled frames
+def reference_windows(samples, frame_check_interval, grace_period_val):
+    # samples is a list of (frame_num, detections) where detections maps object_id -> confidences,
+    # or is None when the model raised on that frame
+    detection_windows = defaultdict(list)
+    gracep_counters = defaultdict(int)
+    currently_detected = defaultdict(bool)
+    confidence_values = defaultdict(list)
+    windows = []
+    for frame_num, detections in samples:
+        if detections is None:
+            continue
+        detected_objects = set(detections)
+        for object_id in sorted(detected_objects):
+            confidence_values[object_id].extend(detections[object_id])
+            detection_windows[object_id].append(frame_num)
+            gracep_counters[object_id] = grace_period_val * frame_check_interval
+        for object_id in gracep_counters:
+            if object_id not in detected_objects:
+                if gracep_counters[object_id] > 0:
+                    detection_windows[object_id].append(-1)
+                    gracep_counters[object_id] -= frame_check_interval
+                else:
+                    gracep_counters[object_id] = 0
+        for object_id, window in detection_windows.items():
+            if gracep_counters[object_id] > 0:
+                currently_detected[object_id] = True
+            elif currently_detected[object_id]:
+                confs = confidence_values[object_id]
+                windows.append((
+                    object_id,
+                    frame_num,
+                    max(f for f in window if f >= 0),
+                    sum(1 for f in window if f >= 0),
+                    len(window),
+                    sum(confs) / len(confs),
+                    statistics.median(confs),
+                    max(confs),
+                ))
+                detection_windows[object_id] = []
+                currently_detected[object_id] = False
+                confidence_values[object_id] = []
+    return windows
+
+def tracker_windows(samples, frame_check_interval, grace_period_val):
+    # Drives WindowTracker the way the main loop in inference.py does
+    tracker = WindowTracker(grace_period_val * frame_check_interval)
+    last_sampled_frame = None
+    windows = []
+    for frame_num, detections in samples:
+        if detections is None:
+            last_sampled_frame = frame_num
+            continue
+        gap = frame_num - last_sampled_frame if last_sampled_frame is not None else frame_check_interval
+        last_sampled_frame = frame_num
+        windows.extend(tracker.update(frame_num, detections, gap))
+    return windows
+
+def array_windows(samples, frame_check_interval, grace_period_val):
+    sampled_frames = [frame_num for frame_num, detections in samples if detections is not None]
+    failed_frames = [frame_num for frame_num, detections in samples if detections is None]
+    rows = [
+        (frame_num, object_id, conf)
+        for frame_num, detections in samples if detections is not None
+        for object_id in sorted(detections) for conf in detections[object_id]
+    ]
+    frame_nums, object_ids, confidences = zip(*rows) if rows else ((), (), ())
+    return compute_windows(sampled_frames, frame_nums, object_ids, confidences,
+                           grace_period_val * frame_check_interval, failed_frames=failed_frames)
+
+def random_samples(seed, num_samples, frame_check_interval, num_objects=4, failure_rate=0.0):
+    rng = np.random.default_rng(seed)
+    samples = []
+    for index in range(num_samples):
+        frame_num = index * frame_check_interval
+        if rng.random() < failure_rate:
+            samples.append((frame_num, None))
+            continue
+        detections = {}
+        for object_id in range(num_objects):
+            # Bursty detections so windows open, survive short gaps and close again
+            if rng.random() < (0.7 if (index // 15 + object_id) % 3 == 0 else 0.05):
+                detections[object_id] = [float(conf) for conf in rng.uniform(0.25, 1.0, size=rng.integers(1, 3))]
+        samples.append((frame_num, detections))
+    return samples
+
+def assert_matches_reference(windows, expected):
+    assert len(windows) == len(expected)
+    for window, (object_id, end_frame, last_valid_frame, frame_count, window_length, avg, median, peak) in zip(windows, expected):
+        assert window.object_id == object_id
+        assert window.end_frame == end_frame
+        assert window.last_valid_frame == last_valid_frame
+        assert window.frame_count == frame_count
+        assert window.window_length == window_length
+        assert window.avg_confidence == pytest.approx(avg)
+        assert window.peak_confidence == pytest.approx(peak)
+        # The engines keep a histogram instead of every value, the median is exact to one bin
+        assert abs(window.median_confidence - median) <= 1 / MEDIAN_BINS
+
+ENGINES = [tracker_windows, array_windows]
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("frame_check_interval,grace_period_val", [(1, 1), (8, 3), (5, 10)])
+def test_matches_reference(engine, seed, frame_check_interval, grace_period_val):
+    samples = random_samples(seed, 300, frame_check_interval)
+    expected = reference_windows(samples, frame_check_interval, grace_period_val)
+    assert expected
+    assert_matches_reference(engine(samples, frame_check_interval, grace_period_val), expected)
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference_with_failed_frames(engine, seed):
+    samples = random_samples(seed, 300, 8, failure_rate=0.1)
+    expected = reference_windows(samples, 8, 3)
+    assert_matches_reference(engine(samples, 8, 3), expected)
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_frame_does_not_spend_grace(engine):
+    # Grace of 3 samples: the failed frame at 16 must not count, so the window closes on frame 32 and not 24
+    samples = [(0, {1: [0.9]}), (8, {}), (16, None), (24, {}), (32, {}), (40, {})]
+    windows = engine(samples, 8, 3)
+    assert [(w.object_id, w.start_frame, w.end_frame, w.frame_count, w.window_length) for w in windows] == [(1, 0, 32, 1, 4)]
+    assert_matches_reference(windows, reference_windows(samples, 8, 3))
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_open_window_at_end_is_dropped(engine):
+    samples = [(0, {}), (8, {2: [0.5]}), (16, {2: [0.6]})]
+    assert engine(samples, 8, 3) == []
+
+def adaptive_samples(seed, num_frames, frame_check_interval, max_frame_check_interval, grace_period_val):
+    # Samples the way adaptive sampling in inference.py picks them: every frame_check_interval frames while a
+    # window is open, every max_frame_check_interval frames otherwise
+    rng = np.random.default_rng(seed)
+    detections_at = {}
+    for frame_num in range(0, num_frames, frame_check_interval):
+        detections_at[frame_num] = {object_id: [float(rng.uniform(0.25, 1.0))] for object_id in range(3)
+                                    if rng.random() < (0.8 if (frame_num // 200 + object_id) % 4 == 0 else 0.01)}
+    tracker = WindowTracker(grace_period_val * frame_check_interval)
+    samples = []
+    last_sampled_frame = None
+    for frame_num in range(0, num_frames, frame_check_interval):
+        interval = frame_check_interval if tracker.open_objects else max_frame_check_interval
+        if last_sampled_frame is not None and frame_num - last_sampled_frame < interval:
+            continue
+        gap = frame_num - last_sampled_frame if last_sampled_frame is not None else frame_check_interval
+        last_sampled_frame = frame_num
+        tracker.update(frame_num, detections_at[frame_num], gap)
+        samples.append((frame_num, detections_at[frame_num]))
+    return samples
+
+@pytest.mark.parametrize("seed", range(5))
+def test_array_engine_matches_tracker_with_adaptive_sampling(seed):
+    samples = adaptive_samples(seed, 4000, 2, 30, 6)
+    gaps = {b[0] - a[0] for a, b in zip(samples, samples[1:])}
+    assert 2 in gaps and 30 in gaps
+    expected = tracker_windows(samples, 2, 6)
+    assert expected
+    assert array_windows(samples, 2, 6) == expected
@@ -0,0 +1,191 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+import requests
+from settings import config
+
+# One Twitch API client shared by the VOD browser, the downloads and the channel monitor. Requests go through a
+# single pooled session, so the TLS connection to Twitch is reused instead of opened for every call. Responses
+# that rarely change (channel ids, pages of the VOD list) are kept for a while and revalidated with
+# If-None-Match when Twitch sent an ETag. Requests are paced with the Ratelimit-* headers and retried with
+# exponential backoff on 429s, server errors and connection problems. With a CLIENT_SECRET the app access token
+# is requested from Twitch and renewed before it expires or when it is rejected.
+
+HELIX_BASE_URL = "https://api.twitch.tv/helix"
+TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+REQUEST_TIMEOUT_SECONDS = 10
+MAX_BACKOFF_SECONDS = 60
+# A new token is requested this long before the current one expires
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+USER_ID_CACHE_SECONDS = 24 * 60 * 60
+VOD_PAGE_CACHE_SECONDS = 60
+MAX_CACHE_ENTRIES = 256
+
+class CacheEntry:
+    def __init__(self, data, etag, expires_at):
+        self.data = data
+        self.etag = etag
+        self.expires_at = expires_at
+
+class TwitchClient:
+    def __init__(self, client_id, client_secret=None, oauth_token=None, base_url=HELIX_BASE_URL, token_url=TOKEN_URL, max_retries=5, sleep=time.sleep):
+        self.client_id = client_id
+        self.client_secret = client_secret or None
+        self.base_url = base_url.rstrip("/")
+        self.token_url = token_url
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.session = requests.Session()
+        self.session.headers.update({'Client-ID': client_id})
+        self.token = oauth_token or None
+        self.token_expires_at = None
+        self.token_lock = Lock()
+        # (path, params) -> CacheEntry, least recently used first
+        self.cache = OrderedDict()
+        self.cache_lock = Lock()
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+        self.requests_made = 0
+
+    def get_token(self):
+        with self.token_lock:
+            if self.client_secret is not None and (self.token is None or time.time() >= self.token_expires_at - TOKEN_REFRESH_MARGIN_SECONDS):
+                self.token, expires_in = self.request_app_token()
+                self.token_expires_at = time.time() + expires_in
+            if self.token is None:
+                raise RuntimeError("No Twitch access token, set CLIENT_SECRET or OAUTH_TOKEN in the config")
+            return self.token
+
+    def request_app_token(self):
+        response = self.session.post(self.token_url, data={
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'client_credentials',
+        }, timeout=REQUEST_TIMEOUT_SECONDS)
+        data = response.json()
+        if 'access_token' not in data:
+            raise RuntimeError(f"Couldn't get a Twitch access token: {data.get('message', response.status_code)}")
+        return data['access_token'], data.get('expires_in', 3600)
+
+    def invalidate_token(self, token):
+        # Only an app token can be replaced, a rejected OAUTH_TOKEN stays an error
+        with self.token_lock:
+            if self.client_secret is None:
+                return False
+            if self.token == token:
+                self.token = None
+            return True
+
+    def update_rate_limit(self, headers):
+        if "Ratelimit-Remaining" in headers:
+            self.rate_limit_remaining = int(headers["Ratelimit-Remaining"])
+        if "Ratelimit-Reset" in headers:
+            self.rate_limit_reset = int(headers["Ratelimit-Reset"])
+
+    def wait_for_rate_limit(self):
+        # The bucket refills completely at Ratelimit-Reset (epoch seconds), only wait when it is empty
+        if self.rate_limit_remaining is not None and self.rate_limit_remaining <= 0 and self.rate_limit_reset is not None:
+            wait = self.rate_limit_reset - time.time()
+            if wait > 0:
+                print(f"Helix rate limit reached, waiting {wait:.1f}s")
+                self.sleep(wait)
+            self.rate_limit_remaining = None
+
+    def request(self, path, params, headers):
+        token_refreshed = False
+        attempt = 0
+        while attempt <= self.max_retries:
+            self.wait_for_rate_limit()
+            backoff = min(2 ** attempt, MAX_BACKOFF_SECONDS)
+            attempt += 1
+            token = self.get_token()
+            try:
+                response = self.session.get(f"{self.base_url}/{path}", params=params, headers={**headers, 'Authorization': f"Bearer {token}"}, timeout=REQUEST_TIMEOUT_SECONDS)
+            except requests.RequestException as e:
+                print(f"Helix request failed ({e}), retrying in {backoff}s")
+                self.sleep(backoff)
+                continue
+            self.requests_made += 1
+            self.update_rate_limit(response.headers)
+
+            if response.status_code == 401 and not token_refreshed and self.invalidate_token(token):
+                # The app token expired early or was revoked, retry once with a new one
+                token_refreshed = True
+                attempt -= 1
+                continue
+            if response.status_code == 429:
+                # wait_for_rate_limit sleeps until the reset when the response says when that is
+                if self.rate_limit_reset is not None and self.rate_limit_reset > time.time():
+                    self.rate_limit_remaining = 0
+                else:
+                    self.sleep(backoff)
+                continue
+            if response.status_code >= 500:
+                print(f"Helix returned {response.status_code}, retrying in {backoff}s")
+                self.sleep(backoff)
+                continue
+            response.raise_for_status()
+            return response
+        raise RuntimeError(f"Helix request to {path} failed after {self.max_retries + 1} attempts")
+
+    def get(self, path, params, cache_seconds=0):
+        # Returns the decoded response. With cache_seconds the response is reused for that long and revalidated
+        # with its ETag afterwards. Cached responses are shared, don't modify them
+        key = (path, tuple(params))
+        with self.cache_lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                if time.time() < entry.expires_at:
+                    return entry.data
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        response = self.request(path, params, headers)
+        if response.status_code == 304 and entry is not None:
+            data, etag = entry.data, entry.etag
+        else:
+            data, etag = response.json(), response.headers.get("ETag")
+
+        if cache_seconds > 0:
+            with self.cache_lock:
+                self.cache[key] = CacheEntry(data, etag, time.time() + cache_seconds)
+                self.cache.move_to_end(key)
+                while len(self.cache) > MAX_CACHE_ENTRIES:
+                    self.cache.popitem(last=False)
+        return data
+
+    def get_user_id(self, login):
+        data = self.get("users", [("login", login.lower())], USER_ID_CACHE_SECONDS)
+        users = data.get("data", [])
+        return users[0]["id"] if users else None
+
+    def get_videos(self, user_id, first=10, after_cursor=None):
+        # One page of a channel's past broadcasts, newest first, and the cursor of the next page
+        params = [("user_id", user_id), ("first", first), ("type", "archive")]
+        if after_cursor:
+            params.append(("after", after_cursor))
+        data = self.get("videos", params, VOD_PAGE_CACHE_SECONDS)
+        return data.get("data", []), data.get("pagination", {}).get("cursor")
+
+    def close(self):
+        self.session.close()
+
+shared_client = None
+shared_client_lock = Lock()
+
+def get_client():
+    # The client every module uses, built from the config on first use
+    global shared_client
+    with shared_client_lock:
+        if shared_client is None:
+            twitch_config = config["twitch_downloader"]
+            shared_client = TwitchClient(
+                twitch_config["CLIENT_ID"],
+                client_secret=twitch_config.get("CLIENT_SECRET"),
+                oauth_token=twitch_config.get("OAUTH_TOKEN"),
+                base_url=config["twitch_autodownloader"].get("HELIX_BASE_URL", HELIX_BASE_URL),
+                token_url=twitch_config.get("TOKEN_URL", TOKEN_URL),
+            )
+        return shared_client
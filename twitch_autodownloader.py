@@ -1,5 +1,5 @@
 import requests
-import json
+from settings import config
 import subprocess
 import os
 import time
@@ -7,8 +7,6 @@ import streamlink
 import sys
 import logging
 
-with open('config.json', 'r') as config_file:
-    config = json.load(config_file)
 
 OUTPUT_DIR = "livevods"
 live_processes = {}
@@ -64,14 +62,36 @@ def generate_output_path(channel_name):
     filename = f"{channel_name}_{time.strftime('%Y%m%d%H%M%S')}.mp4"
     return os.path.join(OUTPUT_DIR, filename)
 
-def download_stream(channel_name):
-    # Retrieve configuration options
-    desired_quality = config["twitch_autodownloader"]["DESIRED_QUALITY"]
+def get_trim_options():
     enable_trimming = config["twitch_autodownloader"]["ENABLE_TRIMMING"]
     start_time = config["twitch_autodownloader"]["START_TIME_MINUTES"] * 60  # Convert minutes to seconds
     end_time = config["twitch_autodownloader"]["END_TIME_MINUTES"] * 60  # Convert minutes to seconds
-
-    # Get the stream URL of the desired quality
+    options = []
+    if enable_trimming:
+        if start_time > 0:
+            options.extend(["-ss", str(start_time)])
+        if end_time > start_time:
+            options.extend(["-to", str(end_time)])
+    return options
+
+def get_record_command(stream_url, output_path):
+    return ["ffmpeg", "-i", stream_url, "-c", "copy", "-bsf:a", "aac_adtstoasc", *get_trim_options(), output_path]
+
+def get_segment_command(stream_url, segment_dir, stream_name):
+    # The segment list only gets a line once its segment is complete, so it tells which files are safe to read.
+    # Segments are cut on keyframes, so their length is only roughly LIVE_SEGMENT_SECONDS
+    segment_seconds = config["twitch_autodownloader"].get("LIVE_SEGMENT_SECONDS", 10)
+    return [
+        "ffmpeg", "-i", stream_url, "-c", "copy", "-map", "0:v:0", "-map", "0:a?", *get_trim_options(),
+        "-f", "segment", "-segment_time", str(segment_seconds), "-segment_format", "mpegts", "-reset_timestamps", "1",
+        "-segment_list", os.path.join(segment_dir, "segments.csv"), "-segment_list_type", "csv",
+        os.path.join(segment_dir, f"{stream_name}_%05d.ts"),
+    ]
+
+def prepare_recording(channel_name, segmented=False):
+    # Resolves the stream and returns the ffmpeg command that records it, the output file (or the segment
+    # directory when segmented) and the name of the recording, None if the stream can't be played
+    desired_quality = config["twitch_autodownloader"]["DESIRED_QUALITY"]
     stream_url = get_stream_url(channel_name, desired_quality)
     if not stream_url:
         print(f"Failed to get stream URL for {channel_name}.")
@@ -79,19 +99,19 @@ def download_stream(channel_name):
         return None
 
     output_path = generate_output_path(channel_name)
-    print(f"Downloading stream for {channel_name} to {output_path}...")
+    stream_name = os.path.splitext(os.path.basename(output_path))[0]
+    if not segmented:
+        return get_record_command(stream_url, output_path), output_path, stream_name
+    segment_dir = os.path.join(OUTPUT_DIR, stream_name)
+    os.makedirs(segment_dir, exist_ok=True)
+    return get_segment_command(stream_url, segment_dir, stream_name), segment_dir, stream_name
 
-    # Construct the FFmpeg command
-    cmd = ["ffmpeg", "-i", stream_url, "-c", "copy", "-bsf:a", "aac_adtstoasc"]
-    if enable_trimming:
-        if start_time > 0:
-            cmd.extend(["-ss", str(start_time)])
-        if end_time > start_time:
-            cmd.extend(["-to", str(end_time)])
-    cmd.append(output_path)
-
-    process = subprocess.Popen(cmd)
-    live_processes[channel_name] = process
+def download_stream(channel_name):
+    recording = prepare_recording(channel_name)
+    if recording is None:
+        return None
+    cmd, output_path, _ = recording
+    print(f"Downloading stream for {channel_name} to {output_path}...")
 
     # Generate log file paths
     stdout_log_file = os.path.join(OUTPUT_DIR, f"{channel_name}_stdout.log")
@@ -104,6 +124,16 @@ def download_stream(channel_name):
     process.communicate()  # Wait for the process to finish
     return output_path
 
+def get_completed_segments(segment_dir):
+    # Paths of the segments ffmpeg has finished writing, in recording order
+    list_path = os.path.join(segment_dir, "segments.csv")
+    if not os.path.exists(list_path):
+        return []
+    with open(list_path) as list_file:
+        lines = list_file.read().splitlines()
+    # The last line may still be half written
+    return [os.path.join(segment_dir, line.split(",")[0]) for line in lines if line.count(",") >= 2]
+
 def stop_download(channel_name):
     if channel_name in live_processes:
         print(f"Stopping download for {channel_name}. Process ID: {live_processes[channel_name].pid}")
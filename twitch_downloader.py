@@ -2,23 +2,63 @@ import os
 import subprocess
 import requests
 import threading
-import json
+import twitch_api
+import clip_fetcher
+from settings import config
 import re
 
-# Load configuration from config.json
-with open('config.json', 'r') as config_file:
-    config = json.load(config_file)
 
-CLIENT_ID = config["twitch_downloader"]["CLIENT_ID"]
-OAUTH_TOKEN = config["twitch_downloader"]["OAUTH_TOKEN"]
 desired_quality = config["twitch_downloader"]["DESIRED_QUALITY"]
+# Quality of the download inference runs on, the clips are then downloaded at desired_quality. None downloads
+# the whole VOD at desired_quality
+analysis_quality = config["twitch_downloader"].get("ANALYSIS_QUALITY")
+# HLS segments fetched at once for each VOD
+concurrent_fragments = config["processor"].get("CONCURRENT_FRAGMENTS", 1)
 
-HEADERS = {
-    'Client-ID': CLIENT_ID,
-    'Authorization': f"Bearer {OAUTH_TOKEN}"
+print_lock = threading.Lock()
+
+def get_download_range():
+    # (start, end) in seconds of the part of the VOD to download, None for the whole VOD
+    trimming_config = config["twitch_downloader"]
+    if not trimming_config["ENABLE_TRIMMING"]:
+        return None
+    start_time_seconds = trimming_config["START_TIME_MINUTES"] * 60
+    end_time_seconds = trimming_config["END_TIME_MINUTES"] * 60
+
+    # Ensure end_time is after start_time
+    if end_time_seconds <= start_time_seconds:
+        print("Error: END_TIME_MINUTES is not greater than START_TIME_MINUTES. Skipping trimming.")
+        return None
+    return start_time_seconds, end_time_seconds
+
+# Define video quality format codes
+quality_codes = {
+    "1080p": "1080p60",
+    "720p": "720p60",
+    "480p": "480p",
+    "360p": "360p",
+    "160p": "160p",
 }
 
-print_lock = threading.Lock()
+def get_download_command(vod_id, output_path, download_range=None, quality_name=None):
+    # Define desired video quality
+    quality = quality_codes.get(quality_name or desired_quality, "best")
+
+    cmd = f"yt-dlp https://www.twitch.tv/videos/{vod_id} -f {quality} -N {concurrent_fragments} -o \"{output_path}\""
+    if download_range is not None:
+        # Only the HLS segments covering the range are fetched. The cut is stream copied, so it starts at the
+        # keyframe before the start time like a trimmed download did
+        cmd += f" --download-sections \"*{download_range[0]}-{download_range[1]}\""
+    return cmd
+
+def download_section(vod_id, start, end, output_path):
+    # One clip of the two-resolution workflow, cut from the VOD at the desired quality
+    cmd = get_download_command(vod_id, output_path, (f"{start:.3f}", f"{end:.3f}"))
+    process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        print(f"Error downloading {start:.1f}-{end:.1f}s of VOD {vod_id}: {process.stderr}")
+        return False
+    return True
 
 def download_single_vod(channel_name, vod_id, title):
     sanitized_title = sanitize_title(title)
@@ -27,93 +67,66 @@ def download_single_vod(channel_name, vod_id, title):
     if not os.path.exists("vods"):
         os.makedirs("vods")
 
-    # Define video quality format codes
-    quality_codes = {
-        "1080p": "1080p60",
-        "720p": "720p60",
-        "480p": "480p",
-        "360p": "360p",
-    }
-
-    # Define desired video quality
-    quality = quality_codes.get(desired_quality, "best")
-
     root_directory = os.getcwd()  # This gets the current working directory of the script
-    output_path = os.path.join(root_directory, "vods", f"{sanitized_title}.mp4")
+    download_range = get_download_range()
+    if download_range is not None:
+        print(f"Downloading minutes {download_range[0] // 60}-{download_range[1] // 60} of the VOD only")
+        output_path = os.path.join(root_directory, "vods", f"trimmed_{sanitized_title}.mp4")
+    else:
+        output_path = os.path.join(root_directory, "vods", f"{sanitized_title}.mp4")
+
+    if analysis_quality:
+        print(f"Downloading the VOD at {analysis_quality} for inference, the clips are downloaded at {desired_quality} afterwards")
 
-    quoted_output_path = f"\"{output_path}\""
-    
     # Construct the command to use yt-dlp
-    cmd = f"yt-dlp https://www.twitch.tv/videos/{vod_id} -f {quality} -o {quoted_output_path}"
+    cmd = get_download_command(vod_id, output_path, download_range, analysis_quality)
     
     # Print the command for debugging
     print(f"Executing command: {cmd}")
     
     # Run the command in a non-blocking manner and capture the output in real-time
-    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # stderr is read along with stdout, a ranged download passes ffmpeg's progress through it and a full pipe
+    # would stall the download
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    error_lines = []
     while True:
         output = process.stdout.readline()
         if output == '' and process.poll() is not None:
             break
         if output:
+            if "ERROR" in output or "Unhandled exception" in output:
+                error_lines.append(output.strip())
             with print_lock:  # Use the print lock to ensure synchronized printing
                 print(output.strip(), end='\r')  # Use end='\r' to overwrite the current line
     rc = process.poll()
 
     # Check for errors in the result
-    stderr_output = process.stderr.read()
-    if "ERROR" in stderr_output or "Unhandled exception" in stderr_output:
-        print(stderr_output)
+    if error_lines:
+        print("\n".join(error_lines))
         print(f"Error downloading VOD {sanitized_title} with id {vod_id}: VOD not found or inaccessible.\n")
         return None
 
     print("\nDownload completed.")
-
-    trimming_config = config["twitch_downloader"]
-    if trimming_config["ENABLE_TRIMMING"]:
-        print("Trimming video...")
-        start_time_seconds = trimming_config["START_TIME_MINUTES"] * 60
-        end_time_seconds = trimming_config["END_TIME_MINUTES"] * 60
-
-        # Ensure end_time is after start_time
-        if end_time_seconds <= start_time_seconds:
-            print("Error: END_TIME_MINUTES is not greater than START_TIME_MINUTES. Skipping trimming.")
-        else:
-            trimmed_output_path = os.path.join(root_directory, "vods", f"trimmed_{sanitized_title}.mp4")
-            success = trim_video(quoted_output_path, start_time_seconds, end_time_seconds, trimmed_output_path)
-            if success:
-                print(f"Trimmed video saved to {trimmed_output_path}")
-                try:
-                    os.remove(quoted_output_path)  # Delete the original VOD file
-                    print(f"Original VOD file {quoted_output_path} deleted.")
-                except Exception as e:
-                    print(f"Failed to delete original VOD file: {e}")
-                return trimmed_output_path  # Return the path to the trimmed video
-            else:
-                print("Failed to trim video.")
+    if analysis_quality:
+        offset_seconds = download_range[0] if download_range is not None else 0
+        clip_fetcher.register(output_path, lambda start, end, part_path: download_section(vod_id, start, end, part_path), offset_seconds)
     print(output_path)
     return output_path
 
 def get_user_id(channel_name):
-    url = f"https://api.twitch.tv/helix/users?login={channel_name}"
-    response = requests.get(url, headers=HEADERS)
-    data = response.json()
-    #print(data)
-    
-    if 'data' in data and len(data['data']) > 0:
-        return data['data'][0]['id']
-    else:
-        print(response)
-        print("Error fetching user ID. Check the response above for details.")
+    # Cached by the client, paging through a channel's VODs only looks the id up once
+    try:
+        user_id = twitch_api.get_client().get_user_id(channel_name)
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"Error fetching user ID: {e}")
         return None
+    if user_id is None:
+        print(f"Error fetching user ID. No Twitch user named {channel_name}.")
+    return user_id
 
 def get_latest_vod_ids(user_id, num_vods=1, after_cursor=None):
-    url = f"https://api.twitch.tv/helix/videos?user_id={user_id}&first={num_vods}&type=archive"
-    if after_cursor:
-        url += f"&after={after_cursor}"
-    response = requests.get(url, headers=HEADERS)
-    data = response.json()
-    return [vod['id'] for vod in data['data']]
+    vods, _ = twitch_api.get_client().get_videos(user_id, num_vods, after_cursor)
+    return [vod['id'] for vod in vods]
     
 def get_latest_vods(channel_name, num_vods=10, after_cursor=None):
     user_id = get_user_id(channel_name)
@@ -121,28 +134,13 @@ def get_latest_vods(channel_name, num_vods=10, after_cursor=None):
         print(f"Failed to get user_id for channel: {channel_name}")
         return [], None  # Return empty list and None for after_cursor
 
-    url = f"https://api.twitch.tv/helix/videos?user_id={user_id}&first={num_vods}&type=archive"
-    if after_cursor:
-        url += f"&after={after_cursor}"
-        
-    response = requests.get(url, headers=HEADERS)
-    data = response.json()
-
-    if 'data' not in data:
-        print(f"Error fetching VODs. Response: {data}")
+    try:
+        vods, after_cursor = twitch_api.get_client().get_videos(user_id, num_vods, after_cursor)
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"Error fetching VODs: {e}")
         return [], None  # Return empty list and None for after_cursor
 
-    after_cursor = data['pagination'].get('cursor', None) if 'pagination' in data else None
-    return [(vod['title'], vod['id']) for vod in data['data']], after_cursor
-
-def trim_video(input_path, start_time, end_time, output_path):
-    cmd = f"ffmpeg -y -i {input_path} -ss {start_time} -to {end_time} -c:v copy -c:a copy {output_path}"
-    process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if process.returncode == 0:
-        return True
-    else:
-        print(f"Error trimming video: {process.stderr.decode('utf-8')}")
-        return False
+    return [(vod['title'], vod['id']) for vod in vods], after_cursor
 
 def sanitize_title(title, max_length=40):
     # Replace spaces with underscores and remove other non-alphanumeric characters
@@ -0,0 +1,30 @@
+# Live status of many channels from the Helix streams endpoint. One request covers up to 100 logins, so a few
+# hundred channels are checked with a handful of requests instead of one streamlink resolution each. The
+# requests go through the shared Twitch client, which paces them with the rate limit headers and retries errors.
+
+MAX_LOGINS_PER_REQUEST = 100
+
+class HelixStatusPoller:
+    def __init__(self, client):
+        self.client = client
+
+    def get_live_logins(self, logins):
+        # Lowercase logins of the channels that are live right now. Never cached, the status has to be current
+        logins = sorted({login.lower() for login in logins})
+        live = set()
+        for index in range(0, len(logins), MAX_LOGINS_PER_REQUEST):
+            params = [("user_login", login) for login in logins[index:index + MAX_LOGINS_PER_REQUEST]]
+            params.append(("first", MAX_LOGINS_PER_REQUEST))
+            cursor = None
+            while True:
+                data = self.client.get("streams", params + ([("after", cursor)] if cursor else []))
+                live.update(stream["user_login"].lower() for stream in data.get("data", []) if stream.get("type", "live") == "live")
+                cursor = data.get("pagination", {}).get("cursor")
+                if not cursor or not data.get("data"):
+                    break
+        return live
+
+    def poll(self, channels):
+        # Maps every channel to "online" or "offline"
+        live = self.get_live_logins(channels)
+        return {channel: "online" if channel.lower() in live else "offline" for channel in channels}
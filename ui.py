@@ -8,10 +8,8 @@ import threading
 import os
 import sys
 import subprocess
-from processor import channel_flags
 import time
 
-print_lock = threading.Lock()
 
 class App(npyscreen.NPSAppManaged):
     def __init__(self, *args, **kwargs):
@@ -181,18 +179,10 @@ class TwitchForm(npyscreen.ActionForm):
         # Start the inference worker thread
         threading.Thread(target=processor.inference_worker).start()
 
-        def download_and_infer():
-            print(f"VOD IDs to download: {self.selected_vod_ids}")  # Debug line
-            for title, vod_id in self.selected_vod_ids:
-                with print_lock:
-                    vod_file = twitch_downloader.download_single_vod(self.channel_name_value, vod_id, title)  # Pass title here
-                # Add the downloaded vod to the queue for inference
-                processor.waiting_for_inference.put(vod_file)
-            # Put sentinel values for each inference worker thread to signal them to exit
-            for _ in range(processor.MAX_INFERENCE_THREADS):
-                processor.waiting_for_inference.put(None)
-
-        threading.Thread(target=download_and_infer).start()
+        print(f"VOD IDs to download: {self.selected_vod_ids}")  # Debug line
+        # Every VOD goes to inference as soon as it is downloaded, while the next ones are still downloading
+        downloads = [(twitch_downloader.download_single_vod, self.channel_name_value, vod_id, title) for title, vod_id in self.selected_vod_ids]
+        threading.Thread(target=processor.download_and_queue, args=(downloads,)).start()
         self.parentApp.switchForm(None)
 
     def on_cancel(self):
@@ -258,23 +248,17 @@ class TwitchAutoDownloaderForm(npyscreen.FormBaseNew):
  
     def on_stop_downloads(self):
         self.stop_thread = True
-        processor.STOP_MONITORING = True
         self.parentApp.switchForm(None)
-        for channel in processor.channel_flags.keys():
-            try:
-                twitch_autodownloader.stop_download(channel)
-            except Exception as e:
-                print(f"An error occurred while stopping the download for {channel}: {e}")
+        # Stops every recording, finished recordings still go to inference
+        processor.stop_monitoring()
         print("Joining threads")
         for thread in self.threads:
             thread.join()  # Wait for the thread to complete
     
     def on_exit(self):
         self.stop_thread = True  # Signal the thread to stop
-        processor.STOP_MONITORING = True
         processor.STOP_INFERENCE = True
-        for channel in processor.channel_flags.keys():
-            twitch_autodownloader.stop_download(channel)
+        processor.stop_monitoring()
         self.monitoring_thread.join()  # Wait for the monitoring thread to finish
         for _ in range(processor.MAX_INFERENCE_THREADS):
             processor.waiting_for_inference.put(None)
@@ -330,17 +314,8 @@ class YouTubeForm(npyscreen.ActionForm):
         # Start the inference worker thread
         threading.Thread(target=processor.inference_worker).start()
 
-        def download_and_infer():
-            for url in self.selected_video_urls:
-                with print_lock:
-                    video_file = youtube_downloader.download_video(url)
-                # Add the downloaded video to the queue for inference
-                processor.waiting_for_inference.put(video_file)
-            # Put sentinel values for each inference worker thread to signal them to exit
-            for _ in range(processor.MAX_INFERENCE_THREADS):
-                processor.waiting_for_inference.put(None)
-
-        threading.Thread(target=download_and_infer).start()
+        downloads = [(youtube_downloader.download_video, url) for url in self.selected_video_urls]
+        threading.Thread(target=processor.download_and_queue, args=(downloads,)).start()
         self.parentApp.switchForm(None)
 
     def on_ok(self):
@@ -437,15 +412,8 @@ class YouTubeShortsForm(npyscreen.ActionForm):
     def start_download_and_inference(self):
         threading.Thread(target=processor.inference_worker).start()
 
-        def download_and_infer():
-            for url in self.selected_short_urls:
-                with print_lock:
-                    short_file = youtube_downloader_shorts.download_short(url)
-                processor.waiting_for_inference.put(short_file)
-            for _ in range(processor.MAX_INFERENCE_THREADS):
-                processor.waiting_for_inference.put(None)
-
-        threading.Thread(target=download_and_infer).start()
+        downloads = [(youtube_downloader_shorts.download_short, url) for url in self.selected_short_urls]
+        threading.Thread(target=processor.download_and_queue, args=(downloads,)).start()
         self.parentApp.switchForm(None)
 
     def on_cancel(self):
@@ -0,0 +1,85 @@
+import cv2
+
+# Frame accurate random access on top of cv2.VideoCapture. Setting CAP_PROP_POS_FRAMES is only exact when the
+# container has a usable index: on MPEG-TS recordings (what streamlink writes) OpenCV can land seconds away
+# from the requested frame while still reporting the requested position. The timestamp of the frame that was
+# actually decoded is reliable, so every seek is checked against it and corrected by decoding forward.
+
+# How far past the current position a read may start before seeking is cheaper than decoding forward
+MAX_FORWARD_GRAB_SECONDS = 10
+
+def frame_at_position(cap, fps):
+    # Index of the frame that was grabbed last, from its presentation timestamp
+    return int(round(cap.get(cv2.CAP_PROP_POS_MSEC) * fps / 1000))
+
+def grab_frames(cap, count):
+    for _ in range(count):
+        if not cap.grab():
+            return False
+    return True
+
+def seek_capture(cap, video_path, frame_num, fps):
+    # Positions the capture so that the next read() returns frame_num. Returns the capture to use from now on,
+    # which is a fresh one if the seek could not be corrected, or None if the video ends before frame_num
+    if frame_num <= 0:
+        cap.release()
+        return cv2.VideoCapture(video_path)
+
+    target = frame_num - 1
+    seek_to = target
+    while seek_to > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, seek_to)
+        if not cap.grab():
+            break
+        landed = frame_at_position(cap, fps)
+        if landed <= target:
+            # Landed on or before the frame in front of frame_num, decode forward to it
+            return cap if grab_frames(cap, target - landed) else None
+        # Overshot, retry further back so the decoder starts from an earlier keyframe
+        seek_to -= max(2 * (landed - seek_to), int(fps))
+
+    # Seeking is no use for this file, decode forward from the start
+    cap.release()
+    cap = cv2.VideoCapture(video_path)
+    return cap if grab_frames(cap, frame_num) else None
+
+def open_capture_at(video_path, frame_num, fps):
+    return seek_capture(cv2.VideoCapture(video_path), video_path, frame_num, fps)
+
+class FrameRangeReader:
+    # Reads inclusive frame ranges with one capture that is reused between ranges. Ranges that start a little
+    # after the previous one are reached by decoding forward, everything else by a checked seek
+    def __init__(self, video_path, fps, preprocess=None, max_forward_seconds=MAX_FORWARD_GRAB_SECONDS):
+        self.video_path = video_path
+        self.fps = fps
+        self.preprocess = preprocess
+        self.max_forward_seconds = max_forward_seconds
+        self.cap = None
+        self.next_frame = 0
+
+    def read_range(self, start_frame, end_frame):
+        forward = start_frame - self.next_frame
+        if self.cap is not None and 0 <= forward <= self.max_forward_seconds * self.fps:
+            if not grab_frames(self.cap, forward):
+                return
+        else:
+            if self.cap is None:
+                self.cap = cv2.VideoCapture(self.video_path)
+            self.cap = seek_capture(self.cap, self.video_path, start_frame, self.fps)
+            if self.cap is None:
+                return
+        self.next_frame = start_frame
+
+        while self.next_frame <= end_frame:
+            success, frame = self.cap.read()
+            if not success:
+                break
+            self.next_frame += 1
+            if self.preprocess is not None:
+                frame = self.preprocess(frame)
+            yield frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
@@ -0,0 +1,184 @@
+from collections import namedtuple
+import numpy as np
+
+# Detection window bookkeeping shared by the frame-by-frame pipeline (WindowTracker) and the whole-video
+# array engine (compute_windows). Both follow the same rules: a detection (re)arms the grace counter of its
+# object with grace_frames, every sampled frame without a detection spends the frames since the previous
+# sample, and the window closes on the sampled frame where the counter runs out. Windows that are still
+# open when the video ends are dropped. A sampled frame the model failed on is skipped as if it was never
+# sampled, it neither extends a window nor spends grace.
+
+# Confidence values are only kept as a histogram, the median is the centre of the bin holding the median
+MEDIAN_BINS = 1000
+
+Window = namedtuple("Window", [
+    "object_id", "start_frame", "end_frame", "last_valid_frame", "frame_count", "window_length",
+    "avg_confidence", "median_confidence", "peak_confidence",
+])
+
+def window_detection_percentage(window):
+    return window.frame_count / max(window.window_length, 1)
+
+def confidence_bins(confidences):
+    bins = (np.asarray(confidences, dtype=np.float64) * MEDIAN_BINS).astype(np.int64)
+    return np.clip(bins, 0, MEDIAN_BINS - 1)
+
+def histogram_median(histogram, count):
+    if count == 0:
+        return 0
+    cumulative = np.cumsum(histogram)
+    lower_bin = int(np.searchsorted(cumulative, (count - 1) // 2, side='right'))
+    upper_bin = int(np.searchsorted(cumulative, count // 2, side='right'))
+    return (lower_bin + upper_bin + 1) / (2 * MEDIAN_BINS)
+
+class WindowState:
+    # Running statistics of one open window, constant size no matter how long the window lasts
+    def __init__(self, start_frame):
+        self.start_frame = start_frame
+        self.last_valid_frame = start_frame
+        self.frame_count = 0
+        self.window_length = 0
+        self.grace = 0
+        self.open = False
+        self.confidence_count = 0
+        self.confidence_sum = 0.0
+        self.confidence_peak = 0.0
+        self.confidence_histogram = np.zeros(MEDIAN_BINS, dtype=np.int64)
+
+    def add_detection(self, frame_num, confidences):
+        self.last_valid_frame = frame_num
+        self.frame_count += 1
+        self.window_length += 1
+        for conf in confidences:
+            conf = float(conf)
+            self.confidence_sum += conf
+            self.confidence_peak = max(self.confidence_peak, conf)
+        self.confidence_count += len(confidences)
+        np.add.at(self.confidence_histogram, confidence_bins(confidences), 1)
+
+    def finish(self, object_id, end_frame):
+        return Window(
+            object_id=object_id,
+            start_frame=self.start_frame,
+            end_frame=end_frame,
+            last_valid_frame=self.last_valid_frame,
+            frame_count=self.frame_count,
+            window_length=self.window_length,
+            avg_confidence=self.confidence_sum / max(self.confidence_count, 1),
+            median_confidence=histogram_median(self.confidence_histogram, self.confidence_count),
+            peak_confidence=self.confidence_peak,
+        )
+
+class WindowTracker:
+    # Incremental window engine, the work per sampled frame only depends on the objects that are detected
+    # or still inside their grace period, not on how many classes the model has
+    def __init__(self, grace_frames):
+        self.grace_frames = grace_frames
+        self.windows = {}
+        self.open_objects = set()
+        self.object_order = {}
+
+    def update(self, frame_num, detections, gap):
+        # detections maps object_id -> confidences of this sampled frame that passed the threshold
+        for object_id in sorted(detections):
+            self.object_order.setdefault(object_id, len(self.object_order))
+            state = self.windows.get(object_id)
+            if state is None:
+                state = self.windows[object_id] = WindowState(frame_num)
+            state.add_detection(frame_num, detections[object_id])
+            state.grace = self.grace_frames
+
+        closed = []
+        for object_id, state in list(self.windows.items()):
+            if object_id not in detections and state.grace > 0:
+                state.window_length += 1
+                state.grace -= gap
+
+            if state.grace > 0:
+                state.open = True
+                self.open_objects.add(object_id)
+            elif state.open:
+                closed.append(state.finish(object_id, frame_num))
+                del self.windows[object_id]
+                self.open_objects.discard(object_id)
+
+        closed.sort(key=lambda window: self.object_order[window.object_id])
+        return closed
+
+def grace_positions(sampled_frames, failed_frames):
+    # Position of every sampled frame on the axis grace is spent on: the frame number minus the frames between
+    # a failed frame and the sample before it, which the frame-by-frame pipeline never spends
+    failed_frames = np.asarray(failed_frames, dtype=np.int64)
+    if len(failed_frames) == 0:
+        return sampled_frames
+    attempted = np.union1d(sampled_frames, failed_frames)
+    gaps = np.diff(attempted, prepend=attempted[0])
+    lost = np.cumsum(np.where(np.isin(attempted, failed_frames), gaps, 0))
+    return (attempted - lost)[np.searchsorted(attempted, sampled_frames)]
+
+def compute_windows(sampled_frames, frame_nums, object_ids, confidences, grace_frames, failed_frames=()):
+    # Whole-video version of WindowTracker over column arrays. frame_nums/object_ids/confidences hold one row
+    # per detection that passed its confidence threshold, sampled_frames every frame the model ran on and
+    # failed_frames the sampled frames where the model raised
+    sampled_frames = np.asarray(sampled_frames, dtype=np.int64)
+    frame_nums = np.asarray(frame_nums, dtype=np.int64)
+    object_ids = np.asarray(object_ids, dtype=np.int64)
+    confidences = np.asarray(confidences, dtype=np.float64)
+    if grace_frames <= 0 or len(frame_nums) == 0:
+        return []
+
+    sample_indices = np.searchsorted(sampled_frames, frame_nums)
+    positions = grace_positions(sampled_frames, failed_frames)
+    # Objects are reported in the order they were first detected, like the frame-by-frame tracker does
+    first_rows = np.lexsort((object_ids, sample_indices))
+    _, first_positions = np.unique(object_ids[first_rows], return_index=True)
+    object_order = {int(object_ids[first_rows][position]): rank for rank, position in enumerate(np.sort(first_positions))}
+
+    windows = []
+    for object_id in np.unique(object_ids):
+        rows = np.flatnonzero(object_ids == object_id)
+        rows = rows[np.argsort(sample_indices[rows], kind='stable')]
+        row_samples = sample_indices[rows]
+
+        # Sampled frames with at least one detection, and the sample where the grace period would run out
+        detected_samples, row_to_detected = np.unique(row_samples, return_inverse=True)
+        close_samples = np.searchsorted(positions, positions[detected_samples] + grace_frames, side='left')
+
+        # A new window starts whenever the next detection comes after the previous window closed
+        starts_window = np.concatenate(([True], detected_samples[1:] > close_samples[:-1]))
+        window_ids = np.cumsum(starts_window) - 1
+        num_windows = int(window_ids[-1]) + 1
+        first_positions = np.flatnonzero(starts_window)
+        last_positions = np.concatenate((first_positions[1:] - 1, [len(detected_samples) - 1]))
+
+        row_windows = window_ids[row_to_detected]
+        confidence_count = np.bincount(row_windows, minlength=num_windows)
+        confidence_sum = np.bincount(row_windows, weights=confidences[rows], minlength=num_windows)
+        confidence_peak = np.zeros(num_windows)
+        np.maximum.at(confidence_peak, row_windows, confidences[rows])
+        histograms = np.bincount(
+            row_windows * MEDIAN_BINS + confidence_bins(confidences[rows]), minlength=num_windows * MEDIAN_BINS
+        ).reshape(num_windows, MEDIAN_BINS)
+
+        for window_index in range(num_windows):
+            first_sample = detected_samples[first_positions[window_index]]
+            last_sample = detected_samples[last_positions[window_index]]
+            close_sample = close_samples[last_positions[window_index]]
+            if close_sample >= len(sampled_frames):
+                # Still open when the video ended
+                continue
+            count = int(confidence_count[window_index])
+            windows.append(Window(
+                object_id=int(object_id),
+                start_frame=int(sampled_frames[first_sample]),
+                end_frame=int(sampled_frames[close_sample]),
+                last_valid_frame=int(sampled_frames[last_sample]),
+                frame_count=int(last_positions[window_index] - first_positions[window_index] + 1),
+                window_length=int(close_sample - first_sample + 1),
+                avg_confidence=confidence_sum[window_index] / max(count, 1),
+                median_confidence=histogram_median(histograms[window_index], count),
+                peak_confidence=float(confidence_peak[window_index]),
+            ))
+
+    windows.sort(key=lambda window: (window.end_frame, object_order[window.object_id]))
+    return windows
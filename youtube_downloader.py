@@ -1,12 +1,13 @@
 import yt_dlp as youtube_dl
 import os
-import json
+import clip_fetcher
+from settings import config
 
-# Load configuration from config.json
-with open('config.json', 'r') as config_file:
-    config = json.load(config_file)
 
 desired_quality = config["youtube_downloader"]["DESIRED_QUALITY"]
+# Quality of the download inference runs on, the clips are then downloaded at desired_quality. None downloads
+# the whole video at desired_quality
+analysis_quality = config["youtube_downloader"].get("ANALYSIS_QUALITY")
 
 # Define video quality format codes
 quality_codes = {
@@ -14,10 +15,14 @@ quality_codes = {
     "1080p": "137",  # 1080p video
     "720p": "136",   # 720p video
     "480p": "135",   # 480p video
-    "360p": "134"    # 360p video
+    "360p": "134",   # 360p video
+    "240p": "133",   # 240p video
+    "144p": "160"    # 144p video
 }
 
 format_code = quality_codes.get(desired_quality, "best")
+# DASH fragments fetched at once for each video
+concurrent_fragments = config["processor"].get("CONCURRENT_FRAGMENTS", 1)
 
 def download_video(link):
     outtmpl = 'videos/%(title)s.%(ext)s'
@@ -27,14 +32,34 @@ def download_video(link):
     # Define youtube_dl options
     ydl_opts = {
         'quiet': True,
-        'format': format_code,
+        'format': quality_codes.get(analysis_quality, "worst") if analysis_quality else format_code,
         'outtmpl': outtmpl,
+        'concurrent_fragment_downloads': concurrent_fragments,
     }
 
     with youtube_dl.YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(link, download=True)
         filename = ydl.prepare_filename(info)
-        return filename
+    if analysis_quality:
+        clip_fetcher.register(filename, lambda start, end, part_path: download_section(link, start, end, part_path))
+    return filename
+
+def download_section(link, start, end, output_path):
+    # One clip of the two-resolution workflow, cut from the video at the desired quality
+    ydl_opts = {
+        'quiet': True,
+        'format': format_code,
+        'outtmpl': output_path,
+        'download_ranges': youtube_dl.utils.download_range_func(None, [(start, end)]),
+        'concurrent_fragment_downloads': concurrent_fragments,
+    }
+    try:
+        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([link])
+    except Exception as e:
+        print(f"Error downloading {start:.1f}-{end:.1f}s of {link}: {e}")
+        return False
+    return True
 
 def get_latest_videos(channel_name, start=0, count=20):
     # Define youtube_dl options for extracting video details